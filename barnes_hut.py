@@ -0,0 +1,206 @@
+from functools import partial
+
+import numpy as np
+
+from gravity import DIMENSIONS, G, MIN_SEPARATION
+
+# Barnes-Hut gravity, an octree is rebuilt over the body positions every step and groups of
+# bodies that are far enough away are replaced by their total mass at their centre of mass
+# A flat system only ever fills the lower four children of a node, so it costs the same as a quadtree
+
+# Opening angle, a node of width s whose centre of mass is a distance d away counts as one
+# mass when s / d < theta. 0 gives the exact answer, bigger is faster and less accurate
+THETA = 0.5
+# Levels in the tree, the Morton key uses 3 bits per level so it has to fit in 64 bits
+MAX_DEPTH = 21
+# Targets walked down the tree at once, bounds the memory used by the traversal
+TRAVERSAL_BATCH = 4096
+
+
+def _spread_bits(v):
+    # Put two zeros between every bit of the low 21 bits of v so the x, y and z bits can be
+    # interleaved into one key
+    v = v.astype(np.uint64) & np.uint64(0x1FFFFF)
+    v = (v | (v << np.uint64(32))) & np.uint64(0x001F00000000FFFF)
+    v = (v | (v << np.uint64(16))) & np.uint64(0x001F0000FF0000FF)
+    v = (v | (v << np.uint64(8))) & np.uint64(0x100F00F00F00F00F)
+    v = (v | (v << np.uint64(4))) & np.uint64(0x10C30C30C30C30C3)
+    v = (v | (v << np.uint64(2))) & np.uint64(0x1249249249249249)
+    return v
+
+
+def _expand(parents, first, counts):
+    # For every parent repeat it once per child and list the child indices first .. first + count
+    repeated = np.repeat(parents, counts)
+    offsets = np.arange(len(repeated)) - np.repeat(np.cumsum(counts) - counts, counts)
+    return repeated, np.repeat(first, counts) + offsets
+
+
+class octree:
+    # Nodes are stored level by level in flat arrays, the children of a node are next to each other
+    # Every node covers a run start .. start + count of the bodies sorted by Morton key
+    def __init__(self, positions, masses, max_depth=MAX_DEPTH):
+        n = len(masses)
+        lo = positions.min(axis=0) if n else np.zeros(DIMENSIONS)
+        side = (positions.max(axis=0) - lo).max() if n else 0.0
+        if side <= 0:
+            side = 1.0
+        cells = 2 ** max_depth
+        q = np.clip(np.floor((positions - lo) / side * cells), 0, cells - 1).astype(np.uint64)
+        keys = (_spread_bits(q[:, 0]) | (_spread_bits(q[:, 1]) << np.uint64(1))
+                | (_spread_bits(q[:, 2]) << np.uint64(2)))
+        self.order = np.argsort(keys, kind='stable')
+        keys = keys[self.order]
+        q = q[self.order]
+        self.sorted_positions = positions[self.order]
+        self.sorted_masses = masses[self.order]
+        weighted = self.sorted_positions * self.sorted_masses[:, np.newaxis]
+
+        levels = []
+        previous = None
+        for level in range(max_depth + 1):
+            if n == 0:
+                break
+            prefix = keys >> np.uint64(DIMENSIONS * (max_depth - level))
+            starts = np.flatnonzero(np.r_[True, prefix[1:] != prefix[:-1]])
+            counts = np.diff(np.r_[starts, n])
+            mass = np.add.reduceat(self.sorted_masses, starts)
+            weighted_sum = np.add.reduceat(weighted, starts, axis=0)
+            if previous is None:
+                keep = np.ones(len(starts), dtype=bool)
+                parent = np.full(len(starts), -1)
+            else:
+                # Only split nodes that held more than one body on the level above
+                segment = np.searchsorted(previous["starts"], starts, side='right') - 1
+                keep = previous["counts"][segment] > 1
+                parent = previous["node_id"][segment[keep]]
+            offset = sum(len(kept["start"]) for kept in levels)
+            node_id = np.full(len(starts), -1)
+            node_id[keep] = offset + np.arange(np.count_nonzero(keep))
+            cell = side / 2 ** level
+            corner = lo + (q[starts[keep]] >> np.uint64(max_depth - level)).astype(float) * cell
+            levels.append({"start": starts[keep], "count": counts[keep], "mass": mass[keep],
+                           "weighted": weighted_sum[keep], "parent": parent,
+                           "center": corner + cell / 2, "half": np.full(np.count_nonzero(keep), cell / 2),
+                           "leaf": (counts[keep] == 1) | (level == max_depth)})
+            previous = {"starts": starts, "counts": counts, "node_id": node_id}
+            if not np.any(counts[keep] > 1):
+                break
+
+        def join(name, shape):
+            return np.concatenate([level[name] for level in levels]) if levels else np.zeros(shape)
+
+        self.start = join("start", 0).astype(np.intp)
+        self.count = join("count", 0).astype(np.intp)
+        self.mass = join("mass", 0)
+        self.center = join("center", (0, DIMENSIONS))
+        self.half_size = join("half", 0)
+        self.leaf = join("leaf", 0).astype(bool)
+        parent = join("parent", 0).astype(np.intp)
+
+        # Centre of mass, massless nodes use the middle of their box
+        self.com = self.center.copy()
+        has_mass = self.mass > 0
+        self.com[has_mass] = join("weighted", (0, DIMENSIONS))[has_mass] / self.mass[has_mass, np.newaxis]
+        # A leaf with one body uses its exact position so the body sees no force from itself
+        single = self.count == 1
+        self.com[single] = self.sorted_positions[self.start[single]]
+
+        # Children are contiguous, so each node only needs its first child and how many there are
+        self.child_start = np.full(len(self.start), -1, dtype=np.intp)
+        self.child_count = np.zeros(len(self.start), dtype=np.intp)
+        children = np.flatnonzero(parent >= 0)
+        if len(children):
+            first = children[np.r_[True, parent[children][1:] != parent[children][:-1]]]
+            self.child_start[parent[first]] = first
+            self.child_count = np.bincount(parent[children], minlength=len(self.start))
+
+    def accelerations(self, targets, theta=THETA, out=None, softening=0.0, potential=None):
+        # potential, when given, is filled with Phi at every target from the same tree walk
+        if out is None:
+            out = np.empty((len(targets), DIMENSIONS), dtype=float)
+        for start in range(0, len(targets), TRAVERSAL_BATCH):
+            stop = min(start + TRAVERSAL_BATCH, len(targets))
+            out[start:stop] = self._walk(targets[start:stop], theta, softening,
+                                         None if potential is None else potential[start:stop])
+        return out
+
+    def _walk(self, targets, theta, softening, potential=None):
+        # Every (target, node) pair on the frontier is either used as one mass or opened into its children
+        n = len(targets)
+        acceleration = np.zeros((n, DIMENSIONS), dtype=float)
+        if potential is not None:
+            potential[:] = 0.0
+        if len(self.start) == 0:
+            return acceleration
+        target = np.arange(n)
+        node = np.zeros(n, dtype=np.intp)
+
+        def add(target, source_positions, source_masses):
+            d = source_positions - targets[target]
+            squared = np.einsum('ij,ij->i', d, d)
+            distance = np.maximum(np.sqrt(squared + softening * softening), MIN_SEPARATION)
+            weight = source_masses / (distance * distance * distance)
+            for axis in range(DIMENSIONS):
+                acceleration[:, axis] += np.bincount(target, weight * d[:, axis], minlength=n)
+            if potential is not None:
+                # A body adds nothing to the potential at its own position
+                potential[:] -= G * np.bincount(target, np.where(squared == 0, 0.0, source_masses / distance),
+                                                minlength=n)
+
+        while len(target):
+            p = targets[target]
+            d = self.com[node] - p
+            distance = np.sqrt(np.einsum('ij,ij->i', d, d))
+            half = self.half_size[node]
+            # Never use a node as one mass if the target is inside it, or it would pull on itself
+            inside = np.all(np.abs(p - self.center[node]) <= half[:, np.newaxis], axis=1)
+            far = (2 * half < theta * distance) & ~inside
+            use = far | (self.count[node] == 1)
+            add(target[use], self.com[node[use]], self.mass[node[use]])
+
+            # Leaves at the deepest level can still hold several bodies, those are summed body by body
+            multi = ~use & self.leaf[node]
+            if multi.any():
+                pair_target, body = _expand(target[multi], self.start[node[multi]], self.count[node[multi]])
+                add(pair_target, self.sorted_positions[body], self.sorted_masses[body])
+
+            opened = ~use & ~self.leaf[node]
+            target, node = _expand(target[opened], self.child_start[node[opened]], self.child_count[node[opened]])
+        return G * acceleration
+
+
+def barnes_hut_gravity(positions, masses, theta=THETA, out=None, targets=None, softening=0.0, potential=None):
+    # Rebuild the tree for this step and find the acceleration of every body, or of the targets
+    if targets is None:
+        targets = positions
+    return octree(positions, masses).accelerations(targets, theta, out=out, softening=softening,
+                                                     potential=potential)
+
+
+def accuracy_report(name, positions, masses, thetas=(0.3, 0.5, 0.7, 1.0), sample=2000, repeats=3):
+    # Compare against the exact kernel at every theta
+    # Imported here, benchmark needs physics which imports this module
+    from benchmark import accuracy_report as solver_report
+    solvers = [(theta, partial(barnes_hut_gravity, positions, masses, theta)) for theta in thetas]
+    return solver_report(name, positions, masses, solvers, "theta", "Barnes-Hut ms", sample=sample, repeats=repeats)
+
+
+def random_cloud(n, seed=0):
+    # A flat disc of similar mass bodies, 1e12 m across
+    rng = np.random.default_rng(seed)
+    radius = 5e11 * np.sqrt(rng.random(n))
+    angle = rng.random(n) * 2 * np.pi
+    positions = np.column_stack((radius * np.cos(angle), radius * np.sin(angle), np.zeros(n)))
+    masses = rng.uniform(1e22, 1e24, n)
+    return positions, masses
+
+
+if __name__ == '__main__':
+    # Imported here, systems needs physics which imports this module
+    from systems import load_system
+    system_4 = load_system("system4")
+    print(accuracy_report("System 4", system_4.positions, system_4.masses))
+    for n in (1000, 10000, 100000):
+        print()
+        print(accuracy_report("Random cloud", *random_cloud(n)))
@@ -0,0 +1,330 @@
+import argparse
+import json
+import os
+import platform
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+
+import physics
+from barnes_hut import random_cloud
+from gravity import G, gravity_kernel
+from gravity_jit import JIT_AVAILABLE, jit_gravity
+from physics import calculate_gravity, system, update_bodies
+from systems import load_system
+
+# Times the force kernels (NumPy, Numba when it is installed, Barnes-Hut and particle-mesh), a step
+# of the integrator and the drawing for the built in systems and for random clouds of 10 to 100000 bodies,
+# with no window. Every result can be saved as a JSON baseline and a later run compared against it,
+# so a change that slows something down shows up
+# python benchmark.py --save before.json
+# python benchmark.py --compare before.json
+# python benchmark.py --compare before.json after.json
+
+# Bodies in the random clouds
+CLOUD_SIZES = [10, 100, 1000, 10000, 100000]
+# Built in systems that are timed as they are
+SYSTEMS = ["system1", "system2", "system3", "system4"]
+# Each case is called again until this many seconds have gone, its fastest call counts
+MIN_TIME = 0.5
+# Seconds per step of the step cases, for the systems and for the clouds
+SYSTEM_DT = 1800
+CLOUD_DT = 86400
+# A case slower than its baseline by more than this share counts as a regression
+TOLERANCE = 0.25
+# The drawing cases need the window code, it is drawn to a Surface instead of the screen
+RENDER_CASES = ["potential_arrows", "potential_field", "trails", "draw"]
+# Most bodies each case is run with unless --full is given, past these the N squared cases (an arrow
+# for every pair of bodies in potential_arrows) and the trails (TRAIL_LENGTH points a body) take
+# minutes or gigabytes
+LARGEST = {"gravity": 20000, "gravity_jit": 30000, "gravity_barnes_hut": None, "gravity_particle_mesh": None,
+           "gravity_compensated": 10000, "step": 20000, "step_barnes_hut": None, "step_particle_mesh": None,
+           "step_compensated": 10000, "potential_arrows": 300,
+           "potential_field": 20000, "trails": 10000, "draw": None}
+CASES = list(LARGEST)
+
+
+def cloud_system(n, seed=0):
+    # The random cloud of barnes_hut.py, each body given the circular speed for the mass inside
+    # its radius so the disc turns instead of falling in
+    positions, masses = random_cloud(n, seed)
+    radius = np.hypot(positions[:, 0], positions[:, 1])
+    order = np.argsort(radius)
+    inside = np.empty(n)
+    inside[order] = np.cumsum(masses[order])
+    distance = np.maximum(radius, 1.0)
+    speed = np.sqrt(G * inside / distance)
+    velocities = np.column_stack((-positions[:, 1], positions[:, 0])) * (speed / distance)[:, np.newaxis]
+    return system.from_arrays([f'Body {k}' for k in range(n)], masses, positions, velocities,
+                              np.full(n, 2.0), np.zeros(n))
+
+
+def workloads(sizes, systems):
+    # (name, a function that makes the bodies, dt) of every workload
+    for name in systems:
+        yield name, lambda name=name: load_system(name), SYSTEM_DT
+    for n in sizes:
+        yield f'cloud {n}', lambda n=n: cloud_system(n), CLOUD_DT
+
+
+def energy(bodies):
+    # With the selected solver, from the potential it works out alongside the accelerations
+    kinetic = 0.5 * float(np.dot(bodies.masses, np.einsum('ij,ij->i', bodies.velocities, bodies.velocities)))
+    return kinetic + physics.potential_energy(bodies)
+
+
+def time_calls(function, min_time):
+    # Fastest of as many calls as fit in min_time, at least one
+    calls, best, begin = 0, float('inf'), time.perf_counter()
+    while calls == 0 or time.perf_counter() - begin < min_time:
+        start = time.perf_counter()
+        function()
+        best = min(best, time.perf_counter() - start)
+        calls += 1
+    return best, calls
+
+
+def best_of(function, repeats):
+    # Fastest of repeats calls and what the last one returned, for the accuracy reports
+    best = float('inf')
+    for _ in range(repeats):
+        begin = time.perf_counter()
+        result = function()
+        best = min(best, time.perf_counter() - begin)
+    return best, result
+
+
+def accuracy_report(name, positions, masses, solvers, label, time_label="ms", with_rms=False, sample=2000,
+                    repeats=3):
+    # A table of approximate solvers, (label value, function) pairs, against the exact kernel, for
+    # barnes_hut.py and particle_mesh.py. For big N only a random sample of bodies is checked exactly
+    # and the exact time is scaled up from the sample (marked with ~)
+    n = len(masses)
+    rng = np.random.default_rng(0)
+    checked = np.sort(rng.choice(n, sample, replace=False)) if n > sample else np.arange(n)
+    exact_time, exact = best_of(lambda: gravity_kernel(positions, masses, targets=positions[checked]), repeats)
+    estimated = len(checked) < n
+    exact_time *= n / len(checked)
+    exact_size = np.linalg.norm(exact, axis=1)
+    columns = [label, "median rel. error", "max rel. error"] + (["rms error / rms accel."] if with_rms else [])
+    columns += [time_label, "speed-up"]
+    lines = [f'{name}: N = {n}, exact {"~" if estimated else ""}{exact_time * 1e3:.2f} ms',
+             '| ' + ' | '.join(columns) + ' |', '|' + '---|' * len(columns)]
+    for value, solver in solvers:
+        solver_time, approx = best_of(solver, repeats)
+        difference = np.linalg.norm(approx[checked] - exact, axis=1)
+        error = difference / np.maximum(exact_size, 1e-300)
+        cells = [value, f'{np.median(error):.2e}', f'{error.max():.2e}']
+        if with_rms:
+            # Over all the checked bodies together, where the bodies with the least pull count least
+            cells.append(f'{np.sqrt(np.mean(difference ** 2) / max(np.mean(exact_size ** 2), 1e-300)):.2e}')
+        cells += [f'{solver_time * 1e3:.2f}', f'{exact_time / solver_time:.2f}x']
+        lines.append('| ' + ' | '.join(str(cell) for cell in cells) + ' |')
+    return "\n".join(lines)
+
+
+def peak_memory(function):
+    # Most bytes allocated at once while function runs, NumPy arrays included
+    tracemalloc.start()
+    try:
+        function()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+class renderer:
+    # The drawing functions of main.py pointed at an offscreen Surface, with the view fitted to the bodies
+    def __init__(self):
+        os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+        import main
+        self.main = main
+        main.scene = main.pygame.Surface((main.screen_width, main.screen_height))
+        main.trajectories_on = True
+        main.paused = True
+
+    def fit(self, bodies):
+        main = self.main
+        extent = np.abs(bodies.positions).max(initial=0.0)
+        main.pixel_scale = 0.45 * min(main.screen_width, main.screen_height) / extent if extent else 0.5e-6
+        main.CenterX, main.CenterY = main.screen_width // 2, main.screen_height // 2
+        main.trails.clear()
+        main.field.log_phi = None
+
+    def case(self, name, bodies, dt):
+        main = self.main
+        if name == "potential_arrows":
+            return lambda: main.calculate_gravitational_potential(bodies, "arrows")
+        if name == "potential_field":
+            def redraw():
+                # Worked out again every call, as it is after every move of the view
+                main.field.log_phi = None
+                main.draw_potential_field(bodies, "field and contours")
+            return redraw
+        if name == "trails":
+            # Full trails along each body's current heading
+            for k in range(main.TRAIL_LENGTH):
+                main.trails.push(bodies.positions + bodies.velocities * (k * dt))
+            return lambda: main.DrawTrajectories(bodies)
+
+        def draw():
+            main.scene.fill(main.BLACK)
+            body_xy, shown, picker = main.visible_bodies(bodies)
+            main.draw_body(bodies, shown)
+            main.name_bodies(bodies, body_xy, shown)
+        return draw
+
+
+def run_case(name, bodies, dt, min_time, render=None):
+    # One result row, the time of one call and what it says about the case
+    n = len(bodies)
+    physics.use_barnes_hut = name.endswith("barnes_hut")
+    physics.use_particle_mesh = name.endswith("particle_mesh")
+    physics.precision = "compensated" if name.endswith("compensated") else "standard"
+    physics.integrator = type(physics.integrator)()
+    # A potential left by another case could be for the same starting positions but another solver
+    physics.last_potential = None
+    result = {"case": name, "bodies": n}
+    if name.startswith("gravity"):
+        if name == "gravity":
+            function = lambda: calculate_gravity(bodies)
+        elif name == "gravity_jit":
+            function = lambda: jit_gravity(bodies.positions, bodies.masses, out=bodies.accelerations)
+        else:
+            function = lambda: physics.calculate_accelerations(bodies.positions, bodies.masses, out=bodies.accelerations)
+        interactions = n * n
+    elif name.startswith("step"):
+        physics.barycentric_frame(bodies)
+        energy_start = energy(bodies)
+        function = lambda: update_bodies(bodies, dt)
+        interactions = n * n * physics.integrator.evaluations_per_step
+    else:
+        render.fit(bodies)
+        function = render.case(name, bodies, dt)
+        interactions = None
+    result["peak_bytes"] = peak_memory(function)
+    seconds, calls = time_calls(function, min_time)
+    result.update({"seconds": seconds, "per_second": 1 / seconds if seconds else float('inf'), "calls": calls,
+                   "ns_per_interaction": seconds * 1e9 / interactions if interactions else None})
+    if name.startswith("step"):
+        # Over every step taken above, the calls are saved with it
+        energy_end = energy(bodies)
+        result["energy_error"] = abs((energy_end - energy_start) / energy_start) if energy_start else 0.0
+    physics.use_barnes_hut = False
+    physics.use_particle_mesh = False
+    physics.precision = "standard"
+    return result
+
+
+def run_benchmarks(sizes=CLOUD_SIZES, systems=SYSTEMS, cases=CASES, min_time=MIN_TIME, full=False, log=None):
+    if not JIT_AVAILABLE:
+        cases = [name for name in cases if name != "gravity_jit"]
+    render = None
+    if any(name in RENDER_CASES for name in cases):
+        try:
+            render = renderer()
+        except (ImportError, FileNotFoundError) as error:
+            # No pygame, or no Images folder in the working directory
+            print(f'Drawing cases skipped, the window code could not be loaded: {error}', file=sys.stderr)
+            cases = [name for name in cases if name not in RENDER_CASES]
+    results = []
+    for workload, make, dt in workloads(sizes, systems):
+        for name in cases:
+            bodies = make()
+            if not full and LARGEST[name] is not None and len(bodies) > LARGEST[name]:
+                continue
+            result = {"workload": workload, **run_case(name, bodies, dt, min_time, render)}
+            results.append(result)
+            if log is not None:
+                print(format_result(result), file=log, flush=True)
+    return results
+
+
+def machine():
+    return {"python": platform.python_version(), "numpy": np.__version__, "backend": physics.backend,
+            "platform": platform.platform(),
+            "processor": platform.processor() or platform.machine(), "cpus": os.cpu_count(),
+            "date": time.strftime('%Y-%m-%d %H:%M:%S')}
+
+
+def format_result(result):
+    text = f'{result["workload"]:>12} {result["case"]:<20} {result["seconds"] * 1e3:>11.3f} ms' \
+           f' {result["per_second"]:>11.1f}/s {result["peak_bytes"] / 2 ** 20:>9.1f} MiB'
+    if result.get("ns_per_interaction") is not None:
+        text += f' {result["ns_per_interaction"]:>9.2f} ns/pair'
+    if result.get("energy_error") is not None:
+        text += f'  energy error {result["energy_error"]:.1e}'
+    return text
+
+
+def compare(old, new, tolerance=TOLERANCE):
+    # Lines comparing every case both runs have, and whether any got slower than the tolerance
+    before = {(result["workload"], result["case"]): result for result in old["results"]}
+    lines = []
+    regressed = False
+    for result in new["results"]:
+        key = (result["workload"], result["case"])
+        if key not in before:
+            continue
+        ratio = result["seconds"] / before[key]["seconds"]
+        verdict = ""
+        if ratio > 1 + tolerance:
+            verdict = "  SLOWER"
+            regressed = True
+        elif ratio < 1 / (1 + tolerance):
+            verdict = "  faster"
+        lines.append(f'{key[0]:>12} {key[1]:<20} {before[key]["seconds"] * 1e3:>11.3f} ms'
+                     f' -> {result["seconds"] * 1e3:>11.3f} ms  {ratio:>6.2f}x{verdict}')
+    return lines, regressed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Time the physics and the drawing over a range of body counts")
+    parser.add_argument("--sizes", default=",".join(map(str, CLOUD_SIZES)),
+                        help="bodies in the random clouds, comma separated")
+    parser.add_argument("--systems", default=",".join(SYSTEMS), help="built in systems, comma separated")
+    parser.add_argument("--cases", default=",".join(CASES), help="cases to run, of " + ", ".join(CASES))
+    parser.add_argument("--min-time", type=float, default=MIN_TIME, help="seconds each case is repeated for")
+    parser.add_argument("--backend", choices=physics.BACKENDS,
+                        help="what the exact gravity of the step cases runs on (default jit when Numba is installed)")
+    parser.add_argument("--full", action="store_true", help="run every case at every size, however long it takes")
+    parser.add_argument("--save", help="write the results as a JSON baseline")
+    parser.add_argument("--compare", nargs='+', metavar="BASELINE",
+                        help="compare this run with a baseline, or two baselines with each other")
+    parser.add_argument("--tolerance", type=float, default=TOLERANCE,
+                        help="share slower than the baseline that counts as a regression")
+    args = parser.parse_args(argv)
+
+    if args.compare and len(args.compare) > 2:
+        parser.error("--compare takes one or two baselines")
+    if args.compare and len(args.compare) == 2:
+        with open(args.compare[1]) as file:
+            new = json.load(file)
+    else:
+        cases = [name for name in args.cases.split(',') if name]
+        unknown = [name for name in cases if name not in CASES]
+        if unknown:
+            parser.error(f'unknown case {", ".join(unknown)}, pick from {", ".join(CASES)}')
+        if args.backend is not None:
+            physics.backend = args.backend
+        sizes = [int(size) for size in args.sizes.split(',') if size]
+        systems = [name for name in args.systems.split(',') if name]
+        new = {"machine": machine(),
+               "results": run_benchmarks(sizes, systems, cases, args.min_time, args.full, log=sys.stdout)}
+        if args.save:
+            with open(args.save, 'w') as file:
+                json.dump(new, file, indent=1)
+    if args.compare:
+        with open(args.compare[0]) as file:
+            old = json.load(file)
+        lines, regressed = compare(old, new, args.tolerance)
+        print(f'Compared with {args.compare[0]} ({old["machine"]["date"]})')
+        print("\n".join(lines))
+        if regressed:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,54 @@
+import numpy as np
+
+# How the (x, y, z) positions are put on the flat screen, a turn about the z axis and a tilt away
+# from looking straight down it, then the depth is dropped. With no turn and no tilt the screen x
+# and y are the world x and y, so flat systems look as they always have
+# Every projection is one (N, 3) by (3, 2) matrix product, whatever the number of points
+# No pygame here, main.py keeps the scale and the centre of the view
+
+# Views the v key cycles through as (turn, tilt) in degrees: top-down, oblique and edge-on
+CAMERA_VIEWS = [(0.0, 0.0), (30.0, 60.0), (0.0, 90.0)]
+# Degrees each press of the turn and tilt keys moves the view by
+CAMERA_STEP = 15.0
+
+
+class camera:
+    def __init__(self, turn=0.0, tilt=0.0):
+        # turn is about the z axis, tilt 0 looks down the z axis and 90 along the x-y plane with +z up
+        self.turn = turn
+        self.tilt = tilt
+
+    @property
+    def angles(self):
+        return self.turn, self.tilt
+
+    @property
+    def axes(self):
+        # (2, 3), the world directions that point right and down on the screen
+        turn, tilt = np.radians(self.turn), np.radians(self.tilt)
+        return np.array([[np.cos(turn), np.sin(turn), 0.0],
+                         [-np.sin(turn) * np.cos(tilt), np.cos(turn) * np.cos(tilt), -np.sin(tilt)]])
+
+    def rotate(self, turn=0.0, tilt=0.0):
+        # Tilting stops at straight down and edge-on, turning goes all the way round
+        self.turn = (self.turn + turn) % 360.0
+        self.tilt = min(max(self.tilt + tilt, 0.0), 90.0)
+
+    def project(self, points, scale, center, dtype=float):
+        # Screen positions of (..., 3) points, worked out in dtype so float32 particles stay float32
+        matrix = (self.axes.T * scale).astype(dtype)
+        return points @ matrix + np.asarray(center, dtype=dtype)
+
+    def project_box(self, low, high, scale, center):
+        # Screen corners of the boxes from low to high, every box drawn lies inside its corners
+        middle = self.project((low + high) / 2, scale, center)
+        reach = (high - low) / 2 @ np.abs(self.axes.T * scale)
+        return middle - reach, middle + reach
+
+    def unproject(self, screen_xy, scale, center):
+        # Points of the plane through the world origin that faces the screen, at the (N, 2) screen positions
+        return (np.asarray(screen_xy, dtype=float) - center) / scale @ self.axes
+
+    def in_view_plane(self, right, down):
+        # (x, y, z) of a vector that points right and down by these amounts on the screen
+        return np.array([right, down]) @ self.axes
@@ -0,0 +1,99 @@
+import numpy as np
+
+# Collisions between bodies with a physical size. Pairs are found with a sort and sweep along x,
+# so only bodies whose paths overlap in x are tested against each other, close to linear in N
+# No pygame here, physics.update_bodies calls these after every step
+
+# Share of the closing speed kept after a bounce, 1 is perfectly elastic
+RESTITUTION = 1.0
+
+
+def contact_pairs(positions, velocities, radii, dt):
+    # Pairs i, j whose spheres touched at some point in the last step of dt, taking each body
+    # to have moved in a straight line so fast bodies can not pass through each other unseen
+    # Returns i, j and the fraction of the step at which they were closest, earliest first
+    n = len(positions)
+    empty = np.zeros(0, dtype=int)
+    if n < 2:
+        return empty, empty, np.zeros(0)
+    # Broad phase, each body covers the x range it swept through plus its radius
+    previous_x = positions[:, 0] - velocities[:, 0] * dt
+    low = np.minimum(previous_x, positions[:, 0]) - radii
+    high = np.maximum(previous_x, positions[:, 0]) + radii
+    order = np.argsort(low, kind='stable')
+    low, high = low[order], high[order]
+    # Every body after k in the sorted order that starts before k ends overlaps it in x
+    counts = np.maximum(np.searchsorted(low, high, side='right') - np.arange(n) - 1, 0)
+    first = np.repeat(np.arange(n), counts)
+    second = first + 1 + np.arange(len(first)) - np.repeat(np.cumsum(counts) - counts, counts)
+    i, j = order[first], order[second]
+
+    # Narrow phase, closest distance between the two straight line paths over the step
+    separation = positions[j] - positions[i]
+    moved = (velocities[j] - velocities[i]) * dt
+    start = separation - moved
+    moved_squared = np.einsum('ij,ij->i', moved, moved)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        when = np.clip(-np.einsum('ij,ij->i', start, moved) / moved_squared, 0.0, 1.0)
+    when[moved_squared == 0] = 1.0
+    closest = start + moved * when[:, np.newaxis]
+    touching = np.einsum('ij,ij->i', closest, closest) < (radii[i] + radii[j]) ** 2
+    i, j, when = i[touching], j[touching], when[touching]
+    earliest = np.argsort(when, kind='stable')
+    return i[earliest], j[earliest], when[earliest]
+
+
+def merge(state, i, j):
+    # The lighter body of each pair is absorbed into the heavier one, keeping the mass, momentum
+    # and volume of the two. Bodies already absorbed earlier in the list are skipped
+    # Returns which bodies were absorbed, the caller removes them
+    # Rows that are written over lose the rounding the compensated precision mode kept for them
+    absorbed = np.zeros(len(state.masses), dtype=bool)
+    for a, b in zip(i.tolist(), j.tolist()):
+        if absorbed[a] or absorbed[b]:
+            continue
+        keep, lose = (a, b) if state.masses[a] >= state.masses[b] else (b, a)
+        mass = state.masses[keep] + state.masses[lose]
+        if mass > 0:
+            share = state.masses[lose] / mass
+            state.positions[keep] += (state.positions[lose] - state.positions[keep]) * share
+            state.velocities[keep] += (state.velocities[lose] - state.velocities[keep]) * share
+            state.position_errors[keep] = 0.0
+            state.velocity_errors[keep] = 0.0
+        state.masses[keep] = mass
+        state.physical_radii[keep] = np.cbrt(state.physical_radii[keep] ** 3 + state.physical_radii[lose] ** 3)
+        absorbed[lose] = True
+    return absorbed
+
+
+def bounce(state, i, j, when, dt, restitution=RESTITUTION):
+    # Each pair is moved back to where it touched, given equal and opposite impulses along the
+    # line between the centres, then moved on for the rest of the step and pushed apart if they
+    # still overlap. Pairs are done one at a time so a body in two contacts gets both
+    for a, b, s in zip(i.tolist(), j.tolist(), when.tolist()):
+        remaining = (1.0 - s) * dt
+        p_a = state.positions[a] - state.velocities[a] * remaining
+        p_b = state.positions[b] - state.velocities[b] * remaining
+        normal = p_b - p_a
+        distance = np.linalg.norm(normal)
+        if distance == 0:
+            continue
+        normal /= distance
+        inverse_a = 1 / state.masses[a] if state.masses[a] > 0 else 0.0
+        inverse_b = 1 / state.masses[b] if state.masses[b] > 0 else 0.0
+        closing = np.dot(state.velocities[b] - state.velocities[a], normal)
+        if closing < 0 and inverse_a + inverse_b > 0:
+            impulse = -(1 + restitution) * closing / (inverse_a + inverse_b)
+            state.velocities[a] -= impulse * inverse_a * normal
+            state.velocities[b] += impulse * inverse_b * normal
+            state.velocity_errors[[a, b]] = 0.0
+        state.positions[a] = p_a + state.velocities[a] * remaining
+        state.positions[b] = p_b + state.velocities[b] * remaining
+        state.position_errors[[a, b]] = 0.0
+        # Push apart so they just touch, the heavier body moves less
+        gap = state.positions[b] - state.positions[a]
+        overlap = state.physical_radii[a] + state.physical_radii[b] - np.linalg.norm(gap)
+        if overlap > 0 and inverse_a + inverse_b > 0:
+            direction = gap / np.linalg.norm(gap) if np.any(gap) else normal
+            state.positions[a] -= direction * overlap * inverse_a / (inverse_a + inverse_b)
+            state.positions[b] += direction * overlap * inverse_b / (inverse_a + inverse_b)
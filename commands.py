@@ -0,0 +1,164 @@
+import json
+import math
+from collections import deque
+
+# Input for the window as a queue of commands. Key presses and clicks are queued as they come in and
+# carried out together at the start of the next frame, so a slow frame delays them but never loses one
+# A command is a name and its arguments, e.g. ("zoom_in",) or ("click", 650, 400), so a run's commands
+# can be written to a log, one JSON list [frame, name, args...] a line, and played back frame for frame
+# No pygame here, keys are known by their pygame.key.name, main.py turns the events into commands
+
+# What each key does, by pygame key name
+KEY_COMMANDS = {
+    ";": "show_input", "'": "hide_input", "left shift": "shift_down", "\\": "toggle_trails",
+    ".": "cycle_potential", "]": "warp_faster", "[": "warp_slower", "/": "warp_reset", "home": "replay_start",
+    "end": "replay_end", "b": "cycle_solver", "j": "toggle_backend", "k": "toggle_precision",
+    ",": "cycle_accuracy",
+    "i": "cycle_integrator", "c": "cycle_collisions", "s": "cycle_softening", "t": "toggle_thread",
+    "r": "toggle_recording", "o": "cycle_prediction", "p": "toggle_profile", "d": "toggle_diagnostics",
+    "y": "toggle_replay", "f5": "save_checkpoint", "f9": "load_checkpoint", "tab": "reset_view",
+    "up": "pan_up", "down": "pan_down", "left": "pan_left", "right": "pan_right", "=": "zoom_in",
+    "-": "zoom_out", "v": "cycle_view", "q": "turn_left", "e": "turn_right", "page up": "tilt_up",
+    "page down": "tilt_down", "return": "create_body", "enter": "create_body",
+}
+# What letting go of a key does
+KEY_RELEASE_COMMANDS = {"left shift": "shift_up"}
+# Keys that do something else while an input box has the focus, any other key that types a
+# character types it into the box
+TYPING_COMMANDS = {"backspace": "erase", "escape": "unfocus"}
+# Keys that repeat while held, pan, zoom, turn, tilt and deleting, the toggles never repeat
+REPEATING_KEYS = {"up", "down", "left", "right", "=", "-", "q", "e", "page up", "page down", "backspace"}
+# Seconds a key is held before it starts repeating, and between repeats
+KEY_REPEAT_DELAY = 0.4
+KEY_REPEAT_INTERVAL = 0.05
+# Most repeats of one key a frame, so a long stall does not fling the view away when it ends
+KEY_REPEAT_LIMIT = 8
+# The new body input boxes in order, and what each has to hold
+BODY_FIELDS = [("mass", "a positive number"), ("velocity", "a number"), ("radius", "a number"),
+               ("size", "a whole number of pixels above 0"), ("name", "some text")]
+
+
+def key_command(name, text, typing):
+    # The command a key press makes, text is the character it types and typing is whether an input
+    # box has the focus. None when the key does nothing
+    if typing:
+        if name in TYPING_COMMANDS:
+            return (TYPING_COMMANDS[name],)
+        if text and text.isprintable():
+            return ("type", text)
+    command = KEY_COMMANDS.get(name)
+    return None if command is None else (command,)
+
+
+def parse_number(text):
+    # A finite number or None, for input boxes that can hold anything typed into them
+    try:
+        value = float(text)
+    except ValueError:
+        return None
+    return value if math.isfinite(value) else None
+
+
+def parse_body_fields(texts):
+    # The values of the new body input boxes as (mass, velocity, radius, size, name), or None and
+    # (box, message) for the first box that does not hold what it should
+    mass, velocity, radius = (parse_number(text) for text in texts[:3])
+    size = int(texts[3]) if texts[3].strip().isdigit() else 0
+    name = texts[4].strip()
+    for box, good in enumerate([mass is not None and mass > 0, velocity is not None, radius is not None,
+                                size > 0, name != ""]):
+        if not good:
+            field, needs = BODY_FIELDS[box]
+            return None, (box, f'{field.capitalize()} needs {needs}')
+    return (mass, velocity, radius, size, name), None
+
+
+class command_queue:
+    # Commands waiting for the start of the next frame, in the order they came in
+    def __init__(self):
+        self._pending = deque()
+
+    def __len__(self):
+        return len(self._pending)
+
+    def push(self, name, *args):
+        self._pending.append((name, *args))
+
+    def drain(self):
+        # Every command queued so far, commands pushed while these are carried out wait for the next frame
+        drained = []
+        for _ in range(len(self._pending)):
+            drained.append(self._pending.popleft())
+        return drained
+
+
+class key_repeat:
+    # Presses made by the held keys in REPEATING_KEYS, worked out from the time so a slow frame gets
+    # every repeat it is owed instead of one
+    def __init__(self, delay=KEY_REPEAT_DELAY, interval=KEY_REPEAT_INTERVAL, limit=KEY_REPEAT_LIMIT):
+        self.delay = delay
+        self.interval = interval
+        self.limit = limit
+        # Held key name to [character it types, time of its next repeat]
+        self._held = {}
+
+    def __len__(self):
+        return len(self._held)
+
+    def press(self, name, text, now):
+        if name in REPEATING_KEYS:
+            self._held[name] = [text, now + self.delay]
+
+    def release(self, name):
+        self._held.pop(name, None)
+
+    def clear(self):
+        # A window that loses the focus never hears about the keys let go of meanwhile
+        self._held.clear()
+
+    def due(self, now):
+        # (name, text) of every repeat due by now
+        presses = []
+        for name, held in self._held.items():
+            count = 0
+            while held[1] <= now and count < self.limit:
+                presses.append((name, held[0]))
+                held[1] += self.interval
+                count += 1
+            if held[1] <= now:
+                # Over the limit, the rest are dropped
+                held[1] = now + self.interval
+        return presses
+
+
+class command_log:
+    # Writes every command carried out with the frame it was carried out in
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, 'w')
+
+    def write(self, frame, command):
+        self.file.write(json.dumps([frame, *command]) + '\n')
+
+    def close(self):
+        self.file.close()
+
+
+def read_command_log(path, known):
+    # The commands of a log by frame, known is every command name that can be carried out
+    # Blank lines and lines starting with # are skipped, so a script can be written by hand
+    frames = {}
+    with open(path) as file:
+        for number, line in enumerate(file, start=1):
+            if not line.strip() or line.lstrip().startswith('#'):
+                continue
+            try:
+                frame, name, *args = json.loads(line)
+            except (ValueError, TypeError):
+                raise ValueError(f'{path} line {number}: expected [frame, command, arguments...]')
+            if not isinstance(frame, int) or isinstance(frame, bool) or frame < 0:
+                raise ValueError(f'{path} line {number}: frame {json.dumps(frame)} is not a whole number')
+            if name not in known:
+                raise ValueError(f'{path} line {number}: unknown command "{name}"')
+            frames.setdefault(frame, []).append((name, *args))
+    return frames
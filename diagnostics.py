@@ -0,0 +1,132 @@
+import csv
+import json
+import math
+from collections import deque
+
+import numpy as np
+
+import physics
+
+# Conserved quantities of the system measured after every step, to see how far the integrator has
+# let them drift. The potential energy comes from the potential the gravity call of the step already
+# worked out, so measuring costs O(N) a step on top of the step itself
+# No pygame here, main.py shows the latest values and headless.py reports the final ones
+# .csv files get a header and a row a step, .ndjson or .jsonl files a JSON object a line
+
+# Steps the recent mean of each drift is taken over
+ROLLING_WINDOW = 100
+# Rows written between flushes of the file
+FLUSH_EVERY = 100
+# Default file for the d (diagnostics) key
+DIAGNOSTICS_PATH = 'diagnostics.csv'
+# Columns of every row, the errors are relative to the first measurement
+FIELDS = ["time", "bodies", "kinetic", "potential", "energy", "momentum_x", "momentum_y", "momentum_z",
+          "angular_momentum_x", "angular_momentum_y", "angular_momentum_z", "energy_error", "momentum_error",
+          "angular_momentum_error"]
+# Parts of the vectors
+MOMENTUM = ["momentum_x", "momentum_y", "momentum_z"]
+ANGULAR_MOMENTUM = ["angular_momentum_x", "angular_momentum_y", "angular_momentum_z"]
+DRIFTS = ["energy_error", "momentum_error", "angular_momentum_error"]
+
+
+class rolling:
+    # Mean, spread and worst value of one quantity since the start, kept with Welford's update so
+    # nothing but the last window of values is stored
+    def __init__(self, window=ROLLING_WINDOW):
+        self.count = 0
+        self.mean = 0.0
+        self._squares = 0.0
+        self.worst = 0.0
+        self.recent = deque(maxlen=window)
+
+    def add(self, value):
+        self.count += 1
+        change = value - self.mean
+        self.mean += change / self.count
+        self._squares += change * (value - self.mean)
+        self.worst = max(self.worst, abs(value))
+        self.recent.append(value)
+
+    @property
+    def spread(self):
+        return math.sqrt(self._squares / (self.count - 1)) if self.count > 1 else 0.0
+
+    @property
+    def recent_mean(self):
+        return sum(self.recent) / len(self.recent) if self.recent else 0.0
+
+
+class monitor:
+    def __init__(self, path=None, start_time=0.0, window=ROLLING_WINDOW):
+        self.path = path
+        self.time = start_time
+        # Row of the first and the latest measurement
+        self.first = None
+        self.latest = None
+        self.statistics = {name: rolling(window) for name in DRIFTS}
+        self._scales = None
+        self._rows = 0
+        self._file = None
+        self._writer = None
+        if path is not None:
+            self._file = open(path, 'w', newline='')
+            if not path.endswith(('.ndjson', '.jsonl')):
+                self._writer = csv.DictWriter(self._file, FIELDS)
+                self._writer.writeheader()
+
+    def measure(self, bodies, dt=0.0):
+        # Measure the state after a step of dt, a dt of 0 measures the starting state
+        self.time += dt
+        masses, positions, velocities = bodies.masses, bodies.positions, bodies.velocities
+        kinetic = 0.5 * float(np.dot(masses, np.einsum('ij,ij->i', velocities, velocities)))
+        potential = physics.potential_energy(bodies)
+        momentum = masses @ velocities
+        angular_momentum = masses @ np.cross(positions, velocities)
+        row = {"time": self.time, "bodies": len(masses), "kinetic": kinetic, "potential": potential,
+               "energy": kinetic + potential}
+        row.update(zip(MOMENTUM, momentum.tolist()))
+        row.update(zip(ANGULAR_MOMENTUM, angular_momentum.tolist()))
+        if self.first is None:
+            # Momentum and angular momentum are often zero to begin with, so their errors are measured
+            # against the sum of their sizes over the bodies instead
+            speeds = np.linalg.norm(velocities, axis=1)
+            self._scales = (abs(row["energy"]) or 1.0, float(np.dot(masses, speeds)) or 1.0,
+                            float(np.dot(masses, np.linalg.norm(positions, axis=1) * speeds)) or 1.0)
+            self.first = row
+        energy_scale, momentum_scale, angular_scale = self._scales
+        row["energy_error"] = (row["energy"] - self.first["energy"]) / energy_scale
+        row["momentum_error"] = math.dist([row[name] for name in MOMENTUM],
+                                          [self.first[name] for name in MOMENTUM]) / momentum_scale
+        row["angular_momentum_error"] = math.dist([row[name] for name in ANGULAR_MOMENTUM],
+                                                  [self.first[name] for name in ANGULAR_MOMENTUM]) / angular_scale
+        for name in DRIFTS:
+            self.statistics[name].add(row[name])
+        self.latest = row
+        self._write(row)
+        return row
+
+    def _write(self, row):
+        if self._file is None:
+            return
+        if self._writer is not None:
+            self._writer.writerow(row)
+        else:
+            self._file.write(json.dumps(row) + '\n')
+        self._rows += 1
+        if self._rows % FLUSH_EVERY == 0:
+            self._file.flush()
+
+    def summary(self):
+        # Latest, recent mean and worst value of every drift
+        summary = {}
+        for name in DRIFTS:
+            statistics = self.statistics[name]
+            summary[name] = statistics.recent[-1] if statistics.recent else 0.0
+            summary[name + "_recent"] = statistics.recent_mean
+            summary[name + "_worst"] = statistics.worst
+        return summary
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
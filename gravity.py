@@ -0,0 +1,128 @@
+import numpy as np
+
+from precision import compensated_add
+
+# Gravity solvers that only need NumPy, so they can be used without a pygame window
+
+# Constants
+# Positions, velocities and accelerations are (x, y, z), a flat system just has every z at 0
+DIMENSIONS = 3
+# Gravitational Constant
+G = 6.67e-11
+# Closest two bodies are treated as being when calculating gravity
+MIN_SEPARATION = 1e-20
+# Most body pairs the gravity kernel works on at once, bounds its memory use at large N
+KERNEL_CHUNK_PAIRS = 2 ** 20
+
+
+def gravity_kernel(positions, masses, out=None, targets=None, softening=0.0, potential=None):
+    # a_i = sum over j of G * m_j * (p_j - p_i) / |p_j - p_i|^3
+    # targets are the points the acceleration is wanted at, by default the bodies themselves
+    # Plummer softening uses (|p_j - p_i|^2 + softening^2)^(3/2) instead, so close passes stay finite
+    # potential, when given, is filled with Phi at every target from the same distances
+    # Done a block of rows at a time so the (rows, N) temporaries never get bigger than KERNEL_CHUNK_PAIRS
+    if targets is None:
+        targets = positions
+    n = len(masses)
+    if out is None:
+        out = np.empty((len(targets), DIMENSIONS), dtype=float)
+    x = positions[:, 0]
+    y = positions[:, 1]
+    z = positions[:, 2]
+    rows = max(1, KERNEL_CHUNK_PAIRS // max(n, 1))
+    for start in range(0, len(targets), rows):
+        stop = min(start + rows, len(targets))
+        dx = x[np.newaxis, :] - targets[start:stop, 0, np.newaxis]
+        dy = y[np.newaxis, :] - targets[start:stop, 1, np.newaxis]
+        dz = z[np.newaxis, :] - targets[start:stop, 2, np.newaxis]
+        distance = np.sqrt(dx * dx + dy * dy + dz * dz + softening * softening)
+        # Same lowest value as the old loop, a body on itself has dx = dy = dz = 0 so adds nothing
+        np.maximum(distance, MIN_SEPARATION, out=distance)
+        weight = masses / (distance * distance * distance)
+        out[start:stop, 0] = G * np.einsum('ij,ij->i', weight, dx)
+        out[start:stop, 1] = G * np.einsum('ij,ij->i', weight, dy)
+        out[start:stop, 2] = G * np.einsum('ij,ij->i', weight, dz)
+        if potential is not None:
+            inverse = masses / distance
+            # A body adds nothing to the potential at its own position
+            inverse[(dx == 0) & (dy == 0) & (dz == 0)] = 0.0
+            potential[start:stop] = -G * inverse.sum(axis=1)
+    return out
+
+
+def ordered_gravity_kernel(positions, masses, out=None, targets=None, softening=0.0, potential=None):
+    # Same arguments and sums as gravity_kernel, but each target's pull is added up body by body in
+    # index order with compensated adds, for the compensated precision mode of physics.py
+    # gravity_jit.jit_ordered_gravity does the same operations in the same order, so the two give
+    # the same bits. It loops over the bodies in Python, a pass over every target each, so it is
+    # for the few heavy bodies of a planetary system rather than big N
+    if targets is None:
+        targets = positions
+    count = len(targets)
+    if out is None:
+        out = np.empty((count, DIMENSIONS), dtype=float)
+    x = np.ascontiguousarray(targets[:, 0])
+    y = np.ascontiguousarray(targets[:, 1])
+    z = np.ascontiguousarray(targets[:, 2])
+    sums = np.zeros((DIMENSIONS, count))
+    errors = np.zeros((DIMENSIONS, count))
+    phi = np.zeros(count)
+    phi_errors = np.zeros(count)
+    softening_squared = softening * softening
+    for j in range(len(masses)):
+        dx = positions[j, 0] - x
+        dy = positions[j, 1] - y
+        dz = positions[j, 2] - z
+        squared = dx * dx + dy * dy + dz * dz
+        distance = np.maximum(np.sqrt(squared + softening_squared), MIN_SEPARATION)
+        weight = masses[j] / (distance * distance * distance)
+        compensated_add(sums[0], weight * dx, errors[0])
+        compensated_add(sums[1], weight * dy, errors[1])
+        compensated_add(sums[2], weight * dz, errors[2])
+        if potential is not None:
+            # A body adds nothing to the potential at its own position
+            compensated_add(phi, np.where(squared != 0.0, masses[j] / distance, 0.0), phi_errors)
+    out[:] = (G * (sums + errors)).T
+    if potential is not None:
+        potential[:] = -G * (phi + phi_errors)
+    return out
+
+
+def nearest_neighbour_distances(positions):
+    # Distance from every body to the closest other body, in the same row blocks as gravity_kernel
+    n = len(positions)
+    out = np.full(n, np.inf)
+    x = positions[:, 0]
+    y = positions[:, 1]
+    z = positions[:, 2]
+    rows = max(1, KERNEL_CHUNK_PAIRS // max(n, 1))
+    for start in range(0, n, rows):
+        stop = min(start + rows, n)
+        dx = x[np.newaxis, :] - x[start:stop, np.newaxis]
+        dy = y[np.newaxis, :] - y[start:stop, np.newaxis]
+        dz = z[np.newaxis, :] - z[start:stop, np.newaxis]
+        distance_squared = dx * dx + dy * dy + dz * dz
+        # A body is not its own neighbour
+        distance_squared[np.arange(stop - start), np.arange(start, stop)] = np.inf
+        out[start:stop] = np.sqrt(distance_squared.min(axis=1, initial=np.inf))
+    return out
+
+
+def potential_kernel(points, positions, masses, min_distance=MIN_SEPARATION):
+    # Phi at every point = -sum over j of G * m_j / |p_j - point|, in the same row blocks as gravity_kernel
+    # Distances are kept above min_distance so a point on top of a body stays finite
+    n = len(masses)
+    out = np.zeros(len(points), dtype=float)
+    x = positions[:, 0]
+    y = positions[:, 1]
+    z = positions[:, 2]
+    rows = max(1, KERNEL_CHUNK_PAIRS // max(n, 1))
+    for start in range(0, len(points), rows):
+        stop = min(start + rows, len(points))
+        dx = x[np.newaxis, :] - points[start:stop, 0, np.newaxis]
+        dy = y[np.newaxis, :] - points[start:stop, 1, np.newaxis]
+        dz = z[np.newaxis, :] - points[start:stop, 2, np.newaxis]
+        distance = np.sqrt(dx * dx + dy * dy + dz * dz)
+        np.maximum(distance, min_distance, out=distance)
+        out[start:stop] = -G * (masses / distance).sum(axis=1)
+    return out
@@ -0,0 +1,240 @@
+import math
+import threading
+
+import numpy as np
+
+from gravity import DIMENSIONS, G, MIN_SEPARATION
+
+try:
+    import numba
+except ImportError:
+    numba = None
+
+# Exact gravity and a whole leapfrog step compiled with Numba, used by physics.py in place of the
+# NumPy kernel when Numba is installed (pip install numba). Nothing of size N squared is made, each
+# pair is worked out once and given to both bodies, and the rows are shared over every core
+# Compiled the first time they are used and cached on disk next to this file after that
+
+JIT_AVAILABLE = numba is not None
+
+if JIT_AVAILABLE:
+    prange = numba.prange
+    # Start the worker threads now, from the thread importing this. Started first from another thread,
+    # such as the physics or the prediction thread, the TBB workers keep the program from exiting
+    numba.get_num_threads()
+
+    def compiled(function):
+        return numba.njit(parallel=True, cache=True)(function)
+
+    def compiled_helper(function):
+        # Small functions the kernels call, inlined by the compiler
+        return numba.njit(cache=True)(function)
+else:
+    prange = range
+
+    def compiled(function):
+        return function
+
+    def compiled_helper(function):
+        return function
+
+
+@compiled
+def _pair_forces(positions, masses, softening_squared, out, potential, with_potential, scratch, scratch_potential):
+    # Worker t takes rows t, t + threads, ... so the short rows at the end are shared out evenly
+    # The pull on j of every pair i < j goes in that worker's own scratch row, so no two workers write
+    # to the same place, then the scratch of every worker is added up
+    n = len(masses)
+    threads = scratch.shape[0]
+    for t in prange(threads):
+        scratch[t, :, :] = 0.0
+        if with_potential:
+            scratch_potential[t, :] = 0.0
+        for i in range(t, n, threads):
+            xi = positions[i, 0]
+            yi = positions[i, 1]
+            zi = positions[i, 2]
+            mi = masses[i]
+            ax = 0.0
+            ay = 0.0
+            az = 0.0
+            phi = 0.0
+            for j in range(i + 1, n):
+                dx = positions[j, 0] - xi
+                dy = positions[j, 1] - yi
+                dz = positions[j, 2] - zi
+                squared = dx * dx + dy * dy + dz * dz
+                distance = max(math.sqrt(squared + softening_squared), MIN_SEPARATION)
+                inverse_cube = 1.0 / (distance * distance * distance)
+                ax += masses[j] * inverse_cube * dx
+                ay += masses[j] * inverse_cube * dy
+                az += masses[j] * inverse_cube * dz
+                scratch[t, j, 0] -= mi * inverse_cube * dx
+                scratch[t, j, 1] -= mi * inverse_cube * dy
+                scratch[t, j, 2] -= mi * inverse_cube * dz
+                if with_potential and squared != 0.0:
+                    phi += masses[j] / distance
+                    scratch_potential[t, j] += mi / distance
+            scratch[t, i, 0] += ax
+            scratch[t, i, 1] += ay
+            scratch[t, i, 2] += az
+            if with_potential:
+                scratch_potential[t, i] += phi
+    for i in prange(n):
+        ax = 0.0
+        ay = 0.0
+        az = 0.0
+        phi = 0.0
+        for t in range(threads):
+            ax += scratch[t, i, 0]
+            ay += scratch[t, i, 1]
+            az += scratch[t, i, 2]
+            if with_potential:
+                phi += scratch_potential[t, i]
+        out[i, 0] = G * ax
+        out[i, 1] = G * ay
+        out[i, 2] = G * az
+        if with_potential:
+            potential[i] = -G * phi
+
+
+@compiled
+def _target_forces(positions, masses, targets, softening_squared, out, potential, with_potential):
+    # Pull on points that are not all the bodies, a row each with nothing shared between rows
+    for k in prange(len(targets)):
+        ax = 0.0
+        ay = 0.0
+        az = 0.0
+        phi = 0.0
+        for j in range(len(masses)):
+            dx = positions[j, 0] - targets[k, 0]
+            dy = positions[j, 1] - targets[k, 1]
+            dz = positions[j, 2] - targets[k, 2]
+            squared = dx * dx + dy * dy + dz * dz
+            distance = max(math.sqrt(squared + softening_squared), MIN_SEPARATION)
+            inverse_cube = 1.0 / (distance * distance * distance)
+            ax += masses[j] * inverse_cube * dx
+            ay += masses[j] * inverse_cube * dy
+            az += masses[j] * inverse_cube * dz
+            if with_potential and squared != 0.0:
+                phi += masses[j] / distance
+        out[k, 0] = G * ax
+        out[k, 1] = G * ay
+        out[k, 2] = G * az
+        if with_potential:
+            potential[k] = -G * phi
+
+
+@compiled_helper
+def _compensated_add(total, error, value):
+    # precision.compensated_add for one number, returns the new total and error
+    added = value + error
+    new_total = total + added
+    rounded = new_total - total
+    return new_total, (total - (new_total - rounded)) + (added - rounded)
+
+
+@compiled
+def _ordered_forces(positions, masses, targets, softening_squared, out, potential, with_potential):
+    # gravity.ordered_gravity_kernel, each target's sum over the bodies in index order with the same
+    # operations, so the bits do not depend on the number of threads or on which backend ran it
+    # Every pair is worked out from both ends, twice the work of _pair_forces
+    for k in prange(len(targets)):
+        sx, sy, sz, phi = 0.0, 0.0, 0.0, 0.0
+        ex, ey, ez, phi_error = 0.0, 0.0, 0.0, 0.0
+        for j in range(len(masses)):
+            dx = positions[j, 0] - targets[k, 0]
+            dy = positions[j, 1] - targets[k, 1]
+            dz = positions[j, 2] - targets[k, 2]
+            squared = dx * dx + dy * dy + dz * dz
+            distance = max(math.sqrt(squared + softening_squared), MIN_SEPARATION)
+            weight = masses[j] / (distance * distance * distance)
+            sx, ex = _compensated_add(sx, ex, weight * dx)
+            sy, ey = _compensated_add(sy, ey, weight * dy)
+            sz, ez = _compensated_add(sz, ez, weight * dz)
+            if with_potential:
+                phi, phi_error = _compensated_add(phi, phi_error, masses[j] / distance if squared != 0.0 else 0.0)
+        out[k, 0] = G * (sx + ex)
+        out[k, 1] = G * (sy + ey)
+        out[k, 2] = G * (sz + ez)
+        if with_potential:
+            potential[k] = -G * (phi + phi_error)
+
+
+@compiled
+def _leapfrog(positions, velocities, accelerations, masses, dt, softening_squared, potential, with_potential,
+              scratch, scratch_potential):
+    # Kick and drift in one pass over the bodies, the new accelerations, then the closing kick
+    half = dt / 2
+    for i in prange(len(masses)):
+        for axis in range(3):
+            velocities[i, axis] += accelerations[i, axis] * half
+            positions[i, axis] += velocities[i, axis] * dt
+    _pair_forces(positions, masses, softening_squared, accelerations, potential, with_potential,
+                 scratch, scratch_potential)
+    for i in prange(len(masses)):
+        for axis in range(3):
+            velocities[i, axis] += accelerations[i, axis] * half
+
+
+# Scratch rows of each worker, kept between calls so a step allocates nothing, one set per thread
+# that calls in so the physics thread and the render loop never share them
+_local = threading.local()
+
+
+def _scratch(n, with_potential):
+    threads = numba.get_num_threads() if JIT_AVAILABLE else 1
+    scratch = getattr(_local, "scratch", None)
+    if scratch is None or scratch.shape[:2] != (threads, n):
+        scratch = _local.scratch = np.empty((threads, n, DIMENSIONS))
+        _local.scratch_potential = np.empty((threads, 0))
+    if with_potential and _local.scratch_potential.shape[1] != n:
+        _local.scratch_potential = np.empty((threads, n))
+    return scratch, _local.scratch_potential
+
+
+def jit_gravity(positions, masses, out=None, targets=None, softening=0.0, potential=None):
+    # Same arguments and results as gravity.gravity_kernel
+    count = len(masses) if targets is None else len(targets)
+    if out is None:
+        out = np.empty((count, DIMENSIONS), dtype=float)
+    with_potential = potential is not None
+    if not with_potential:
+        potential = np.empty(0)
+    if targets is None:
+        scratch, scratch_potential = _scratch(len(masses), with_potential)
+        _pair_forces(positions, masses, softening * softening, out, potential, with_potential,
+                     scratch, scratch_potential)
+    else:
+        _target_forces(positions, masses, targets, softening * softening, out, potential, with_potential)
+    return out
+
+
+def jit_ordered_gravity(positions, masses, out=None, targets=None, softening=0.0, potential=None):
+    # Same arguments and results as gravity.ordered_gravity_kernel
+    if targets is None:
+        targets = positions
+    if out is None:
+        out = np.empty((len(targets), DIMENSIONS), dtype=float)
+    with_potential = potential is not None
+    if not with_potential:
+        potential = np.empty(0)
+    _ordered_forces(positions, masses, targets, softening * softening, out, potential, with_potential)
+    return out
+
+
+def set_threads(threads):
+    # Worker threads the kernels share the rows over, None for every core
+    if JIT_AVAILABLE:
+        numba.set_num_threads(threads or numba.config.NUMBA_NUM_THREADS)
+
+
+def jit_leapfrog_step(state, dt, softening=0.0, potential=None):
+    # The kick-drift-kick of integrators.leapfrog in one compiled call, state.accelerations must be
+    # right for the current positions and are left right for the new ones
+    with_potential = potential is not None
+    if not with_potential:
+        potential = np.empty(0)
+    scratch, scratch_potential = _scratch(len(state.masses), with_potential)
+    _leapfrog(state.positions, state.velocities, state.accelerations, state.masses, dt, softening * softening,
+              potential, with_potential, scratch, scratch_potential)
@@ -0,0 +1,205 @@
+import argparse
+import csv
+import json
+import sys
+import time
+
+import numpy as np
+
+import physics
+from diagnostics import monitor
+from gravity_jit import JIT_AVAILABLE
+from integrators import INTEGRATOR_NAMES
+from recording import recorder
+from scenarios import is_scenario_file, load_scenario, restore_settings, save_scenario
+from systems import SYSTEM_NAMES, load_system
+
+# Runs a system with no display and writes out the results, for batch jobs on machines with no screen
+# python headless.py system4 --duration 1y --dt 1800 --output final.csv --trajectory orbits.npz
+# python headless.py system4 --duration 1y --checkpoint year1.npz, then carry on with
+# python headless.py year1.npz --duration 1y --checkpoint year2.npz
+
+# Suffixes allowed on --duration
+DURATION_UNITS = {"s": 1, "m": 60, "h": 3600, "d": 86400, "y": 365.25 * 86400}
+
+
+def parse_duration(text):
+    # "3600", "12h", "30d" or "1.5y" in simulated seconds
+    if text[-1] in DURATION_UNITS:
+        return float(text[:-1]) * DURATION_UNITS[text[-1]]
+    return float(text)
+
+
+def system_name(text):
+    # A built in system or a scenario file
+    if text not in SYSTEM_NAMES and not is_scenario_file(text):
+        raise argparse.ArgumentTypeError(f'pick one of {", ".join(SYSTEM_NAMES)} or a .json or .npz scenario')
+    return text
+
+
+def gravity_name():
+    # The selected gravity solver as the summary gives it
+    if physics.use_particle_mesh:
+        return f'{"P3M" if physics.mesh_short_range else "Particle-mesh"} mesh {physics.mesh_size}'
+    return f"Barnes-Hut theta {physics.theta}" if physics.use_barnes_hut else "Exact"
+
+
+def run(bodies, dt, steps, record_every=0, record_to=None, start_time=0.0, diagnostics_to=None):
+    # Step the bodies on steps times, recording positions and velocities every record_every steps
+    # and every step to the binary recording record_to when it is given
+    # diagnostics_to streams the energy, momentum and angular momentum after every step
+    # Returns a summary of the run and the recorded trajectory
+    physics.barycentric_frame(bodies)
+    energy_start = physics.total_energy(bodies.positions, bodies.velocities, bodies.masses)
+    original = list(bodies)
+    masses = bodies.masses.copy()
+    times = [start_time]
+    positions = [bodies.positions.copy()]
+    velocities = [bodies.velocities.copy()]
+    binary = recorder(record_to, bodies, dt, physics.integrator.name, start_time) if record_to else None
+    diagnostics = None
+    if diagnostics_to:
+        physics.track_potential = True
+        diagnostics = monitor(diagnostics_to, start_time)
+        diagnostics.measure(bodies)
+    begin = time.perf_counter()
+    for step in range(1, steps + 1):
+        physics.update_bodies(bodies, dt)
+        if diagnostics is not None:
+            diagnostics.measure(bodies, dt)
+        if binary is not None and len(bodies) != binary.bodies:
+            # A recording is for a fixed set of bodies, it ends when collisions merge some
+            binary.close()
+            binary = None
+            print(f'Bodies merged at step {step}, the recording stops there', file=sys.stderr)
+        if binary is not None:
+            binary.append(bodies.positions, bodies.velocities, dt)
+        if record_every and step % record_every == 0:
+            times.append(start_time + step * dt)
+            positions.append(rows_of(bodies, original, bodies.positions))
+            velocities.append(rows_of(bodies, original, bodies.velocities))
+    wall_time = time.perf_counter() - begin
+    if binary is not None:
+        binary.close()
+    if diagnostics is not None:
+        diagnostics.close()
+        physics.track_potential = False
+    energy_end = physics.total_energy(bodies.positions, bodies.velocities, bodies.masses)
+    summary = {"bodies": len(bodies), "particles": 0 if bodies.particles is None else len(bodies.particles),
+               "steps": steps, "dt": dt, "simulated_time": steps * dt,
+               "end_time": start_time + steps * dt,
+               "integrator": physics.integrator.name,
+               "gravity": gravity_name(),
+               "backend": physics.backend, "precision": physics.precision,
+               "softening": physics.softening, "collisions": physics.collisions,
+               "merged": len(original) - len(bodies),
+               "wall_time": wall_time, "steps_per_second": steps / wall_time if wall_time else float('inf'),
+               "gravity_evaluations": physics.integrator.evaluations,
+               "energy_start": energy_start, "energy_end": energy_end,
+               "energy_error": abs((energy_end - energy_start) / energy_start) if energy_start else 0.0}
+    if diagnostics is not None:
+        summary["diagnostics"] = diagnostics.summary()
+    trajectory = {"names": np.array([old_body.name for old_body in original]), "masses": masses,
+                  "times": np.array(times), "positions": np.array(positions), "velocities": np.array(velocities)}
+    return summary, trajectory
+
+
+def rows_of(bodies, original, values):
+    # values of the bodies in original in that order, bodies merged away by collisions get NaN
+    if len(bodies) == len(original):
+        return values.copy()
+    out = np.full((len(original),) + values.shape[1:], np.nan)
+    present = [k for k, old_body in enumerate(original) if old_body.state is bodies]
+    out[present] = values[[original[k].index for k in present]]
+    return out
+
+
+def write_final_state(bodies, summary, path):
+    # .json gets the summary and every body, anything else is written as a csv table of bodies
+    rows = [{"name": body.name, "mass": float(body.mass), **dict(zip(["x", "y", "z"], body.position.tolist())),
+             **dict(zip(["vx", "vy", "vz"], body.velocity.tolist()))} for body in bodies]
+    with open(path, 'w', newline='') as file:
+        if path.endswith('.json'):
+            json.dump({"summary": summary, "bodies": rows}, file, indent=2)
+        else:
+            writer = csv.DictWriter(file, fieldnames=["name", "mass", "x", "y", "z", "vx", "vy", "vz"])
+            writer.writeheader()
+            writer.writerows(rows)
+
+
+def write_trajectory(trajectory, path):
+    # Names and starting masses are saved with the trajectory, one row per body the run started with
+    np.savez_compressed(path, **trajectory)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run a gravity simulation without a display")
+    parser.add_argument("system", type=system_name,
+                        help="one of " + ", ".join(SYSTEM_NAMES) + ", or a scenario or checkpoint file")
+    length = parser.add_mutually_exclusive_group(required=True)
+    length.add_argument("--steps", type=int, help="number of steps to run")
+    length.add_argument("--duration", type=parse_duration, help="simulated time, e.g. 3600, 12h, 30d, 1.5y")
+    # The options below left out keep what a checkpoint was saved with, or the defaults
+    parser.add_argument("--dt", type=float, help="seconds per step (default 1800)")
+    parser.add_argument("--integrator", choices=sorted(INTEGRATOR_NAMES), help="(default leapfrog)")
+    parser.add_argument("--barnes-hut", action="store_true", default=None,
+                        help="use Barnes-Hut gravity instead of exact")
+    parser.add_argument("--theta", type=float, help="Barnes-Hut opening angle")
+    parser.add_argument("--particle-mesh", action="store_true", default=None,
+                        help="use particle-mesh gravity on a grid, for very large N")
+    parser.add_argument("--p3m", action="store_true", default=None,
+                        help="particle-mesh gravity with the close pairs added exactly")
+    parser.add_argument("--mesh-size", type=int, help="particle-mesh cells along the longest side (default 64)")
+    parser.add_argument("--backend", choices=physics.BACKENDS,
+                        help="exact gravity with NumPy or compiled with Numba (default jit when Numba is installed)")
+    parser.add_argument("--precision", choices=physics.PRECISIONS,
+                        help="compensated sums for runs that come out the same bits on every backend")
+    parser.add_argument("--softening", type=float, help="Plummer softening length in metres")
+    parser.add_argument("--collisions", choices=physics.COLLISION_MODES,
+                        help="merge or bounce bodies that touch, going by their radius in metres")
+    parser.add_argument("--seed", type=int, help="seed for random systems")
+    parser.add_argument("--output", help="final state, .csv or .json")
+    parser.add_argument("--trajectory", help="recorded positions and velocities, .npz")
+    parser.add_argument("--every", type=int, default=1, help="record every this many steps (default 1)")
+    parser.add_argument("--record", help="every step as a binary recording that the window can replay with y")
+    parser.add_argument("--checkpoint", help="save the end of the run to carry on from, .json or .npz")
+    parser.add_argument("--diagnostics", help="energy, momentum and angular momentum every step, .csv or .ndjson")
+    args = parser.parse_args(argv)
+
+    start_time, dt = 0.0, None
+    if is_scenario_file(args.system):
+        bodies, settings = load_scenario(args.system)
+        start_time, dt = restore_settings(bodies, settings)
+    else:
+        bodies = load_system(args.system, seed=args.seed)
+    dt = args.dt or dt or 1800
+    if args.backend == "jit" and not JIT_AVAILABLE:
+        parser.error("--backend jit needs Numba, pip install numba")
+    if args.backend is not None:
+        physics.backend = args.backend
+    if args.integrator is not None:
+        physics.integrator = INTEGRATOR_NAMES[args.integrator]()
+    if args.p3m:
+        physics.use_particle_mesh = True
+    settings = {"barnes_hut": "use_barnes_hut", "particle_mesh": "use_particle_mesh", "p3m": "mesh_short_range",
+                "mesh_size": "mesh_size", "theta": "theta", "softening": "softening", "collisions": "collisions",
+                "precision": "precision"}
+    for name, setting in settings.items():
+        if getattr(args, name) is not None:
+            setattr(physics, setting, getattr(args, name))
+    steps = args.steps if args.steps is not None else int(round(args.duration / dt))
+
+    summary, trajectory = run(bodies, dt, steps, args.every if args.trajectory else 0, args.record, start_time,
+                              args.diagnostics)
+    if args.checkpoint:
+        save_scenario(args.checkpoint, bodies, start_time + steps * dt, dt, physics.integrator)
+    if args.output:
+        write_final_state(bodies, summary, args.output)
+    if args.trajectory:
+        write_trajectory(trajectory, args.trajectory)
+    json.dump(summary, sys.stdout, indent=2)
+    print()
+
+
+if __name__ == '__main__':
+    main()
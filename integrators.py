@@ -0,0 +1,294 @@
+import numpy as np
+
+from gravity import nearest_neighbour_distances
+from precision import compensated_add
+
+# Integrators move a state (positions, velocities, accelerations and masses arrays) on by dt
+# gravity(positions, masses, out=None, targets=None) returns the accelerations at the given
+# positions, or only at the targets if they are given
+# Every integrator remembers which positions state.accelerations belongs to, so a step that
+# starts where the last one ended does not calculate the same gravity again
+# Positions and velocities are only changed through drift and kick, which keep the rounding of
+# every update in state.position_errors and state.velocity_errors when compensated is set
+
+# Yoshida 4th order weights
+YOSHIDA_W1 = 1 / (2 - 2 ** (1 / 3))
+YOSHIDA_W0 = -2 ** (1 / 3) * YOSHIDA_W1
+
+# Dormand-Prince 5(4) tableau used by rk45
+DP_A = [[],
+        [1 / 5],
+        [3 / 40, 9 / 40],
+        [44 / 45, -56 / 15, 32 / 9],
+        [19372 / 6561, -25360 / 2187, 64448 / 6561, -212 / 729],
+        [9017 / 3168, -355 / 33, 46732 / 5247, 49 / 176, -5103 / 18656],
+        [35 / 384, 0, 500 / 1113, 125 / 192, -2187 / 6784, 11 / 84]]
+# 5th order weights minus 4th order weights, gives the error estimate of a step
+DP_E = [71 / 57600, 0, -71 / 16695, 71 / 1920, -17253 / 339200, 22 / 525, -1 / 40]
+# Allowed error per step for rk45, relative to each body's distance and speed plus a floor
+RK45_TOLERANCE = 1e-9
+RK45_POSITION_FLOOR = 1.0
+RK45_VELOCITY_FLOOR = 1e-6
+# Block timesteps, a body steps dt / 2**level with the level picked so that the step is no
+# longer than BLOCK_ETA * sqrt(nearest neighbour distance / acceleration), about 1/200 of an orbit
+BLOCK_ETA = 0.03
+BLOCK_MAX_LEVEL = 12
+
+
+class integrator:
+    name = "None"
+    # Gravity evaluations per step once the previous step's acceleration is reused
+    evaluations_per_step = 0
+
+    def __init__(self):
+        # Total gravity evaluations, so integrators can be compared on cost
+        self.evaluations = 0
+        # Set by physics.update_bodies in the compensated precision mode
+        self.compensated = False
+        self._known_positions = None
+        self._known_masses = None
+
+    def gravity(self, gravity, positions, masses, out=None, targets=None):
+        self.evaluations += 1
+        return gravity(positions, masses, out=out, targets=targets)
+
+    def drift(self, state, delta, rows=None):
+        # positions += delta, or only the rows given
+        if self.compensated:
+            compensated_add(state.positions, delta, state.position_errors, rows)
+        elif rows is None:
+            state.positions += delta
+        else:
+            state.positions[rows] += delta
+
+    def kick(self, state, delta, rows=None):
+        # velocities += delta, or only the rows given
+        if self.compensated:
+            compensated_add(state.velocities, delta, state.velocity_errors, rows)
+        elif rows is None:
+            state.velocities += delta
+        else:
+            state.velocities[rows] += delta
+
+    def start_acceleration(self, state, gravity):
+        # The acceleration at the current positions, only calculated if the last step didn't leave it
+        if not self._is_known(state):
+            self.gravity(gravity, state.positions, state.masses, out=state.accelerations)
+            self.remember(state)
+        return state.accelerations
+
+    def remember(self, state):
+        # state.accelerations is now right for the current positions
+        self._known_positions = state.positions.copy()
+        self._known_masses = state.masses.copy()
+
+    def _is_known(self, state):
+        return (self._known_positions is not None
+                and self._known_positions.shape == state.positions.shape
+                and np.array_equal(self._known_positions, state.positions)
+                and np.array_equal(self._known_masses, state.masses))
+
+    def step(self, state, dt, gravity):
+        raise NotImplementedError
+
+    def checkpoint(self):
+        # Settings and counters to carry on a run with, the public attributes as plain values
+        saved = {}
+        for name, value in vars(self).items():
+            if not name.startswith('_'):
+                saved[name] = value.tolist() if isinstance(value, (np.ndarray, np.generic)) else value
+        return saved
+
+    def restore(self, saved):
+        for name, value in saved.items():
+            if isinstance(getattr(self, name, None), np.ndarray):
+                value = np.array(value, dtype=getattr(self, name).dtype)
+            setattr(self, name, value)
+
+
+class euler(integrator):
+    # Semi-implicit Euler, the original update_bodies, first order
+    name = "Euler"
+    evaluations_per_step = 1
+
+    def step(self, state, dt, gravity):
+        acceleration = self.start_acceleration(state, gravity)
+        self.kick(state, acceleration * dt)  # v=u+at
+        self.drift(state, state.velocities * dt)  # s=s1 + s2 (s2 = v * dt)
+
+
+class leapfrog(integrator):
+    # Kick-drift-kick leapfrog (velocity Verlet), symplectic and second order
+    # The closing kick uses the acceleration at the new positions, which opens the next step
+    name = "Leapfrog"
+    evaluations_per_step = 1
+
+    def step(self, state, dt, gravity):
+        acceleration = self.start_acceleration(state, gravity)
+        self.kick(state, acceleration * (dt / 2))
+        self.drift(state, state.velocities * dt)
+        self.gravity(gravity, state.positions, state.masses, out=state.accelerations)
+        self.kick(state, state.accelerations * (dt / 2))
+        self.remember(state)
+
+
+class yoshida4(integrator):
+    # Yoshida's 4th order symplectic scheme, three leapfrog steps of weight w1, w0, w1
+    # In kick-drift-kick form the first kick reuses the last step's acceleration
+    name = "Yoshida 4"
+    evaluations_per_step = 3
+
+    def step(self, state, dt, gravity):
+        kicks = [YOSHIDA_W1 / 2, (YOSHIDA_W0 + YOSHIDA_W1) / 2, (YOSHIDA_W0 + YOSHIDA_W1) / 2, YOSHIDA_W1 / 2]
+        drifts = [YOSHIDA_W1, YOSHIDA_W0, YOSHIDA_W1]
+        acceleration = self.start_acceleration(state, gravity)
+        self.kick(state, acceleration * (kicks[0] * dt))
+        for kick, drift in zip(kicks[1:], drifts):
+            self.drift(state, state.velocities * (drift * dt))
+            self.gravity(gravity, state.positions, state.masses, out=state.accelerations)
+            self.kick(state, state.accelerations * (kick * dt))
+        self.remember(state)
+
+
+class rk4(integrator):
+    # Classic 4th order Runge-Kutta, not symplectic so energy slowly drifts
+    # Only the first stage can be reused, the step never ends on an evaluated position
+    name = "RK4"
+    evaluations_per_step = 4
+
+    def step(self, state, dt, gravity):
+        x = state.positions
+        v = state.velocities
+        a1 = self.start_acceleration(state, gravity).copy()
+        v2 = v + a1 * (dt / 2)
+        a2 = self.gravity(gravity, x + v * (dt / 2), state.masses)
+        v3 = v + a2 * (dt / 2)
+        a3 = self.gravity(gravity, x + v2 * (dt / 2), state.masses)
+        v4 = v + a3 * dt
+        a4 = self.gravity(gravity, x + v3 * dt, state.masses)
+        self.drift(state, (v + 2 * v2 + 2 * v3 + v4) * (dt / 6))
+        self.kick(state, (a1 + 2 * a2 + 2 * a3 + a4) * (dt / 6))
+
+
+class rk45(integrator):
+    # Dormand-Prince 5(4) with its own step size, takes as many substeps as needed to cover dt
+    # The last stage is the acceleration at the new positions, so it starts the next substep
+    name = "RK45"
+    evaluations_per_step = 6
+
+    def __init__(self, tolerance=RK45_TOLERANCE):
+        super().__init__()
+        self.tolerance = tolerance
+        # Substep size carried over between calls
+        self.h = None
+        self.rejected = 0
+
+    def step(self, state, dt, gravity):
+        remaining = dt
+        while remaining > 0:
+            proposed = dt if self.h is None else self.h
+            h = min(proposed, remaining)
+            error = self._attempt(state, h, gravity)
+            # Standard step size controller, never change by more than 5 times per attempt
+            factor = 5.0 if error == 0 else min(5.0, max(0.2, 0.9 * error ** -0.2))
+            if error <= 1:
+                remaining = 0 if h == remaining else remaining - h
+                # A substep cut short to land on dt says nothing about the size the orbit needs
+                self.h = max(proposed, h * factor) if h < proposed else h * factor
+            else:
+                self.rejected += 1
+                self.h = h * factor
+
+    def _attempt(self, state, h, gravity):
+        x = state.positions
+        v = state.velocities
+        kx = [v.copy()]
+        kv = [self.start_acceleration(state, gravity).copy()]
+        for row in DP_A[1:]:
+            step_x = h * sum(weight * k for weight, k in zip(row, kx) if weight)
+            step_v = h * sum(weight * k for weight, k in zip(row, kv) if weight)
+            stage_x = x + step_x
+            stage_v = v + step_v
+            kx.append(stage_v)
+            kv.append(self.gravity(gravity, stage_x, state.masses))
+        # The 7th stage was taken at the 5th order solution, which is the new state
+        new_x = stage_x
+        new_v = stage_v
+        error_x = h * sum(weight * k for weight, k in zip(DP_E, kx) if weight)
+        error_v = h * sum(weight * k for weight, k in zip(DP_E, kv) if weight)
+        scale_x = RK45_POSITION_FLOOR + self.tolerance * np.maximum(np.linalg.norm(x, axis=1),
+                                                                    np.linalg.norm(new_x, axis=1))
+        scale_v = RK45_VELOCITY_FLOOR + self.tolerance * np.maximum(np.linalg.norm(v, axis=1),
+                                                                    np.linalg.norm(new_v, axis=1))
+        error = max(np.max(np.linalg.norm(error_x, axis=1) / scale_x, initial=0.0),
+                    np.max(np.linalg.norm(error_v, axis=1) / scale_v, initial=0.0))
+        if error <= 1:
+            # The same sums as new_x and new_v, added on so they can be compensated
+            self.drift(state, step_x)
+            self.kick(state, step_v)
+            state.accelerations[:] = kv[-1]
+            self.remember(state)
+        return error
+
+
+class block_leapfrog(integrator):
+    # Leapfrog where every body has its own power of two fraction of dt (Makino's block steps)
+    # All bodies drift on the finest substep but only the ones at the end of their own step
+    # get a new acceleration and a kick, so slow outer planets cost one gravity sum per dt
+    # Levels are picked again every dt, when all the bodies are back in step
+    name = "Block Leapfrog"
+    evaluations_per_step = 1
+
+    def __init__(self, eta=BLOCK_ETA, max_level=BLOCK_MAX_LEVEL):
+        super().__init__()
+        self.eta = eta
+        self.max_level = max_level
+        self.levels = np.zeros(0, dtype=int)
+        # Accelerations of single bodies worked out, a global step would use N per evaluation
+        self.body_evaluations = 0
+
+    def choose_levels(self, state, dt):
+        acceleration = np.linalg.norm(state.accelerations, axis=1)
+        neighbour = nearest_neighbour_distances(state.positions)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            wanted = self.eta * np.sqrt(neighbour / acceleration)
+            levels = np.ceil(np.log2(dt / wanted))
+        # A lone body (no neighbour or no pull) gets the coarsest step
+        levels[np.isnan(levels)] = 0
+        return np.clip(levels, 0, self.max_level).astype(int)
+
+    def level_counts(self):
+        # How many bodies are on each level, for the HUD
+        return np.bincount(self.levels, minlength=self.max_level + 1)
+
+    def step(self, state, dt, gravity):
+        self.start_acceleration(state, gravity)
+        self.levels = self.choose_levels(state, dt)
+        deepest = int(self.levels.max(initial=0))
+        substeps = 2 ** deepest
+        h = dt / substeps
+        half_kick = (dt / 2 ** self.levels / 2)[:, np.newaxis]
+        # A body's step is 2^(deepest - level) substeps, so the bodies at the end of their step
+        # after a substep that 2^k divides are the ones on level deepest - k and up. Their rows
+        # and half kicks for every k, worked out once instead of on each substep. None is empty,
+        # the bodies on the deepest level take part in every substep
+        due = [np.flatnonzero(self.levels >= deepest - k) for k in range(deepest + 1)]
+        due_kicks = [half_kick[rows] for rows in due]
+        for substep in range(substeps):
+            # Times 2 divides substep, every body starts a step on substep 0
+            k = deepest if substep == 0 else min((substep & -substep).bit_length() - 1, deepest)
+            self.kick(state, state.accelerations[due[k]] * due_kicks[k], rows=due[k])
+            self.drift(state, state.velocities * h)
+            k = min(((substep + 1) & -(substep + 1)).bit_length() - 1, deepest)
+            active = due[k]
+            state.accelerations[active] = self.gravity(gravity, state.positions, state.masses,
+                                                       targets=state.positions[active])
+            self.body_evaluations += len(active)
+            self.kick(state, state.accelerations[active] * due_kicks[k], rows=active)
+        self.remember(state)
+
+
+# Integrators that can be picked at runtime, in the order the i key cycles through them
+INTEGRATORS = [euler, leapfrog, yoshida4, rk4, rk45, block_leapfrog]
+# Class name to class, for command lines and saved checkpoints
+INTEGRATOR_NAMES = {integrator.__name__: integrator for integrator in INTEGRATORS}
@@ -1,22 +1,67 @@
-import random
+import argparse
+import os
+import time
 
 import numpy as np
 import pygame
 import math
 
+import physics
+from physics import body, potential_zero_points, system, update_bodies
+from integrators import INTEGRATORS, block_leapfrog
+from camera import CAMERA_STEP, CAMERA_VIEWS, camera
+from gravity_jit import JIT_AVAILABLE
+from runner import FRAME_BUDGET, physics_runner
+from systems import load_system
+from scenarios import (BINARY_SCENARIO_PATH, JSON_BODY_LIMIT, SCENARIO_PATH, is_scenario_file, load_scenario,
+                       restore_settings, save_scenario)
+import recording
+from diagnostics import DIAGNOSTICS_PATH, monitor
+from prediction import orbit_predictor
+from profiler import PROFILE_HISTORY, STAGE_COLOURS, TRACE_PATH, frame_profiler
+from trails import TRAIL_LENGTH, trail_buffer
+from potential_field import potential_field
+from commands import (BODY_FIELDS, KEY_RELEASE_COMMANDS, command_log, command_queue, key_command, key_repeat,
+                      parse_body_fields, parse_number, read_command_log)
+from viewport import on_screen, one_per_pixel, place_labels, screen_index, segments_on_screen
+
 #from pygame.examples.go_over_there import delta_time
 
 # Physics engine will display a screen with multiple objects
-# Every object can be defined as having these characteristics: Mass, Velocity, Position
+# The physics itself is in physics.py, this file draws it and handles the controls
 
 # Constants
-# Gravitational Constant
-G = 6.67e-11
 # Simulation time
 current_time = 0
-# Real World seconds per frame
+# Simulated seconds per frame, the physics runner splits it into steps of at most MAX_STEP
 dt = 1800
 DEBUG = False
+# Gravity solvers the b key cycles through, as (Barnes-Hut, particle-mesh, short range correction):
+# exact, Barnes-Hut, particle-mesh and particle-mesh with close pairs added exactly (P3M)
+SOLVER_CHOICES = [(False, False, False), (True, False, False), (False, True, False), (False, True, True)]
+# Opening angles the , key cycles through, or the particle-mesh cells along the longest side
+THETA_CHOICES = [0.3, 0.5, 0.7, 1.0]
+MESH_CHOICES = [32, 64, 128, 256]
+# Plummer softening lengths in metres the s key cycles through
+SOFTENING_CHOICES = [0.0, 1e6, 1e7, 1e8]
+# Recorder every physics step is written to while the r key has recording on
+active_recorder = None
+# Energy, momentum and angular momentum drift measured every physics step while the d key has it on
+active_monitor = None
+# Seconds ahead the o key cycles the predicted path through, 0 is off, the prediction starts again
+# when the body it follows strays this many pixels from it
+PREDICTION_HORIZONS = [0, 30 * 86400, 365.25 * 86400, 10 * 365.25 * 86400]
+PREDICTION_DRIFT_PIXELS = 3
+predictor = orbit_predictor()
+# Time spent in each stage of the frame while the p key has profiling on
+profile = frame_profiler()
+# Trail points of every body, grows with the number of bodies
+trails = trail_buffer(length=TRAIL_LENGTH)
+# Rendered label text by string, emptied when it holds more than LABEL_CACHE_SIZE
+label_surfaces = {}
+LABEL_CACHE_SIZE = 2048
+# What the . key cycles through, arrows to each pair's zero point or a map of the potential
+POTENTIAL_VIEWS = ["off", "arrows", "field", "field and contours"]
 
 # Set up pygame screen
 pygame.init()
@@ -25,45 +70,42 @@ screen_width = 1300
 CenterX = screen_width // 2
 CenterY = screen_height // 2
 
-# Set up screen
+# Set up screen, the bodies and everything else that moves with the view are drawn on the scene layer
+# and copied to the screen, with the text, buttons and highlights over them
 screen = pygame.display.set_mode((screen_width, screen_height))
+scene = pygame.Surface((screen_width, screen_height))
 clock = pygame.time.Clock()
 center = (screen_width / 2, screen_height / 2)
 # size conversions, this is a 0.5e-6 scale model
 pixel_scale = 0.5e-6
+# Direction the system is seen from, turned and tilted by the keys, see camera.py
+projection = camera()
 
 # Colours definers
 BLACK = (0, 0, 0)
 WHITE = (255, 255, 255)
 RED = (255, 0, 0)
+GREY = (140, 140, 140)
+BLUE = (80, 160, 255)
 
 # Font
 font = pygame.font.Font(None, 30)
 
 # Frame Limiter
 FPS = 60
+# Longest the loop sleeps for while paused with nothing happening, in milliseconds
+IDLE_WAIT_MS = 100
+
+# Potential worked out over the window, and its surfaces until it changes
+field = potential_field(screen_width, screen_height)
+field_surface = None
+contour_surface = None
 
 # Images for Play/Pause button
 play_image = pygame.image.load('Images/Play.png').convert_alpha()
 pause_image = pygame.image.load('Images/Pause.png').convert_alpha()
 
 
-# Classes
-class body:
-    def __init__(self, mass, velocity, position, radius, name):
-        self.mass = mass
-        # Use of NP array so vector calculations can be done
-        self.position = np.array(position, dtype=float)
-        self.velocity = np.array(velocity, dtype=float)
-        self.acceleration = np.array([0.0, 0.0], dtype=float)
-        self.radius = radius
-        self.name = name
-        self.past_positions = []
-        # Calculate a hit box area
-        self.hit_box_surface = pygame.Surface(
-            (self.radius * 2, self.radius * 2))  # make a surface that is around the object
-
-
 class menu:
     def __init__(self, height, width, pos):
         self.surface = pygame.Surface((height, width))
@@ -73,6 +115,8 @@ class menu:
         self.line_space = 5
         self.line_start = 0
         self.categories = ["Mass:", "Velocity:", "Radius:", "Size:", "Name:"]
+        # What the surface was last drawn with, it is only drawn again when that changes
+        self.content = None
 
     def show(self):
         self.visible = True
@@ -87,7 +131,17 @@ class menu:
                 f'Velocity: {int(np.linalg.norm(body.velocity))}m/s']
         return text
 
+    def generate_selection_data(self, bodies, indices):
+        text = ["OBJECT DATA:",
+                f'Bodies: {len(indices)}',
+                f'Nearest: {bodies[indices[0]].name}',
+                f'Total mass: {bodies.masses[indices].sum()}kg']
+        return text
+
     def add_to_menu(self, text):
+        if text == self.content:
+            return
+        self.content = text
         self.surface.fill(BLACK)  # Remove all previous data
         current_y = self.line_start
 
@@ -98,6 +152,9 @@ class menu:
 
     def draw_data_input(self, pos):
         # Draw categories
+        if self.content == ("input", pos):
+            return
+        self.content = ("input", pos)
         self.surface.fill(BLACK)
         current_y = self.line_start
         for category in self.categories:
@@ -107,127 +164,224 @@ class menu:
 
     def draw_menu(self):
         if self.visible:
-            screen.blit(self.surface, self.surface_position)
+            scene.blit(self.surface, self.surface_position)
+
+
+class compositor:
+    # Puts each frame together from the scene layer and the overlays added to it that frame. An
+    # overlay is a key for what it shows, the rectangle it covers and a function that draws it
+    # Only the rectangles of the overlays that came, went or changed since the last frame are drawn
+    # and sent to the display, unless full is set because the scene changed under all of them
+    def __init__(self, screen, scene):
+        self.screen = screen
+        self.scene = scene
+        self.full = True
+        self._overlays = []
+        self._shown = []
+
+    def add(self, key, rect, draw):
+        self._overlays.append((key, pygame.Rect(rect), draw))
+
+    def add_surface(self, key, surface, position):
+        rect = surface.get_rect(topleft=position)
+        self.add(key, rect, lambda: self.screen.blit(surface, rect))
+
+    def present(self):
+        # Draw the frame, returns the rectangles sent to the display
+        overlays, self._overlays = self._overlays, []
+        if self.full:
+            self.screen.blit(self.scene, (0, 0))
+            for _, _, draw in overlays:
+                draw()
+            pygame.display.flip()
+            dirty = [self.screen.get_rect()]
+        else:
+            shown = {(key, tuple(rect)) for key, rect, _ in self._shown}
+            current = {(key, tuple(rect)) for key, rect, _ in overlays}
+            dirty = [rect for key, rect, _ in self._shown if (key, tuple(rect)) not in current] + \
+                    [rect for key, rect, _ in overlays if (key, tuple(rect)) not in shown]
+            for area in dirty:
+                # The scene under the area, then every overlay that reaches into it, in order
+                self.screen.set_clip(area)
+                self.screen.blit(self.scene, area, area)
+                for _, rect, draw in overlays:
+                    if rect.colliderect(area):
+                        draw()
+            self.screen.set_clip(None)
+            if dirty:
+                pygame.display.update(dirty)
+        self._shown = overlays
+        self.full = False
+        return dirty
 
 
 def create_new_body(mass, velocity, radius, size, name):
-    new_body = body(mass, [0, velocity], [radius, 0], size, name)
+    new_body = body(mass, *new_body_vectors(velocity, radius), size, name)
+    # The physics thread has its own copy of the arrays, restart it with the new body
+    threaded = runner.threaded
+    runner.stop()
+    # A recording is for a fixed set of bodies, so it ends here, the drift would jump with the new body too
+    stop_recording()
+    stop_diagnostics()
     bodies.append(new_body)
-
-
-def calculate_gravity(bodies):
-    # Initialise bodies with no acceleration
-    for body in bodies:
-        body.acceleration = np.zeros(2, dtype=float)
-
-    for i, body1 in enumerate(bodies):
-        # Cycle through all the bodies in the body list
-        for j, body2 in enumerate(bodies):
-            # Only if the 2 bodies are different, run the calculations
-            if i != j:
-                # Find vector direction by getting the distance and normalising it
-                resultant_vector = body2.position - body1.position  # r = p2-p1 calculates the direction of vector
-                resultant_direction = max(np.linalg.norm(resultant_vector),
-                                          1e-20)  # Find the direction by normalising vector, set lowest value to 1e-20
-                # max(a, b) returns the bigger value, either the calculated value or the set value
-
-                # make sure we are never dealing with negatives
-                if resultant_direction > 0:
-                    # Use Newtons equation to calculate the force magnitude between the 2 bodies
-                    force_magnitude = (G * body1.mass * body2.mass) / (resultant_direction ** 2)
-                    # Get the force vector with r^ = r / |r| UNIT vector equation
-                    force_vector = force_magnitude * (
-                            resultant_vector / resultant_direction)
-                    # Apply forces to body F = m * a -> a = F/m
-                    body1.acceleration += force_vector / body1.mass
-
-def calculate_gravitational_potential(bodies, toggle_arrows):
-    if toggle_arrows:
-        for i, body1 in enumerate(bodies):
-            for j, body2 in enumerate(bodies):
-                if i != j:
-                    # Calculate distance and other variables
-                    direction = body2.position - body1.position
-                    distance = np.linalg.norm(direction)
-                    direction_unit_vector = direction / distance
-
-                    mass1 = body1.mass
-                    mass2 = body2.mass
-                    # Calculate where Phi is 0 by this equation
-                    '''
-                    Phi = -GM/R1 
-                    Phi net = -GM1/R1 - GM2/R2
-                    Phi net = 0
-                    GM1/R1 = -GM2/R2 --> ignore signs, only worry about magnitudes being equal
-                    GM1/R1 = GM2/R2 Remove Like terms
-                    M1/R1 = M2/R2  (R1 + R2 = D) Put all in terms of R1
-                    M1/R1 = M2/(D - R1) --> M1D - M1R1 = M2R1 --> M1D = M2R1 + M1R1
-                    M1D = R1(M2 + M1)
-                    final equation
-                    R1 = M1D/(M2 + M1) 
-                    '''
-
-                    R1 = (distance * mass1) / (mass1 + mass2)
-
-                    zero_point_real = (body1.position + (direction_unit_vector * R1))
-                    zero_point_x = zero_point_real[0] * pixel_scale + CenterX
-                    zero_point_y = zero_point_real[1] * pixel_scale + CenterY
-                    zero_point = (zero_point_x, zero_point_y)
-                    begin_point_x = body1.position[0] * pixel_scale + CenterX
-                    begin_point_y = body1.position[1] * pixel_scale + CenterY
-                    begin_point = (begin_point_x, begin_point_y)
-
-                    # Draw an arrow
-                    DrawArrow(begin_point, zero_point, (body1.radius + body2.radius)//2)
-
-
-def update_bodies(bodies, dt):
-    for body in bodies:
-        # use suvat to solve for new speed
-        body.velocity += body.acceleration * dt  # v=u+at
-        # update position with suvat
-        body.position += body.velocity * dt  # s=s1 + s2 (s2 = v * dt)
-
-
-def draw_body(bodies):
-    for body in bodies:
-        # Find where body would be on screen based on pixel scale
-        body_x = int(body.position[0] * pixel_scale) + CenterX
-        body_y = int(body.position[1] * pixel_scale) + CenterY
-
-        # Trajectory tracking
-        if trajectories_on and not paused:
-            body.past_positions.append([body.position[0], body.position[1]])
-            if len(body.past_positions) > 500:
-                body.past_positions.pop(0)
-        if not trajectories_on:
-            body.past_positions = []
-
-
-        # Calculate a hit box area
-        hit_box_rect = body.hit_box_surface.get_rect(
-            center=(body_x, body_y))  # Centre the rectangle at the bodies coordinates
-        body.hit_box_rect = hit_box_rect
-        pygame.draw.circle(screen, WHITE, (body_x, body_y),
-                           body.radius)  # The scale of the object is determined by mass
-
-
-def check_planet_hitboxes(bodies, pos):
-    for body in bodies:
-        hitbox_rect = body.hit_box_surface.get_rect(center=(int(body.position[0] * pixel_scale) + CenterX,
-                                                            int(body.position[
-                                                                    1] * pixel_scale) + CenterY))  # find the rectangle for that surface
-        # Collidepoint() checks if the event was on the rectangle
-        if hitbox_rect.collidepoint(pos):
-            return True, body
-    return False, None
+    if threaded:
+        runner.start(dt * FPS)
+
+
+def next_choice(choices, value):
+    # The choice after value, values loaded from a file may fall between the choices
+    return next((choice for choice in choices if choice > value), choices[0])
+
+
+def update_and_record(bodies, dt):
+    # The step the physics runner takes, writes every step to the recording when there is one
+    update_bodies(bodies, dt)
+    if active_recorder is not None and len(bodies) != active_recorder.bodies:
+        # Collisions merged some bodies, a recording is for a fixed set of bodies so it ends here
+        stop_recording()
+    if active_recorder is not None:
+        active_recorder.append(bodies.positions, bodies.velocities, dt)
+    if active_monitor is not None:
+        active_monitor.measure(bodies, dt)
+
+
+def stop_recording():
+    global active_recorder
+    if active_recorder is not None:
+        active_recorder.close()
+        active_recorder = None
+
+
+def stop_diagnostics():
+    global active_monitor
+    if active_monitor is not None:
+        active_monitor.close()
+        active_monitor = None
+    physics.track_potential = False
+
+
+def load_replay(path):
+    # Bodies to draw a recording with, and a player that moves them through its frames
+    recorded = recording.recording(path)
+    if len(recorded) == 0:
+        return None, None
+    replay_bodies = system([body(mass, [0, 0], [0, 0], radius, name)
+                            for mass, radius, name in zip(recorded.masses, recorded.radii, recorded.names)])
+    return replay_bodies, recording.player(recorded)
+
+
+def calculate_gravitational_potential(bodies, view):
+    if view == "arrows":
+        i, j, zero_points = potential_zero_points(bodies.positions, bodies.masses)
+        begin_points = screen_positions(bodies.positions)[i]
+        zero_points = screen_positions(zero_points)
+        # Only the arrows that cross the screen
+        shown = segments_on_screen(begin_points, zero_points, screen_width, screen_height)
+        i, j, begin_points, zero_points = i[shown], j[shown], begin_points[shown], zero_points[shown]
+        radii = bodies.radii.astype(int)
+        for begin_point, zero_point, scale in zip(begin_points, zero_points, (radii[i] + radii[j]) // 2):
+            # Draw an arrow
+            DrawArrow(tuple(begin_point), tuple(zero_point), int(scale))
+
+
+def draw_potential_field(bodies, view):
+    # Colour map of the potential, and its contours, made into surfaces only when the field changes
+    global field_surface, contour_surface
+    if view not in ("field", "field and contours"):
+        return
+    if field.update(bodies.positions, bodies.masses, pixel_scale, (CenterX, CenterY), projection) \
+            or field_surface is None:
+        size = (field.columns * field.cell, field.rows * field.cell)
+        field_surface = pygame.transform.smoothscale(pygame.surfarray.make_surface(field.colours()), size)
+        contour_surface = None
+    scene.blit(field_surface, (0, 0))
+    if view == "field and contours":
+        if contour_surface is None:
+            lines = field.contours()
+            contour_surface = pygame.surfarray.make_surface(lines[..., np.newaxis] * np.array(WHITE, dtype=np.uint8))
+            contour_surface.set_colorkey(BLACK)
+        scene.blit(contour_surface, (0, 0))
+
+
+def screen_positions(points):
+    # Find where every point would be on screen based on the camera and pixel scale, in one go
+    return projection.project(points, pixel_scale, (CenterX, CenterY))
+
+
+def pixel_positions(points):
+    # Truncate the same way int() did for each body
+    return projection.project(points, pixel_scale, (0, 0)).astype(int) + (CenterX, CenterY)
+
+
+def visible_bodies(bodies):
+    # Render pass shared by the drawing below, where every body is on screen and which ones are
+    # worth drawing: on screen, and only the biggest of any bodies that land on the same pixel
+    # Also returns the picking index of every body on screen, for the mouse until the next frame
+    body_xy = screen_positions(bodies.positions)
+    on = np.flatnonzero(on_screen(body_xy, bodies.radii, screen_width, screen_height))
+    pixel_xy = pixel_positions(bodies.positions)
+    picker = screen_index(pixel_xy, bodies.radii, on, screen_width, screen_height)
+    return body_xy, one_per_pixel(on, pixel_xy, bodies.radii), picker
+
+
+def draw_particles(bodies):
+    # Every test particle on screen is one pixel, written straight into the screen's pixels
+    if bodies.particles is None or len(bodies.particles) == 0:
+        return
+    # Kept in float32 like the particles, and only the ones on screen are made into pixel indices
+    pixel_xy = projection.project(bodies.particles.positions, pixel_scale, (CenterX, CenterY), dtype=np.float32)
+    x, y = pixel_xy[:, 0], pixel_xy[:, 1]
+    on = (x >= 0) & (x < screen_width) & (y >= 0) & (y < screen_height)
+    pixels = pygame.surfarray.pixels2d(scene)
+    pixels[x[on].astype(int), y[on].astype(int)] = scene.map_rgb(GREY)
+    # The surface stays locked while the pixel array is held
+    del pixels
+
+
+def draw_body(bodies, shown):
+    body_xy = pixel_positions(bodies.positions[shown])
+    # Trajectory tracking, the newest point of every body goes in at once
+    if trajectories_on and not paused:
+        trails.push(bodies.positions)
+    if not trajectories_on:
+        trails.clear()
+
+    for radius, (body_x, body_y) in zip(bodies.radii[shown], body_xy):
+        pygame.draw.circle(scene, WHITE, (body_x, body_y),
+                           radius)  # The scale of the object is determined by mass
+
+
+def check_planet_hitboxes(bodies, picker, pos):
+    # The hit box is a square of side 2 * radius centred on the body, looked up in the picking
+    # index of the frame on screen. Of overlapping hit boxes the nearest centre wins
+    index = picker.pick(pos) if picker is not None else None
+    if index is None or index >= len(bodies):
+        return False, None
+    return True, bodies[index]
+
+
+def draw_highlights(bodies, hovered, selected_bodies, box_start, mouse_pos):
+    # Ring around the body under the mouse and every box selected body, and the box being dragged
+    rings = [(index, width) for index, width in [(hovered, 1)] + [(index, 2) for index in selected_bodies]
+             if index is not None and index < len(bodies)]
+    if rings:
+        rows = [index for index, _ in rings]
+        for (index, width), centre, radius in zip(rings, pixel_positions(bodies.positions[rows]),
+                                                  bodies.radii[rows] + 4):
+            centre = tuple(int(c) for c in centre)
+            size = 2 * int(radius) + 3
+            composer.add(("ring", index, width, centre, radius), pygame.Rect(0, 0, size, size).move(
+                centre[0] - size // 2, centre[1] - size // 2),
+                lambda centre=centre, radius=radius, width=width: pygame.draw.circle(screen, RED, centre, radius,
+                                                                                     width))
+    if box_start is not None:
+        left, top = min(box_start[0], mouse_pos[0]), min(box_start[1], mouse_pos[1])
+        box = pygame.Rect(left, top, abs(mouse_pos[0] - box_start[0]) + 1, abs(mouse_pos[1] - box_start[1]) + 1)
+        composer.add(("box", tuple(box)), box, lambda: pygame.draw.rect(screen, RED, box, 1))
 
 
 def draw_pause_buttons():
-    if paused:
-        screen.blit(pause_image, (50, 50))
-    else:
-        screen.blit(play_image, (50, 50))
+    composer.add_surface(("pause", paused), pause_image if paused else play_image, (50, 50))
 
 
 def on_pause(pos):
@@ -235,13 +389,31 @@ def on_pause(pos):
         return True
 
 
-def name_bodies(bodies):
-    for body in bodies:
-        name = body.name
-        text_surface = font.render(name, True, WHITE)
-        text_x = (body.position[0] * pixel_scale) + CenterX
-        text_y = (body.position[1] * pixel_scale) + CenterY
-        screen.blit(text_surface, (text_x + body.radius, text_y - 2 * body.radius))
+def label_surface(text, colour=WHITE):
+    if (text, colour) not in label_surfaces:
+        if len(label_surfaces) >= LABEL_CACHE_SIZE:
+            label_surfaces.clear()
+        label_surfaces[text, colour] = font.render(text, True, colour)
+    return label_surfaces[text, colour]
+
+
+def hud_text(text, position, colour=WHITE):
+    # A line of text over the scene, rendered again only when the text changes
+    composer.add_surface((text, colour), label_surface(text, colour), position)
+
+
+def name_bodies(bodies, body_xy, shown):
+    if len(shown) == 0:
+        return
+    surfaces = [label_surface(bodies[i].name) for i in shown]
+    radii = bodies.radii[shown]
+    corners = body_xy[shown] + np.stack([radii, -2 * radii], axis=1)
+    sizes = np.array([surface.get_size() for surface in surfaces])
+    # Heavier bodies get their label first, the labels that would overlap it are counted on it
+    placed, merged = place_labels(corners, sizes, bodies.masses[shown], screen_width, screen_height)
+    for k, others in zip(placed, merged):
+        name = bodies[shown[k]].name
+        scene.blit(label_surface(f'{name} +{others}' if others else name), tuple(corners[k]))
 
 
 def draw_clock(new_time):
@@ -254,34 +426,153 @@ def draw_clock(new_time):
     new_time %= 3600
 
     clock_text = f' T+ {days}:Days  {hours}:Hours'
-    clock_surface = font.render(clock_text, True, WHITE)
-    screen.blit(clock_surface, (screen_width * 0.75, 70))
+    hud_text(clock_text, (screen_width * 0.75, 70))
 
 
-def draw_input_boxes(x, y):
-    current_y = y
-    input_boxes = []
-    for i in range(5):
-        input_box_rect = pygame.Rect(x, current_y - 4, 100, 26)
-        pygame.draw.rect(screen, RED, pygame.Rect(x, current_y - 4, 100, 26), 2)
-        input_boxes.append(input_box_rect)
-        current_y += 29
-    return input_boxes
-
-
-def display_input_numbers(x, y):
-    current_y = y
-    mass_surface = font.render(mass_text, True, WHITE)
-    velocity_surface = font.render(velocity_text, True, WHITE)
-    radius_surface = font.render(radius_text, True, WHITE)
-    size_surface = font.render(size_text, True, WHITE)
-    name_surface = font.render(name_text, True, WHITE)
+def draw_solver(use_barnes_hut, theta, use_particle_mesh, mesh_size, mesh_short_range, integrator, softening,
+                collisions, backend, precision):
+    if use_particle_mesh:
+        solver_text = f' Gravity: {"P3M" if mesh_short_range else "Particle-mesh"}  mesh {mesh_size}'
+    elif use_barnes_hut:
+        solver_text = f' Gravity: Barnes-Hut  theta {theta}'
+    else:
+        solver_text = f' Gravity: Exact ({"Numba" if backend == "jit" else "NumPy"})'
+    if softening:
+        solver_text += f'  softening {softening:g} m'
+    if precision != "standard":
+        solver_text += f'  {precision}'
+    hud_text(solver_text, (screen_width * 0.75, 100))
+    hud_text(f' Integrator: {integrator.name}', (screen_width * 0.75, 130))
+    if isinstance(integrator, block_leapfrog):
+        # Bodies on each timestep level, level k steps dt / 2^k
+        counts = integrator.level_counts()
+        levels_text = '  '.join(f'dt/{2 ** level}: {count}' for level, count in enumerate(counts) if count)
+        hud_text(f' Steps  {levels_text}', (screen_width * 0.75, 190))
+    if collisions != "off":
+        hud_text(f' Collisions: {collisions}', (screen_width * 0.75, 250))
+
+
+def draw_recording(active_recorder, replay):
+    if replay is not None:
+        recording_text = f' Replay: frame {replay.frame + 1}/{len(replay.recording)}  speed {replay.speed:g}x'
+    elif active_recorder is not None:
+        recording_text = f' Recording: {active_recorder.frames} steps'
+    else:
+        return
+    hud_text(recording_text, (screen_width * 0.75, 220), RED)
+
+
+def draw_diagnostics(active_monitor):
+    # Drift of each conserved quantity since the d key was pressed, latest and worst
+    if active_monitor is None or active_monitor.latest is None:
+        return
+    summary = active_monitor.summary()
+    for k, (name, label) in enumerate([("energy_error", "Energy"), ("momentum_error", "Momentum"),
+                                       ("angular_momentum_error", "Ang. momentum")]):
+        drift_text = f' {label} drift: {summary[name]:.2e}  worst {summary[name + "_worst"]:.2e}'
+        hud_text(drift_text, (screen_width * 0.75, 280 + 30 * k))
+
+
+def entered_body():
+    # The body the input boxes would make, as (mass, position, velocity), None until they are numbers
+    mass, velocity, radius = (parse_number(text) for text in input_texts[:3])
+    if mass is None or velocity is None or radius is None:
+        return None
+    # Where create_new_body puts it
+    velocity, position = new_body_vectors(velocity, radius)
+    return mass, tuple(position), tuple(velocity)
+
+
+def new_body_vectors(velocity, radius):
+    # Velocity and position of a new body, radius to the right of the origin on screen and moving
+    # down the screen, so it orbits in the plane of the view. Looking straight down that is the x-y
+    # plane, a tilted or turned view gives an inclined orbit
+    return projection.in_view_plane(0.0, velocity), projection.in_view_plane(radius, 0.0)
+
+
+def draw_prediction(predictor, horizon, now):
+    if not horizon:
+        return
+    times, path = predictor.ahead(now)
+    if len(times) < 2:
+        return
+    for k in range(path.shape[1]):
+        points = screen_positions(path[:, k])
+        # Only the runs of segments that cross the screen are drawn
+        visible = segments_on_screen(points[:-1], points[1:], screen_width, screen_height)
+        edges = np.flatnonzero(np.diff(np.concatenate([[0], visible.astype(int), [0]])))
+        for begin, end in zip(edges[::2], edges[1::2]):
+            pygame.draw.lines(scene, BLUE, False, points[begin:end + 1].tolist())
+
+
+def draw_prediction_horizon(horizon):
+    if not horizon:
+        return
+    days = horizon / 86400
+    horizon_text = f'{days:g} days' if days < 365 else f'{days / 365.25:g} year' + ('s' if days > 366 else '')
+    hud_text(f' Prediction: {horizon_text}', (screen_width * 0.75, 370), BLUE)
+
+
+def draw_camera(projection):
+    # Only shown once the view has been turned or tilted away from straight down
+    if projection.angles == CAMERA_VIEWS[0]:
+        return
+    camera_text = f' View: turn {projection.turn:g}  tilt {projection.tilt:g}'
+    hud_text(camera_text, (screen_width * 0.75, 400))
+
+
+def draw_profile(profile):
+    # Rolling graph of the last frames, each stacked from its stages, with the mean of each stage
+    if not profile.enabled or profile.frames == 0:
+        return
+    height = 100
+    # A frame that takes all of 1 / FPS reaches half way up
+    image = profile.graph(height, 1e3 / FPS / (height / 2))
+    graph_surface = pygame.transform.scale(pygame.surfarray.make_surface(image), (2 * PROFILE_HISTORY, height))
+    averages, fps = profile.averages()
+    texts = [(font.render(f' {fps:.0f} FPS  {sum(averages.values()):.1f} ms', True, WHITE),
+              (2 * PROFILE_HISTORY + 10, 0))]
+    for k, (stage, ms) in enumerate(averages.items()):
+        column, row = divmod(k, 4)
+        colour = tuple(int(c) for c in STAGE_COLOURS[k % len(STAGE_COLOURS)])
+        texts.append((font.render(f' {stage} {ms:.1f}', True, colour),
+                      (2 * PROFILE_HISTORY + 10 + 130 * column, 22 * (row + 1))))
+    # Drawn on a panel of its own that the scene shows through, a new one every frame
+    panel = pygame.Surface((max(x + surface.get_width() for surface, (x, y) in texts), height))
+    panel.set_colorkey(BLACK)
+    panel.blit(graph_surface, (0, 0))
+    pygame.draw.line(panel, WHITE, (0, height // 2), (2 * PROFILE_HISTORY, height // 2))
+    for surface, position in texts:
+        panel.blit(surface, position)
+    composer.add_surface(("profile", profile.frames), panel, (screen_width * 0.35, 10))
+
+
+def draw_physics_rate(runner):
+    if runner.threaded:
+        rate_text = f' Physics thread: {runner.steps_last_frame} steps'
+    else:
+        rate_text = f' Physics: {runner.steps_last_frame} steps/frame'
+    hud_text(rate_text, (screen_width * 0.75, 160))
 
-    surfaces = [mass_surface, velocity_surface, radius_surface, size_surface, name_surface]
 
-    for surface in surfaces:
-        screen.blit(surface, (x, current_y))
-        current_y += 29
+def draw_input_boxes(x, y):
+    # The boxes, the text typed into each and why Enter did not make the body, over the scene
+    # The typed text only gets rendered again when it changes, label_surface keeps each string's surface
+    input_boxes = [pygame.Rect(x, y - 4 + 29 * i, 100, 26) for i in range(len(BODY_FIELDS))]
+    texts = [(label_surface(text), (x, y + 29 * i)) for i, text in enumerate(input_texts)]
+    if input_error is not None:
+        texts.append((label_surface(input_error[1]), (x - 100, y + 29 * len(input_texts) + 4)))
+    area = input_boxes[0].unionall(input_boxes[1:] + [surface.get_rect(topleft=position)
+                                                      for surface, position in texts])
+
+    def draw():
+        for i, box in enumerate(input_boxes):
+            wrong = input_error is not None and input_error[0] == i
+            pygame.draw.rect(screen, WHITE if wrong else RED, box, 2)
+        for surface, position in texts:
+            screen.blit(surface, position)
+    composer.add(("input", tuple(input_texts), input_error), area, draw)
+    return input_boxes
 
 def TimeWarpForward(dt):
     dt *= 2
@@ -304,17 +595,18 @@ def DrawArrow(beginPoint, endPoint, scale):
     right_y = end[1] - scale * math.sin(angle + math.pi / 6) * 5
 
     # First drw the line from point to point
-    pygame.draw.line(screen, pygame.Color('blue'), beginPoint, endPoint, scale)
+    pygame.draw.line(scene, pygame.Color('blue'), beginPoint, endPoint, scale)
     # Draw arrow head
-    pygame.draw.polygon(screen, pygame.Color('blue'), [(end[0], end[1]), (left_x, left_y), (right_x, right_y)])
+    pygame.draw.polygon(scene, pygame.Color('blue'), [(end[0], end[1]), (left_x, left_y), (right_x, right_y)])
 
 def DrawTrajectories(bodies):
-    for body in bodies:
-        # For every point in the trajectory point draw a line
-        for i in range(len(body.past_positions) - 1):
-            pygame.draw.line(screen, pygame.Color('white'),
-                             ((body.past_positions[i][0] * pixel_scale) + CenterX, (body.past_positions[i][1] * pixel_scale) + CenterY),
-                             ((body.past_positions[i+1][0] * pixel_scale) + CenterX, (body.past_positions[i+1][1] * pixel_scale)+ CenterY), body.radius//2)
+    if len(trails.points) != len(bodies):
+        return
+    widths = bodies.radii.astype(int) // 2
+    # Every trail is moved onto the screen together and drawn as one polyline per body
+    for i, points in trails.screen_polylines(projection, pixel_scale, (CenterX, CenterY),
+                                             rows=np.flatnonzero(widths > 0), viewport=(screen_width, screen_height)):
+        pygame.draw.lines(scene, WHITE, False, points.tolist(), int(widths[i]))
 
 def LockPlanet(body, locked):
     global CenterX
@@ -323,8 +615,428 @@ def LockPlanet(body, locked):
     global offset_y
 
     if locked and body != None:
-        CenterX = -(body.position[0] * pixel_scale) + screen_width / 2 + offset_x
-        CenterY = -(body.position[1] * pixel_scale) + screen_height / 2 + offset_y
+        body_x, body_y = projection.project(body.position, pixel_scale, (0, 0))
+        CenterX = -body_x + screen_width / 2 + offset_x
+        CenterY = -body_y + screen_height / 2 + offset_y
+
+
+# Commands, carried out at the start of a frame in the order they were queued, see commands.py
+# Each one changes the window's state, the names are the ones in the command logs
+def quit_simulation():
+    global running
+    running = False
+
+
+def show_input():
+    input_menu.show()
+
+
+def hide_input():
+    input_menu.hide()
+
+
+def shift_down():
+    global shifting
+    shifting = True
+
+
+def shift_up():
+    global shifting
+    shifting = False
+
+
+def toggle_trails():
+    global trajectories_on
+    trajectories_on = not trajectories_on
+    trails.clear()
+
+
+def cycle_potential():
+    # Potential arrows, field and contours, then off again
+    global potential_view
+    potential_view = POTENTIAL_VIEWS[(POTENTIAL_VIEWS.index(potential_view) + 1) % len(POTENTIAL_VIEWS)]
+
+
+# Time Warping, while replaying this changes the replay speed instead
+def warp_faster():
+    global dt
+    if replay is not None:
+        replay.speed = TimeWarpForward(replay.speed)
+    else:
+        dt = TimeWarpForward(dt)
+
+
+def warp_slower():
+    global dt
+    if replay is not None:
+        replay.speed = TimeWarpBackward(replay.speed)
+    else:
+        dt = TimeWarpBackward(dt)
+
+
+def warp_reset():
+    global dt
+    if replay is not None:
+        # Play backwards
+        replay.speed = -replay.speed
+    else:
+        dt = 1800
+
+
+# Jump to the start or end of a replay
+def replay_start():
+    if replay is not None:
+        replay.seek(0)
+
+
+def replay_end():
+    if replay is not None:
+        replay.seek(len(replay.recording) - 1)
+
+
+def cycle_solver():
+    solver = (physics.use_barnes_hut, physics.use_particle_mesh, physics.mesh_short_range)
+    following = SOLVER_CHOICES.index(solver) + 1 if solver in SOLVER_CHOICES else 0
+    physics.use_barnes_hut, physics.use_particle_mesh, physics.mesh_short_range = \
+        SOLVER_CHOICES[following % len(SOLVER_CHOICES)]
+
+
+def toggle_backend():
+    # Compiled exact gravity, only when Numba is installed
+    if JIT_AVAILABLE:
+        physics.backend = "numpy" if physics.backend == "jit" else "jit"
+
+
+def toggle_precision():
+    # Compensated sums, the same bits on every backend
+    next_precision = (physics.PRECISIONS.index(physics.precision) + 1) % len(physics.PRECISIONS)
+    physics.precision = physics.PRECISIONS[next_precision]
+
+
+def cycle_accuracy():
+    if physics.use_particle_mesh:
+        physics.mesh_size = next_choice(MESH_CHOICES, physics.mesh_size)
+    else:
+        physics.theta = next_choice(THETA_CHOICES, physics.theta)
+
+
+def cycle_integrator():
+    next_integrator = (INTEGRATORS.index(type(physics.integrator)) + 1) % len(INTEGRATORS)
+    physics.integrator = INTEGRATORS[next_integrator]()
+
+
+# Collisions off, merging or bouncing, and the softening length
+def cycle_collisions():
+    next_mode = (physics.COLLISION_MODES.index(physics.collisions) + 1) % len(physics.COLLISION_MODES)
+    physics.collisions = physics.COLLISION_MODES[next_mode]
+
+
+def cycle_softening():
+    physics.softening = next_choice(SOFTENING_CHOICES, physics.softening)
+
+
+def toggle_thread():
+    # Physics in a background thread, not while a command log plays, the thread's steps do not
+    # line up with the frames so the run would not come out the same
+    if command_script is not None:
+        return
+    if runner.threaded:
+        runner.stop()
+    else:
+        runner.start(dt * FPS)
+
+
+def toggle_recording():
+    # Record every physics step to recording.RECORDING_PATH
+    global active_recorder
+    if replay is not None:
+        return
+    threaded = runner.threaded
+    runner.stop()
+    if active_recorder is not None:
+        stop_recording()
+    else:
+        active_recorder = recording.recorder(recording.RECORDING_PATH, bodies, dt,
+                                             physics.integrator.name, start_time=current_time)
+    if threaded:
+        runner.start(dt * FPS)
+
+
+def cycle_prediction():
+    # Predicted path of the selected body and the body being entered
+    global prediction_horizon
+    prediction_horizon = next_choice(PREDICTION_HORIZONS, prediction_horizon)
+
+
+def toggle_profile():
+    # Time every stage of the frame, the trace goes to TRACE_PATH when it is turned off
+    if profile.enabled:
+        profile.stop()
+        profile.save_trace(TRACE_PATH)
+    else:
+        profile.start()
+
+
+def toggle_diagnostics():
+    # Stream the drift of the conserved quantities to DIAGNOSTICS_PATH
+    global active_monitor
+    if replay is not None:
+        return
+    threaded = runner.threaded
+    runner.stop()
+    if active_monitor is not None:
+        stop_diagnostics()
+    else:
+        physics.track_potential = True
+        active_monitor = monitor(DIAGNOSTICS_PATH, current_time)
+        active_monitor.measure(bodies)
+    if threaded:
+        runner.start(dt * FPS)
+
+
+def toggle_replay():
+    # Replay the last recording
+    global replay, bodies
+    if replay is not None:
+        replay = None
+        bodies = live_bodies
+    else:
+        runner.stop()
+        stop_recording()
+        stop_diagnostics()
+        if os.path.exists(recording.RECORDING_PATH):
+            replay_bodies, replay = load_replay(recording.RECORDING_PATH)
+            if replay is not None:
+                bodies = replay_bodies
+    forget_selection()
+
+
+def save_checkpoint():
+    # Save a checkpoint, time, dt, integrator and all
+    if replay is not None:
+        return
+    threaded = runner.threaded
+    runner.stop()
+    size = len(bodies) + (0 if bodies.particles is None else len(bodies.particles))
+    save_path = SCENARIO_PATH if size <= JSON_BODY_LIMIT else BINARY_SCENARIO_PATH
+    save_scenario(save_path, bodies, runner.time, dt, physics.integrator)
+    if threaded:
+        runner.start(dt * FPS)
+
+
+def load_checkpoint():
+    # Load the last checkpoint saved
+    global replay, bodies, current_time, dt, live_bodies, runner
+    saved = [path for path in (SCENARIO_PATH, BINARY_SCENARIO_PATH) if os.path.exists(path)]
+    if not saved:
+        return
+    runner.stop()
+    stop_recording()
+    stop_diagnostics()
+    replay = None
+    bodies, settings = load_scenario(max(saved, key=os.path.getmtime))
+    current_time, saved_dt = restore_settings(bodies, settings)
+    dt = saved_dt or dt
+    live_bodies = bodies
+    runner = physics_runner(bodies, update_and_record, profiler=profile)
+    runner.time = current_time
+    forget_selection()
+
+
+def forget_selection():
+    # The bodies were swapped for others, nothing picked before is there any more
+    global selected_planet, selected_bodies, picker, planet_locked, last_scene_key
+    selected_planet = None
+    selected_bodies = []
+    picker = None
+    planet_locked = False
+    # The picker is made with the scene, so the next frame draws the scene again
+    last_scene_key = None
+    # The trails belong to the other set of bodies
+    trails.clear()
+
+
+def reset_view():
+    global CenterX, CenterY, planet_locked, selected_planet, selected_bodies, offset_x, offset_y
+    CenterX = screen_width // 2
+    CenterY = screen_height // 2
+    planet_locked = False
+    selected_planet = None
+    selected_bodies = []
+    offset_x = 0
+    offset_y = 0
+    projection.turn, projection.tilt = CAMERA_VIEWS[0]
+
+
+def pan(x, y):
+    # Move around the screen, a locked planet stays locked with the view offset from it
+    global CenterX, CenterY, offset_x, offset_y
+    if planet_locked:
+        offset_x += x
+        offset_y += y
+    else:
+        CenterX += x
+        CenterY += y
+
+
+# Zooming with shift
+def zoom_in():
+    global pixel_scale
+    if shifting:
+        pixel_scale *= 2
+    else:
+        pixel_scale += 0.005e-6
+
+
+def zoom_out():
+    global pixel_scale
+    if shifting:
+        pixel_scale /= 2
+    else:
+        pixel_scale -= 0.005e-6
+
+
+# Camera, v cycles the top-down, oblique and edge-on views, q and e turn it, Page Up and Page Down tilt it
+def cycle_view():
+    view = next((k for k, angles in enumerate(CAMERA_VIEWS) if angles == projection.angles), -1)
+    projection.turn, projection.tilt = CAMERA_VIEWS[(view + 1) % len(CAMERA_VIEWS)]
+
+
+# Typing into the input box with the focus
+def focus(box):
+    global current_box
+    current_box = box
+
+
+def type_text(text):
+    global input_error
+    if current_box != -1:
+        input_texts[current_box] += text
+        input_error = None
+
+
+def erase():
+    global input_error
+    if current_box != -1:
+        input_texts[current_box] = input_texts[current_box][:-1]
+        input_error = None
+
+
+def create_body():
+    # Make a new body once every box holds something, a box that holds the wrong thing is pointed out
+    # instead of crashing the window
+    global input_texts, input_error
+    if "" in input_texts:
+        return
+    values, input_error = parse_body_fields(input_texts)
+    if values is None:
+        return
+    mass, velocity, radius, size, name = values
+    create_new_body(mass=mass, velocity=velocity, radius=radius, size=size, name=name)
+    # reset the strings
+    input_texts = [""] * len(BODY_FIELDS)
+
+
+def click(x, y):
+    global paused, selected_bodies, selected_planet, planet_locked
+    # Check Pause Button
+    if on_pause((x, y)):
+        paused = not paused
+        return
+    # Check if body is selected
+    hit, hit_body = check_planet_hitboxes(bodies, picker, (x, y))
+    selected_bodies = []
+    if hit:
+        # Make menu visable and display the bodies data
+        data_menu.show()
+        selected_planet = hit_body
+        # If Shifting lock onto the planet
+        planet_locked = shifting
+    else:
+        # Hide menu if you click anywhere else
+        data_menu.hide()
+    # Check if a box was hit, anywhere else takes the focus off the boxes
+    focus(next((i for i, box in enumerate(input_boxes) if box.collidepoint((x, y))), -1))
+
+
+# Box select with the right mouse button
+def select_start(x, y):
+    global box_start
+    box_start = (x, y)
+
+
+def select_end(x, y):
+    global box_start, selected_bodies, selected_planet
+    if box_start is None:
+        return
+    if picker is not None:
+        selected_bodies = [int(index) for index in picker.in_box(box_start, (x, y)) if index < len(bodies)]
+    box_start = None
+    if len(selected_bodies) == 1:
+        selected_planet = bodies[selected_bodies[0]]
+        data_menu.show()
+    elif selected_bodies:
+        selected_planet = None
+        data_menu.show()
+
+
+COMMAND_HANDLERS = {
+    "quit": quit_simulation, "show_input": show_input, "hide_input": hide_input, "shift_down": shift_down,
+    "shift_up": shift_up, "toggle_trails": toggle_trails, "cycle_potential": cycle_potential,
+    "warp_faster": warp_faster, "warp_slower": warp_slower, "warp_reset": warp_reset,
+    "replay_start": replay_start, "replay_end": replay_end, "cycle_solver": cycle_solver,
+    "toggle_backend": toggle_backend, "toggle_precision": toggle_precision, "cycle_accuracy": cycle_accuracy,
+    "cycle_integrator": cycle_integrator,
+    "cycle_collisions": cycle_collisions, "cycle_softening": cycle_softening, "toggle_thread": toggle_thread,
+    "toggle_recording": toggle_recording, "cycle_prediction": cycle_prediction, "toggle_profile": toggle_profile,
+    "toggle_diagnostics": toggle_diagnostics, "toggle_replay": toggle_replay, "save_checkpoint": save_checkpoint,
+    "load_checkpoint": load_checkpoint, "reset_view": reset_view,
+    "pan_up": lambda: pan(0, 50), "pan_down": lambda: pan(0, -50),
+    "pan_left": lambda: pan(50, 0), "pan_right": lambda: pan(-50, 0),
+    "zoom_in": zoom_in, "zoom_out": zoom_out, "cycle_view": cycle_view,
+    "turn_left": lambda: projection.rotate(turn=-CAMERA_STEP), "turn_right": lambda: projection.rotate(turn=CAMERA_STEP),
+    "tilt_up": lambda: projection.rotate(tilt=CAMERA_STEP), "tilt_down": lambda: projection.rotate(tilt=-CAMERA_STEP),
+    "focus": focus, "unfocus": lambda: focus(-1), "type": type_text, "erase": erase, "create_body": create_body,
+    "click": click, "select_start": select_start, "select_end": select_end,
+}
+
+
+def queue_event(event, now):
+    # Turn a pygame event into commands, keys are turned into commands when they are carried out
+    # since what a key does depends on whether a box has the focus by then
+    if event.type == pygame.QUIT:
+        commands.push("quit")
+    elif event.type == pygame.MOUSEBUTTONDOWN and event.button == 3:
+        commands.push("select_start", *event.pos)
+    elif event.type == pygame.MOUSEBUTTONUP and event.button == 3:
+        commands.push("select_end", *event.pos)
+    elif event.type == pygame.MOUSEBUTTONDOWN and event.button == 1:
+        commands.push("click", *event.pos)
+    elif event.type == pygame.KEYDOWN:
+        name = pygame.key.name(event.key)
+        commands.push("key", name, event.unicode)
+        held_keys.press(name, event.unicode, now)
+    elif event.type == pygame.KEYUP:
+        name = pygame.key.name(event.key)
+        held_keys.release(name)
+        if name in KEY_RELEASE_COMMANDS:
+            commands.push(KEY_RELEASE_COMMANDS[name])
+    elif event.type == pygame.WINDOWFOCUSLOST:
+        held_keys.clear()
+    elif event.type in (pygame.WINDOWEXPOSED, pygame.VIDEOEXPOSE):
+        # Part of the window was uncovered, none of it can be taken as still on screen
+        composer.full = True
+
+
+def run_command(command):
+    # Carry out one command, written to the command log first when one is being recorded
+    if command[0] == "key":
+        command = key_command(command[1], command[2], current_box != -1)
+        if command is None:
+            return
+    if command_recorder is not None:
+        command_recorder.write(frame, command)
+    COMMAND_HANDLERS[command[0]](*command[1:])
 
 
 if __name__ == '__main__':
@@ -332,26 +1044,6 @@ if __name__ == '__main__':
 
     # Class definitions
 
-    # Bodies
-    Earth = body(5.24e24, [0, 0], [0, 0], 10, "Earth")
-    Minmus = body(3.5e22, [0, -600], [-900000000, 0], 2, "Minmus")
-    Moon = body(7.37e22, [0, -954], [-384000000, 0], 6, "Moon")
-    Asteroid = body(27.0e6, [0, 760], [600000000, 0], 2, "Asteroid 1")
-    Asteroid1 = body(27.0e6, [0, 660], [500000000, 0], 2, "Asteroid 2")
-    Asteroid2 = body(27.0e6, [0, 660], [400000000, 0], 2, "Asteroid 3")
-    GeoSat = body(120, [0, 2940], [40430423, 0], 1, "Geo Sat")
-    Sun = body(1.989e30, [0, 0], [0, 0], 20, "The Sun")
-    Moon2 = body(7.37e22, [0, 954 + 29785], [1.496e11 + 384000000, 0], 2, "Moon")
-    Mercury = body(3.30e23, [0, 47360], [5.79e10, 0], 2, "Mercury")
-    Venus = body(4.87e24, [0, 35020], [1.08e11, 0], 2, "Venus")
-    Earth2 = body(5.97e24, [0, 29780], [1.496e11, 0], 2, "Earth")
-    Mars = body(6.42e23, [0, 24070], [2.28e11, 0], 2, "Mars")
-    Jupiter = body(1.90e27, [0, 13070], [7.78e11, 0], 5, "Jupiter")
-    Saturn = body(5.68e26, [0, 9680], [1.43e12, 0], 4, "Saturn")
-    Uranus = body(8.68e25, [0, 6800], [2.87e12, 0], 3, "Uranus")
-    Neptune = body(1.02e26, [0, 5430], [4.50e12, 0], 3, "Neptune")
-    Phobos = body(1.07e16, [0, 24070 + 2138], [2.28e11 + 9.376e6 , 0], 2, "Phobos")
-    Deimos = body(1.48e15, [0, 24070 + 1350], [2.28e11 + 2.346e7, 0], 2, "Deimos")
     # Menus
     # 0.666 and 0.75 are static screen size percentages to make sure they work on any screen size, ignore
     data_menu = menu(350, 600, (50, screen_height * 0.666))
@@ -359,271 +1051,209 @@ if __name__ == '__main__':
     input_boxes = []
 
 
-    # Systems
-    # System1
-    #bodies = [Earth, Moon, Asteroid, Asteroid1, Asteroid2, Minmus, GeoSat]
-    # System 2
-    #bodies = [Earth, Moon]
-    # System 3
-    #bodies = [Earth, Moon, Asteroid, Asteroid1, Asteroid2]
-    # System 4
-    bodies = [Sun, Mercury, Venus, Earth2, Moon2, Mars, Phobos, Deimos, Jupiter, Saturn, Neptune]
-    # Empty Sys
-    #bodies = []
-    '''
-    for i in range(50):
-        bodies.append(
-            body(5.24e24, [0, 0], [
-                random.randint(0,2000000000000), random.randint(0,200000000000)
-            ], 10, "Earth")
-        )
-    '''
+    # Systems, see systems.py: system1, system2, system3, system4, asteroid_belt, pluto, random_earths, empty
+    # python main.py system1 picks another, python main.py scenario.json carries on from a checkpoint
+    # --record-commands writes every command carried out to a log, --play-commands plays one back
+    # frame for frame, as fast as it can, and closes the window at its end
+    parser = argparse.ArgumentParser(description="Show a system and run it in a window")
+    parser.add_argument("system", nargs="?", default="system4")
+    parser.add_argument("--record-commands", metavar="LOG", help="write every command to LOG, .jsonl")
+    parser.add_argument("--play-commands", metavar="LOG", help="carry out the commands in LOG instead of the input")
+    args = parser.parse_args()
+    start = args.system
+    if is_scenario_file(start):
+        bodies, settings = load_scenario(start)
+        current_time, saved_dt = restore_settings(bodies, settings)
+        dt = saved_dt or dt
+    else:
+        bodies = load_system(start)
 
     # Initialise variables
     selected_planet = None
     planet_locked = False
     trajectories_on = True
-    mouse_dragging = False
-    toggle_arrows = False
+    potential_view = "off"
+    prediction_horizon = 0
     shifting = False
     running = True
     paused = True
     input_menu.visible = False
     current_box = -1
-    last_mouse_pos = None
-    mass_text = ""
-    velocity_text = ""
-    radius_text = ""
-    size_text = ""
-    name_text = ""
+    # Picking index of the last frame drawn, bodies picked by a right button drag and where it began
+    picker = None
+    selected_bodies = []
+    box_start = None
+    # Text typed into each input box, and the box and message of the last body that could not be made
+    input_texts = [""] * len(BODY_FIELDS)
+    input_error = None
     offset_x = 0
     offset_y = 0
 
-    # Extras
-    trajectory_list = []
+    # Physics, steps the bodies in the render loop or in a background thread
+    runner = physics_runner(bodies, update_and_record, profiler=profile)
+    runner.time = current_time
+    # While a recording is replayed bodies is swapped for the recorded bodies, live_bodies keeps the real ones
+    replay = None
+    live_bodies = bodies
+
+    # The scene is drawn on its own layer, the overlays and the window's updates go through composer
+    composer = compositor(screen, scene)
+    last_scene_key = None
+
+    # Input waits in the command queue until the start of the next frame
+    commands = command_queue()
+    held_keys = key_repeat()
+    frame = 0
+    command_recorder = command_log(args.record_commands) if args.record_commands else None
+    command_script = read_command_log(args.play_commands, COMMAND_HANDLERS) if args.play_commands else None
+    if command_script is not None:
+        last_frame = max(command_script, default=0)
+        began = time.perf_counter()
 
     while running:
-
-        # Fill Background
-        screen.fill(BLACK)
-        # Lock FPS to 60
-        clock.tick(FPS)
-
-        # Calculate Physics
-        if not paused:
-            calculate_gravity(bodies)
-            # Update Physics
-            update_bodies(bodies, dt)
-
+        # Each profile.mark puts the time since the last one down to that stage of the frame
+        profile.begin_frame()
+
+        # Nothing moves while paused, so instead of drawing the same frame 60 times a second the loop
+        # sleeps until an event comes in, waking now and then for the prediction thread's new paths
+        if command_script is None and paused and not profile.enabled and len(held_keys) == 0:
+            event = pygame.event.wait(IDLE_WAIT_MS)
+            if event.type != pygame.NOEVENT:
+                queue_event(event, time.perf_counter())
+        # Lock FPS to 60, a command log plays as fast as the frames can be drawn
+        if command_script is None:
+            clock.tick(FPS)
+        profile.mark("wait")
 
         # Handle Events
-
-        # Get mouse position
+        # Everything that came in since the last frame is carried out now, before the physics and drawing
         mouse_pos = pygame.mouse.get_pos()
-        for event in pygame.event.get():
-            # If event is Quit
-            if event.type == pygame.QUIT:
-                running = False
-
-            # Check Mouse
-            if event.type == pygame.MOUSEBUTTONDOWN:
-                # Check Pause Button
-                if on_pause(mouse_pos):
-                    if paused:
-                        paused = False
-                    else:
-                        paused = True
-
-                else:
-                    # Check if body is selected
-                    # Check Hitboxes return True, the body
-                    if check_planet_hitboxes(bodies, event.pos)[0]:
-                        # Make menu visable
-                        data_menu.show()
-                        # Display the bodies data
-                        selected_planet = check_planet_hitboxes(bodies, event.pos)[1]
-                        # If Shifting lock onto the planet
-                        if shifting:
-                            planet_locked = True
-                            # Lock with the returned planet
-                        else:
-                            planet_locked = False
-
-                    else:
-                        # Hide menu if you click anywhere else
-                        data_menu.hide()
-
-                    # Check if a box was hit
-                    box_clicked = False
-                    for i, box in enumerate(input_boxes):
-                        if box.collidepoint(event.pos):
-                            current_box = i
-                            box_clicked = True
-                        if not box_clicked:
-                            current_box = -1  # Points to Null Box
-
-
-
-            # Check keyboard
-
-            # Check If the input shows or hides the input menus
-            if event.type == pygame.KEYDOWN:
-                if event.key == pygame.K_SEMICOLON:
-                    input_menu.show()
-                if event.key == pygame.K_QUOTE:
-                    input_menu.hide()
-
-                # Toggle shifting
-                if event.key == pygame.K_LSHIFT:
-                    shifting = True
-
-                # Show/Hide Trajectories:
-                if event.key == pygame.K_BACKSLASH:
-                    trajectories_on = not trajectories_on
-                    trajectory_list = []
-                # Show/Hide Potential Arrows
-                if event.key == pygame.K_PERIOD:
-                    toggle_arrows = not toggle_arrows
-                # Time Warping
-                if event.key == pygame.K_RIGHTBRACKET:
-                    dt = TimeWarpForward(dt)
-                if event.key == pygame.K_LEFTBRACKET:
-                    dt = TimeWarpBackward(dt)
-                if event.key == pygame.K_SLASH:
-                    dt = 1800
-                # Move around the screen
-                if event.key == pygame.K_TAB:
-                    CenterX = screen_width // 2
-                    CenterY = screen_height // 2
-                    planet_locked = False
-                    selected_planet = None
-                    offset_x = 0
-                    offset_y = 0
-
-                if event.key == pygame.K_UP:
-                    if planet_locked:
-                        offset_y += 50
-                    else:
-                        CenterY += 50
-                if event.key == pygame.K_DOWN:
-                    if planet_locked:
-                        offset_y -= 50
-                    else:
-                        CenterY -= 50
-                if event.key == pygame.K_LEFT:
-                    if planet_locked:
-                        offset_x += 50
-                    else:
-                        CenterX += 50
-                if event.key == pygame.K_RIGHT:
-                    if planet_locked:
-                        offset_x -= 50
-                    else:
-                        CenterX -= 50
-
-                # Zooming with shift
-                if event.key == pygame.K_EQUALS:
-                    if shifting:
-                        pixel_scale *= 2
-                    else:
-                        pixel_scale += 0.005e-6
-                if event.key == pygame.K_MINUS:
-                    if shifting:
-                        pixel_scale /= 2
-                    else:
-                        pixel_scale -= 0.005e-6
-
-                # find the box to enter inputs into
-                # Handle the display text
-                # Handle backspace for the current box
-                if event.key == pygame.K_BACKSPACE:
-                    if current_box == 0:
-                        mass_text = mass_text[:-1]
-                    elif current_box == 1:
-                        velocity_text = velocity_text[:-1]
-                    elif current_box == 2:
-                        radius_text = radius_text[:-1]
-                    elif current_box == 3:
-                        size_text = size_text[:-1]
-                    elif current_box == 4:
-                        name_text = name_text[:-1]
-                elif event.key != pygame.K_RETURN:
-                    if current_box == 0:
-                        mass_text += event.unicode
-                    elif current_box == 1:
-                        velocity_text += event.unicode
-                    elif current_box == 2:
-                        radius_text += event.unicode
-                    elif current_box == 3:
-                        size_text += event.unicode
-                    elif current_box == 4:
-                        name_text += event.unicode
-
-                # If the Enter key is pressed make a new body
-                if event.key == pygame.K_RETURN:
-                    if mass_text == "" or velocity_text == "" or radius_text == "" or size_text == "" or name_text == "":
-                        pass
-                    else:
-                        create_new_body(mass=float(mass_text),
-                                        velocity=float(velocity_text),
-                                        radius=float(radius_text),
-                                        size=int(size_text),
-                                        name=str(name_text))
-                        # reset the strings
-                        mass_text = ""
-                        velocity_text = ""
-                        radius_text = ""
-                        size_text = ""
-                        name_text = ""
-
-            # Untoggle shifting
-            if event.type == pygame.KEYUP:
-                if event.key == pygame.K_LSHIFT:
-                    shifting = False
-
-
-
+        if command_script is None:
+            now = time.perf_counter()
+            for event in pygame.event.get():
+                queue_event(event, now)
+            for name, text in held_keys.due(now):
+                commands.push("key", name, text)
+        else:
+            # Only closing the window is listened to while a log plays
+            if pygame.event.peek(pygame.QUIT):
+                commands.push("quit")
+            pygame.event.clear()
+            for command in command_script.get(frame, []):
+                commands.push(*command)
+            if frame >= last_frame:
+                commands.push("quit")
+        for command in commands.drain():
+            run_command(command)
+        profile.mark("events")
 
+        # Calculate Physics
+        if replay is not None:
+            # No physics while replaying, the bodies are moved to the recorded frame
+            replay.paused = paused
+            replay.advance()
+            current_time = replay.apply(bodies)
+        else:
+            runner.paused = paused
+            runner.warp = dt * FPS
+            if not paused and not runner.threaded:
+                # Update Physics, as many steps as dt needs within the frame budget
+                # A command log gets every step, so the same log always makes the same run
+                runner.advance(dt, FRAME_BUDGET / FPS if command_script is None else math.inf)
+            # With the physics thread running this copies in its newest snapshot
+            current_time = runner.read()
+            # A body merged into another by a collision is no longer in the system
+            if selected_planet is not None and selected_planet.state is not bodies:
+                selected_planet = None
+                planet_locked = False
+        profile.mark("physics")
+
+        # Keep the predicted paths up to date, the predictor works them out in its own thread
+        watched = [selected_planet.index] if selected_planet is not None and selected_planet.state is bodies else []
+        entered = entered_body() if input_menu.visible else None
+        if prediction_horizon and replay is None and (watched or entered is not None):
+            predictor.watch(bodies, watched, entered, prediction_horizon, current_time,
+                            PREDICTION_DRIFT_PIXELS / pixel_scale)
+        else:
+            predictor.stop()
 
         # Display handling
 
-        # Draw menus
-        data_menu.draw_menu()
-        input_menu.draw_menu()
-
-        # Draw planets and their data
-        # Draw arrows
-        calculate_gravitational_potential(bodies, toggle_arrows)
-        draw_body(bodies)
-        DrawTrajectories(bodies)
-        # Draw body names
-        name_bodies(bodies)
-
         # Update the data menu data
         if data_menu.visible and selected_planet is not None:
             text = data_menu.generate_data(selected_planet)
             data_menu.add_to_menu(text)
+        elif data_menu.visible and selected_bodies:
+            text = data_menu.generate_selection_data(bodies, selected_bodies)
+            data_menu.add_to_menu(text)
+        if input_menu.visible:
+            input_menu.draw_data_input(0)
+
+        # The scene is everything drawn from the bodies, it is only drawn again when something in it
+        # changed: the time, the bodies, the view, what is shown, the menus or a new predicted path
+        # Typing, hovering and the text on top only redraw their own overlays
+        scene_key = (current_time, id(bodies), len(bodies), CenterX, CenterY, pixel_scale, projection.angles,
+                     potential_view, trajectories_on, prediction_horizon, predictor.updates, data_menu.visible,
+                     data_menu.content, input_menu.visible)
+        if scene_key != last_scene_key or composer.full:
+            last_scene_key = scene_key
+            composer.full = True
+            scene.fill(BLACK)
+
+            # Potential field goes under everything else
+            draw_potential_field(bodies, potential_view)
+            profile.mark("field")
+            draw_particles(bodies)
+            profile.mark("particles")
+
+            # Draw menus
+            data_menu.draw_menu()
+            input_menu.draw_menu()
+            profile.mark("menus")
+
+            # Draw planets and their data
+            # Draw arrows
+            # Only what is on screen is drawn
+            body_xy, shown, picker = visible_bodies(bodies)
+            profile.mark("cull")
+            calculate_gravitational_potential(bodies, potential_view)
+            profile.mark("arrows")
+            draw_body(bodies, shown)
+            profile.mark("bodies")
+            DrawTrajectories(bodies)
+            profile.mark("trails")
+            draw_prediction(predictor, prediction_horizon, current_time)
+            profile.mark("prediction")
+            # Draw body names
+            name_bodies(bodies, body_xy, shown)
+
+        # Everything from here on is an overlay, drawn over the scene where it changed
+        hovered = picker.pick(mouse_pos) if picker is not None else None
+        draw_highlights(bodies, hovered, selected_bodies, box_start, mouse_pos)
+        profile.mark("labels")
 
         if input_menu.visible:
             # 0.83 and 0.65 are screen offsets to allow any screen size, ignore them
-            input_menu.draw_data_input(0)
             input_boxes = draw_input_boxes(screen_width * 0.83, screen_height * 0.65)
-            display_input_numbers(screen_width * 0.83, screen_height * 0.65)
+        else:
+            input_boxes = []
 
         # Button Handling
         draw_pause_buttons()
 
         # Time handling
-        # Update time, if simulation is paused increment normal delta time
-        # If paused, delta time is 0
-        if not paused:
-            # Update time
-            current_time += dt
-        if paused:
-            current_time += 0
+        # current_time comes from the physics runner, it only moves on while not paused
 
         # Update Simulation Clock
-        draw_clock(current_time)
+        draw_clock(int(current_time))
+        draw_solver(physics.use_barnes_hut, physics.theta, physics.use_particle_mesh, physics.mesh_size,
+                    physics.mesh_short_range, physics.integrator, physics.softening, physics.collisions,
+                    physics.backend, physics.precision)
+        draw_physics_rate(runner)
+        draw_recording(active_recorder, replay)
+        draw_diagnostics(active_monitor)
+        draw_camera(projection)
+        draw_prediction_horizon(prediction_horizon)
 
         # DEBUGGING
         if DEBUG:
@@ -632,6 +1262,23 @@ if __name__ == '__main__':
         # Lock now
         # Planet Locking
         LockPlanet(selected_planet, planet_locked)
-
-        # Update next frame of simulation
-        pygame.display.flip()
+        draw_profile(profile)
+        profile.mark("hud")
+
+        # Update next frame of simulation, only the parts of the window that changed
+        composer.present()
+        profile.mark("flip")
+        profile.end_frame()
+        frame += 1
+
+    runner.stop()
+    stop_recording()
+    stop_diagnostics()
+    if profile.enabled:
+        profile.save_trace(TRACE_PATH)
+    if command_recorder is not None:
+        command_recorder.close()
+    if command_script is not None:
+        elapsed = time.perf_counter() - began
+        print(f'{frame} frames in {elapsed:.2f}s, {1e3 * elapsed / max(frame, 1):.2f} ms a frame, '
+              f'simulated time {current_time:.0f}s')
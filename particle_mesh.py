@@ -0,0 +1,290 @@
+from functools import partial
+
+import numpy as np
+
+from gravity import DIMENSIONS, G, KERNEL_CHUNK_PAIRS
+
+# Particle-mesh gravity for very large N. The masses are spread onto a grid of cubic cells over the
+# box around the bodies with cloud in cell (CIC) weights, the grid is convolved with the pull of a
+# unit mass by FFT and the accelerations at the grid points are read back with the same weights
+# The grid is padded to twice its size with zeros so the FFT sees no copies of the box (isolated,
+# not periodic, boundaries), and the same weights both ways mean a body never pulls on itself and
+# every pair pulls equally on both bodies, so momentum is kept
+# Bodies closer than a couple of cells are pulled too weakly. With the short range correction (P3M)
+# the mesh only carries the smooth erf part of the pull and every pair closer than SHORT_RANGE_CUTOFF
+# split lengths has the rest added body by body
+# Only NumPy's FFT is used, so it runs on any CPU
+
+# Cells along the longest side of the box, the other sides get as many cubic cells as they need,
+# so a flat system is a single layer of cells deep
+MESH_SIZE = 64
+# Split length of the short range correction in cells, the mesh pull is -G m erf(r / (2 r_s)) / r^2
+# plus its Gaussian term, which the grid can resolve once r_s is over a cell
+SPLIT_CELLS = 1.25
+# Pairs closer than this many split lengths are summed directly, past it the part of the pull
+# the mesh leaves out is under 2% of the whole
+SHORT_RANGE_CUTOFF = 4.5
+# Mean of 1 / r over a cube of side 1 seen from its centre, the potential of a cell on itself
+CELL_SELF_POTENTIAL = 2.3800772
+# Green's function transforms kept, for the system being simulated and the one being predicted. A
+# 128 cell cube holds half a gigabyte of them
+KERNEL_CACHE_SIZE = 2
+_kernels = {}
+
+
+def _fast_length(n):
+    # Smallest length of at least n with no prime factors over 5, which the FFT handles quickly
+    while True:
+        m = n
+        for factor in (2, 3, 5):
+            while m % factor == 0:
+                m //= factor
+        if m == 1:
+            return n
+        n += 1
+
+
+def _erfc(x):
+    # Complementary error function of x >= 0 to 1.5e-7 (Abramowitz and Stegun 7.1.26), NumPy has none
+    t = 1.0 / (1.0 + 0.3275911 * x)
+    poly = t * (0.254829592 + t * (-0.284496736 + t * (1.421413741 + t * (-1.453152027 + t * 1.061405429))))
+    return poly * np.exp(-x * x)
+
+
+def _pair_terms(squared, softening, split):
+    # For pairs at squared distance r^2, the factors f and p of the pull G m f d towards the other
+    # body and its potential -G m p, of the whole pull or only of its smooth part when split is the
+    # split length. Any unit of length as long as all three are in it
+    if split is None:
+        distance = np.sqrt(squared + softening * softening)
+        return 1.0 / distance ** 3, 1.0 / distance
+    r = np.sqrt(squared)
+    u = r / (2 * split)
+    smooth = 1.0 - _erfc(u)
+    gaussian = r / (split * np.sqrt(np.pi)) * np.exp(-u * u)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        force = np.where(r > 0, (smooth - gaussian) / (r * r * r), 0.0)
+        potential = np.where(r > 0, smooth / r, 1.0 / (split * np.sqrt(np.pi)))
+    return force, potential
+
+
+def _green(shape, padded, softening, split):
+    # Transforms of the pull and the potential of a unit mass at every cell offset, in units of a
+    # cell, and the potential at the offsets 0 and 1 along each axis. They only change with the grid
+    # shape and the softening in cells, so they are cached
+    key = (shape, padded, softening, split)
+    cached = _kernels.get(key)
+    if cached is not None:
+        return cached
+    offsets = []
+    for size in padded:
+        # Offsets up to half the padded length are forwards, the rest wrap round to backwards
+        k = np.arange(size)
+        offsets.append(np.where(k <= size // 2, k, k - size).astype(float))
+    d = np.meshgrid(*offsets, indexing='ij', sparse=True)
+    squared = d[0] ** 2 + d[1] ** 2 + d[2] ** 2
+    with np.errstate(divide='ignore', invalid='ignore'):
+        force, potential = _pair_terms(squared, softening, split)
+    if split is None:
+        # A body does not pull on its own cell, and without softening the potential of a cell on
+        # itself is its mean
+        force[0, 0, 0] = 0.0
+        potential[0, 0, 0] = 1.0 / softening if softening else CELL_SELF_POTENTIAL
+    # The acceleration at offset d from a unit mass is towards it, -d
+    transforms = [np.fft.rfftn(-force * d[axis]) for axis in range(DIMENSIONS)] + [np.fft.rfftn(-potential)]
+    near = -potential[:2, :2, :2].copy()
+    if len(_kernels) >= KERNEL_CACHE_SIZE:
+        _kernels.clear()
+    _kernels[key] = transforms, near
+    return transforms, near
+
+
+class particle_mesh:
+    # The accelerations at the grid points, worked out once for the bodies and read back at any
+    # targets inside the box
+    def __init__(self, positions, masses, mesh_size=MESH_SIZE, short_range=False, softening=0.0, bounds=None):
+        self.positions = positions
+        self.masses = masses
+        self.softening = softening
+        low = positions.min(axis=0) if len(masses) else np.zeros(DIMENSIONS)
+        high = positions.max(axis=0) if len(masses) else np.zeros(DIMENSIONS)
+        if bounds is not None:
+            low, high = np.minimum(low, bounds[0]), np.maximum(high, bounds[1])
+        longest = (high - low).max()
+        # The longest side is mesh_size - 2 cells, and every side has a cell to spare at its top
+        self.cell = longest / (mesh_size - 2) if longest > 0 else 1.0
+        self.low = low
+        # Sides over two cells are rounded up to a multiple of an eighth of the mesh, so the shape and the
+        # Green's functions stay the same while the bodies move about
+        cells = ((high - low) / self.cell).astype(int) + 2
+        step = max(mesh_size // 8, 1)
+        self.shape = tuple(int(n) if n <= 2 else int(-(-n // step) * step) for n in cells)
+        self.padded = tuple(_fast_length(2 * n - 1) for n in self.shape)
+        # Split length in metres, None for plain particle-mesh
+        self.split = SPLIT_CELLS * self.cell if short_range else None
+        # The softening is only on the mesh without the correction, which softens the close pairs
+        # itself. It is rounded to 3 figures in cells so the Green's functions are reused as the box changes
+        mesh_softening = 0.0 if short_range else float(f'{softening / self.cell:.3g}')
+        green, self._near = _green(self.shape, self.padded, mesh_softening, None if self.split is None else SPLIT_CELLS)
+
+        # The corners of the bodies are kept, they are read back at the same corners
+        self._body_corners = index, weight = self._corners(positions)
+        density = np.bincount(index.ravel(), (weight * masses).ravel(),
+                              minlength=int(np.prod(self.padded)))
+        self._density = np.fft.rfftn(density.reshape(self.padded))
+        # The Green's functions are per cell, a cell of side h scales the pull by 1 / h^2 and the potential by 1 / h
+        self.grid = [np.fft.irfftn(self._density * transform, s=self.padded, axes=(0, 1, 2)).ravel()
+                     * (G / self.cell ** 2) for transform in green[:DIMENSIONS]]
+        self._potential_transform = green[DIMENSIONS]
+        self._potential_grid = None
+
+    def _corners(self, points):
+        # Flat padded grid index and CIC weight of the 8 cell corners around every point, (8, N) each
+        u = (points - self.low) / self.cell
+        first = np.clip(np.floor(u).astype(np.intp), 0, np.array(self.shape) - 2)
+        fraction = np.clip(u - first, 0.0, 1.0)
+        index = np.zeros((8, len(points)), dtype=np.intp)
+        weight = np.ones((8, len(points)))
+        stride = np.cumprod((1,) + self.padded[:0:-1])[::-1]
+        for axis in range(DIMENSIONS):
+            lower = first[:, axis] * stride[axis]
+            upper = lower + stride[axis]
+            above = np.ascontiguousarray(fraction[:, axis])
+            below = 1.0 - above
+            for corner in range(8):
+                if (corner >> axis) & 1:
+                    index[corner] += upper
+                    weight[corner] *= above
+                else:
+                    index[corner] += lower
+                    weight[corner] *= below
+        return index, weight
+
+    def _self_potential(self, points):
+        # Potential every body gets from its own mass spread over its corners, two of its corners are
+        # on different sides along an axis with chance 2 f (1 - f)
+        u = (points - self.low) / self.cell
+        fraction = np.clip(u - np.clip(np.floor(u), 0, np.array(self.shape) - 2), 0.0, 1.0)
+        apart = 2 * fraction * (1 - fraction)
+        total = np.zeros(len(points))
+        for pattern in range(8):
+            chance = np.ones(len(points))
+            for axis in range(DIMENSIONS):
+                chance *= apart[:, axis] if (pattern >> axis) & 1 else 1 - apart[:, axis]
+            total += chance * self._near[pattern & 1, (pattern >> 1) & 1, (pattern >> 2) & 1]
+        return total * (G / self.cell)
+
+    def accelerations(self, targets=None, out=None, potential=None):
+        # targets default to the bodies themselves, potential, when given, is filled with Phi at every
+        # target. A body's own mass is only left out of it when the targets are the bodies
+        own = targets is None
+        if own:
+            targets = self.positions
+        if out is None:
+            out = np.empty((len(targets), DIMENSIONS), dtype=float)
+        index, weight = self._body_corners if own else self._corners(targets)
+        for axis in range(DIMENSIONS):
+            out[:, axis] = np.einsum('ij,ij->j', self.grid[axis][index], weight)
+        if potential is not None:
+            # The potential grid is only made when it is asked for
+            if self._potential_grid is None:
+                self._potential_grid = np.fft.irfftn(self._density * self._potential_transform, s=self.padded,
+                                                     axes=(0, 1, 2)).ravel()
+            potential[:] = np.einsum('ij,ij->j', self._potential_grid[index], weight) * (G / self.cell)
+            if own:
+                potential -= self.masses * self._self_potential(targets)
+        if self.split is not None and len(self.masses):
+            self._add_short_range(targets, out, potential)
+        return out
+
+    def _add_short_range(self, targets, out, potential):
+        # What the mesh left out of the pull of every body closer than the cutoff, found with cells as
+        # wide as the cutoff so only the 27 cells around a target can hold one
+        cutoff = SHORT_RANGE_CUTOFF * self.split
+        # Cells are counted from one cell below the box, so every cell has all its neighbours
+        cells = ((self.positions - self.low) // cutoff).astype(np.intp) + 1
+        target_cells = ((targets - self.low) // cutoff).astype(np.intp) + 1
+        shape = np.maximum(cells.max(axis=0), target_cells.max(axis=0, initial=0)) + 2
+        # Bodies and targets are both taken in the order of their cells, so the bodies a run of
+        # targets needs are close together in memory
+        keys = np.ravel_multi_index(cells.T, shape)
+        order = np.argsort(keys, kind='stable')
+        keys = keys[order]
+        sorted_positions = self.positions[order]
+        sorted_masses = self.masses[order]
+        target_order = np.argsort(np.ravel_multi_index(target_cells.T, shape), kind='stable')
+        sorted_targets = targets[target_order]
+        neighbours = np.stack(np.meshgrid(*[[-1, 0, 1]] * DIMENSIONS, indexing='ij'), axis=-1).reshape(-1, DIMENSIONS)
+        # Start and length of the run of sorted bodies in every neighbour cell of every target
+        around = np.ravel_multi_index(np.moveaxis(target_cells[target_order, np.newaxis, :] + neighbours, -1, 0), shape)
+        first = np.searchsorted(keys, around, side='left')
+        counts = np.searchsorted(keys, around, side='right') - first
+        pairs = np.cumsum(counts.sum(axis=1))
+        start = 0
+        while start < len(targets):
+            # As many targets as keep the pairs under KERNEL_CHUNK_PAIRS, at least one
+            done = pairs[start - 1] if start else 0
+            stop = max(int(np.searchsorted(pairs, done + KERNEL_CHUNK_PAIRS, side='right')), start + 1)
+            run_counts = counts[start:stop].ravel()
+            target = np.repeat(np.repeat(np.arange(stop - start), len(neighbours)), run_counts)
+            offsets = np.arange(len(target)) - np.repeat(np.cumsum(run_counts) - run_counts, run_counts)
+            body = np.repeat(first[start:stop].ravel(), run_counts) + offsets
+            d = sorted_positions[body] - sorted_targets[start + target]
+            squared = np.einsum('ij,ij->i', d, d)
+            # A body adds nothing to itself, and pairs past the cutoff are left to the mesh
+            close = (squared > 0) & (squared < cutoff * cutoff)
+            target, body, d, squared = target[close], body[close], d[close], squared[close]
+            exact_force, exact_potential = _pair_terms(squared, self.softening, None)
+            mesh_force, mesh_potential = _pair_terms(squared, 0.0, self.split)
+            weight = G * sorted_masses[body] * (exact_force - mesh_force)
+            rows = target_order[start:stop]
+            for axis in range(DIMENSIONS):
+                out[rows, axis] += np.bincount(target, weight * d[:, axis], minlength=stop - start)
+            if potential is not None:
+                potential[rows] -= G * np.bincount(target, sorted_masses[body] * (exact_potential - mesh_potential),
+                                                   minlength=stop - start)
+            start = stop
+
+
+def particle_mesh_gravity(positions, masses, mesh_size=MESH_SIZE, short_range=False, out=None, targets=None,
+                          softening=0.0, potential=None):
+    # Spread the masses onto a grid for this step and find the acceleration of every body, or of the
+    # targets, the box is made big enough for targets that are not among the bodies
+    bounds = (targets.min(axis=0), targets.max(axis=0)) if targets is not None and len(targets) else None
+    mesh = particle_mesh(positions, masses, mesh_size, short_range, softening, bounds)
+    return mesh.accelerations(targets, out=out, potential=potential)
+
+
+def random_ball(n, seed=0):
+    # A round cloud of similar mass bodies, Gaussian with a spread of 2e11 m along every axis
+    rng = np.random.default_rng(seed)
+    return rng.normal(0.0, 2e11, (n, DIMENSIONS)), rng.uniform(1e22, 1e24, n)
+
+
+def accuracy_report(name, positions, masses, mesh_sizes=(32, 64, 128), short_ranges=(False, True), sample=2000,
+                    repeats=3):
+    # Compared against the exact kernel like barnes_hut.accuracy_report, at every mesh size without
+    # and with the short range correction
+    # Imported here, benchmark needs physics which imports this module
+    from benchmark import accuracy_report as solver_report
+    solvers = [(f'{"P3M" if short_range else "PM"} {mesh_size}',
+                partial(particle_mesh_gravity, positions, masses, mesh_size, short_range))
+               for short_range in short_ranges for mesh_size in mesh_sizes]
+    return solver_report(name, positions, masses, solvers, "mesh", with_rms=True, sample=sample, repeats=repeats)
+
+
+if __name__ == '__main__':
+    # Imported here, systems needs physics which imports this module
+    from barnes_hut import random_cloud
+    from systems import load_system
+    system_4 = load_system("system4")
+    print(accuracy_report("System 4", system_4.positions, system_4.masses))
+    # The short range correction has hundreds of close pairs a body past 10000 bodies, minutes in NumPy
+    for n in (1000, 10000, 100000, 1000000):
+        print()
+        print(accuracy_report("Random cloud", *random_cloud(n), mesh_sizes=(64, 128, 256),
+                              short_ranges=(False, True) if n <= 10000 else (False,)))
+    for n in (10000, 100000, 1000000):
+        print()
+        print(accuracy_report("Random ball", *random_ball(n), mesh_sizes=(32, 64, 128),
+                              short_ranges=(False, True) if n <= 10000 else (False,)))
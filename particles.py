@@ -0,0 +1,65 @@
+import numpy as np
+
+from gravity import DIMENSIONS, G
+from physics import as_vectors
+
+# Test particles for debris rings and asteroid belts, millions of them in packed float32 arrays with
+# no Python object each. They feel the gravity of the bodies of their system but pull on nothing,
+# not even each other, so a step costs bodies x particles instead of (bodies + particles) squared
+# They go through each other and through the bodies, collisions are only between bodies
+# No pygame here, main.py draws them as single pixels
+
+# Stored precision, a position of 1e12 m is kept to within about 1e5 m
+PARTICLE_DTYPE = np.float32
+
+
+class particle_cloud:
+    def __init__(self, positions=(), velocities=()):
+        # Copied, 2D rows get z = 0 like the bodies do
+        self.positions = np.array(as_vectors(positions, PARTICLE_DTYPE)).reshape(-1, DIMENSIONS)
+        self.velocities = np.array(as_vectors(velocities, PARTICLE_DTYPE)).reshape(-1, DIMENSIONS)
+        self.accelerations = np.zeros_like(self.positions)
+        # Positions of the bodies the accelerations were worked out for, None when they are not known
+        self._known_positions = None
+
+    def __len__(self):
+        return len(self.positions)
+
+    def copy(self):
+        new_cloud = particle_cloud(self.positions, self.velocities)
+        new_cloud.accelerations[...] = self.accelerations
+        new_cloud._known_positions = None if self._known_positions is None else self._known_positions.copy()
+        return new_cloud
+
+    def accelerate(self, bodies, gravity):
+        # Pull of the bodies on every particle, with the solver the bodies use
+        gravity(bodies.positions, bodies.masses, out=self.accelerations, targets=self.positions)
+        self._known_positions = bodies.positions.copy()
+
+    def start_step(self, bodies, dt, gravity):
+        # Opening kick and drift of a leapfrog step, before the bodies take their step of dt
+        # The accelerations left by the last step are reused while the bodies have not been moved since
+        if self._known_positions is None or not np.array_equal(self._known_positions, bodies.positions):
+            self.accelerate(bodies, gravity)
+        self.velocities += self.accelerations * PARTICLE_DTYPE(dt / 2)
+        self.positions += self.velocities * PARTICLE_DTYPE(dt)
+
+    def finish_step(self, bodies, dt, gravity):
+        # Closing kick with the pull of the bodies at their new positions
+        self.accelerate(bodies, gravity)
+        self.velocities += self.accelerations * PARTICLE_DTYPE(dt / 2)
+
+
+def ring(central, count, inner, outer, seed=None, eccentricity=0.0):
+    # count particles on orbits around the body central between inner and outer metres from it,
+    # spread evenly over the area of the ring in the x-y plane, circular unless given a random
+    # eccentricity up to eccentricity, moving with the central body
+    rng = np.random.default_rng(seed)
+    radius = np.sqrt(rng.uniform(inner ** 2, outer ** 2, count))
+    angle = rng.uniform(0.0, 2 * np.pi, count)
+    direction = np.column_stack((np.cos(angle), np.sin(angle), np.zeros(count)))
+    # Speed at the closest point of an orbit of eccentricity e, sqrt(G M (1 + e) / r)
+    speed = np.sqrt(G * central.mass / radius * (1 + rng.uniform(0.0, eccentricity, count)))
+    positions = central.position + direction * radius[:, np.newaxis]
+    velocities = central.velocity + np.column_stack((-direction[:, 1], direction[:, 0], np.zeros(count))) * speed[:, np.newaxis]
+    return particle_cloud(positions, velocities)
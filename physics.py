@@ -0,0 +1,423 @@
+import numpy as np
+
+from gravity import DIMENSIONS, G, gravity_kernel, ordered_gravity_kernel
+from gravity_jit import JIT_AVAILABLE, jit_gravity, jit_leapfrog_step, jit_ordered_gravity
+from barnes_hut import THETA, barnes_hut_gravity
+from particle_mesh import MESH_SIZE, particle_mesh_gravity
+from collisions import bounce, contact_pairs, merge
+from integrators import leapfrog
+from precision import recentre
+
+# The physics of the simulation with no pygame in it, so it can run without a display
+# Every object can be defined as having these characteristics: Mass, Velocity, Position
+
+# Gravity solver, exact all pairs or Barnes-Hut with opening angle theta
+use_barnes_hut = False
+theta = THETA
+# Particle-mesh gravity for very large N instead, on a grid of mesh_size cells along the longest
+# side, with close pairs added body by body when mesh_short_range is on (P3M)
+use_particle_mesh = False
+mesh_size = MESH_SIZE
+mesh_short_range = False
+# What exact gravity and leapfrog steps run on, compiled with Numba when it is installed or NumPy
+BACKENDS = ["numpy", "jit"]
+backend = "jit" if JIT_AVAILABLE else "numpy"
+# How the bodies are moved on each step
+integrator = leapfrog()
+# How the sums are rounded, standard floats or compensated: positions and velocities carry the
+# rounding of every step, exact gravity adds up in a fixed order and the system is moved into its
+# barycentric frame, so runs come out the same to the bit on every backend (see precision.py)
+PRECISIONS = ["standard", "compensated"]
+precision = "standard"
+# What happens when two bodies touch, going by their physical radii
+COLLISION_MODES = ["off", "merge", "bounce"]
+collisions = "off"
+# Plummer softening length in metres, gravity between bodies closer than this is weakened
+softening = 0.0
+# Set while the diagnostics are on, every full gravity call then also leaves Phi at each body
+track_potential = False
+# (positions, masses, Phi at every body) from the last gravity call that worked the potential out
+last_potential = None
+
+
+def as_vectors(values, dtype=float):
+    # (x, y, z) from (x, y) or (x, y, z), one vector or rows of them. z is 0 for a 2D vector, so
+    # flat systems and files saved before there was a z load as they were
+    values = np.asarray(values, dtype=dtype)
+    if values.size and values.shape[-1] < DIMENSIONS:
+        values = np.pad(values, [(0, 0)] * (values.ndim - 1) + [(0, DIMENSIONS - values.shape[-1])])
+    return values
+
+
+# Classes
+class body:
+    # radius is how many pixels the body is drawn with, physical_radius is its size in metres
+    def __init__(self, mass, velocity, position, radius, name, physical_radius=0.0):
+        self.name = name
+        # A body does not store its own vectors, it is an index into the arrays of a system
+        # On its own it lives in a one body system until it is added to a bigger one
+        self.state = None
+        self.index = 0
+        system()._add(self, mass, velocity, position, radius, physical_radius)
+
+    # Properties return views into the system arrays so vector calculations can still be done on them
+    @property
+    def mass(self):
+        return self.state.masses[self.index]
+
+    @mass.setter
+    def mass(self, value):
+        self.state.masses[self.index] = value
+
+    @property
+    def position(self):
+        return self.state.positions[self.index]
+
+    @position.setter
+    def position(self, value):
+        self.state.positions[self.index] = as_vectors(value)
+
+    @property
+    def velocity(self):
+        return self.state.velocities[self.index]
+
+    @velocity.setter
+    def velocity(self, value):
+        self.state.velocities[self.index] = as_vectors(value)
+
+    @property
+    def acceleration(self):
+        return self.state.accelerations[self.index]
+
+    @acceleration.setter
+    def acceleration(self, value):
+        self.state.accelerations[self.index] = as_vectors(value)
+
+    @property
+    def radius(self):
+        return int(self.state.radii[self.index])
+
+    @radius.setter
+    def radius(self, value):
+        self.state.radii[self.index] = value
+
+    @property
+    def physical_radius(self):
+        return self.state.physical_radii[self.index]
+
+    @physical_radius.setter
+    def physical_radius(self, value):
+        self.state.physical_radii[self.index] = value
+
+
+class system:
+    # Structure of arrays for all the bodies, row i of every array belongs to self.bodies[i]
+    # Buffers behind the public arrays and the shape of one row of each
+    _buffers = {"_position_buffer": (DIMENSIONS,), "_velocity_buffer": (DIMENSIONS,),
+                "_acceleration_buffer": (DIMENSIONS,),
+                "_mass_buffer": (), "_radius_buffer": (), "_physical_radius_buffer": (),
+                "_position_error_buffer": (DIMENSIONS,), "_velocity_error_buffer": (DIMENSIONS,)}
+
+    def __init__(self, bodies=()):
+        self.bodies = []
+        # Whether the compensated precision mode has moved it into its barycentric frame, bodies
+        # added later move the centre of mass so it is cleared again
+        self.barycentric = False
+        # Test particles moving with the bodies, a particles.particle_cloud or None
+        self.particles = None
+        self._capacity = 0
+        self._resize(max(len(bodies), 1))
+        for new_body in bodies:
+            self.append(new_body)
+
+    @classmethod
+    def from_arrays(cls, names, masses, positions, velocities, radii, physical_radii, accelerations=None,
+                    position_errors=None, velocity_errors=None):
+        # A system that takes the arrays over as its buffers, without copying any that are already
+        # contiguous float64, for loading big systems. The bodies are made straight onto its rows
+        # instead of each starting in a system of its own
+        new_system = cls()
+        n = len(masses)
+        if n == 0:
+            return new_system
+        if accelerations is None:
+            accelerations = np.zeros((n, DIMENSIONS), dtype=float)
+        # The rounding the compensated precision mode has kept, none for a new system
+        if position_errors is None:
+            position_errors = np.zeros((n, DIMENSIONS), dtype=float)
+        if velocity_errors is None:
+            velocity_errors = np.zeros((n, DIMENSIONS), dtype=float)
+        arrays = [as_vectors(positions), as_vectors(velocities), as_vectors(accelerations), masses, radii,
+                  physical_radii, as_vectors(position_errors), as_vectors(velocity_errors)]
+        for name, shape, array in zip(cls._buffers, cls._buffers.values(), arrays):
+            setattr(new_system, name, np.ascontiguousarray(array, dtype=float).reshape((n,) + shape))
+        new_system._capacity = n
+        for index, name in enumerate(names):
+            new_body = body.__new__(body)
+            new_body.name = name
+            new_body.state = new_system
+            new_body.index = index
+            new_system.bodies.append(new_body)
+        new_system._update_views()
+        return new_system
+
+    def _resize(self, capacity):
+        # Grow the buffers by copying into bigger ones, the public arrays are views of the used rows
+        n = len(self.bodies)
+        for name, shape in self._buffers.items():
+            new_buffer = np.zeros((capacity,) + shape, dtype=float)
+            if self._capacity:
+                new_buffer[:n] = getattr(self, name)[:n]
+            setattr(self, name, new_buffer)
+        self._capacity = capacity
+        self._update_views()
+
+    def _update_views(self):
+        n = len(self.bodies)
+        self.positions = self._position_buffer[:n]
+        self.velocities = self._velocity_buffer[:n]
+        self.accelerations = self._acceleration_buffer[:n]
+        self.masses = self._mass_buffer[:n]
+        self.radii = self._radius_buffer[:n]
+        self.physical_radii = self._physical_radius_buffer[:n]
+        self.position_errors = self._position_error_buffer[:n]
+        self.velocity_errors = self._velocity_error_buffer[:n]
+
+    def _add(self, new_body, mass, velocity, position, radius, physical_radius):
+        n = len(self.bodies)
+        if n == self._capacity:
+            self._resize(self._capacity * 2)
+        self._position_buffer[n] = as_vectors(position)
+        self._velocity_buffer[n] = as_vectors(velocity)
+        self._acceleration_buffer[n] = 0.0
+        self._mass_buffer[n] = mass
+        self._radius_buffer[n] = radius
+        self._physical_radius_buffer[n] = physical_radius
+        self._position_error_buffer[n] = 0.0
+        self._velocity_error_buffer[n] = 0.0
+        self.barycentric = False
+        self.bodies.append(new_body)
+        self._update_views()
+        new_body.state = self
+        new_body.index = n
+
+    def append(self, new_body):
+        # Copy the body's current values in before it is pointed at this system
+        self._add(new_body, new_body.mass, new_body.velocity.copy(), new_body.position.copy(), new_body.radius,
+                  new_body.physical_radius)
+
+    def keep(self, rows):
+        # Keep only the bodies in rows, in that order, for example after collisions merged some
+        # The bodies that are dropped go back to being on their own with their last values
+        rows = np.asarray(rows, dtype=int)
+        dropped = np.ones(len(self.bodies), dtype=bool)
+        dropped[rows] = False
+        for row in np.flatnonzero(dropped):
+            system([self.bodies[row]])
+        for name in self._buffers:
+            buffer = getattr(self, name)
+            buffer[:len(rows)] = buffer[rows]
+        self.bodies = [self.bodies[row] for row in rows]
+        for index, kept_body in enumerate(self.bodies):
+            kept_body.index = index
+        self._update_views()
+
+    def __len__(self):
+        return len(self.bodies)
+
+    def __iter__(self):
+        return iter(self.bodies)
+
+    def __getitem__(self, i):
+        return self.bodies[i]
+
+
+def calculate_gravity(bodies):
+    # Matches calculate_gravity_loop to a relative error below 1e-12 of each acceleration
+    gravity_kernel(bodies.positions, bodies.masses, out=bodies.accelerations)
+
+
+def calculate_accelerations(positions, masses, out=None, targets=None, potential=None):
+    # Gravity with the selected solver, this is what the integrators call
+    # targets limits it to the bodies that need a new acceleration
+    # potential is filled with Phi at every body from the same distances, it is always worked out
+    # for full calls while track_potential is set
+    global last_potential
+    if potential is None and track_potential and targets is None:
+        potential = np.empty(len(masses))
+    out = solver_gravity(positions, masses, out=out, targets=targets, potential=potential)
+    if potential is not None and targets is None:
+        last_potential = (positions.copy(), masses.copy(), potential)
+    return out
+
+
+def solver_gravity(positions, masses, out=None, targets=None, potential=None):
+    # The selected solver on its own, for systems other than the one being simulated
+    if use_particle_mesh:
+        # The masses are spread onto a new grid from the positions every call
+        return particle_mesh_gravity(positions, masses, mesh_size, mesh_short_range, out=out, targets=targets,
+                                     softening=softening, potential=potential)
+    if use_barnes_hut:
+        # O(N log N) approximation, the octree is rebuilt from the positions every call
+        return barnes_hut_gravity(positions, masses, theta, out=out, targets=targets, softening=softening,
+                                  potential=potential)
+    return exact_kernel()(positions, masses, out=out, targets=targets, softening=softening, potential=potential)
+
+
+def exact_kernel():
+    # The all pairs kernel for the selected backend and precision
+    if precision == "compensated":
+        return jit_ordered_gravity if backend == "jit" else ordered_gravity_kernel
+    return jit_gravity if backend == "jit" else gravity_kernel
+
+
+def calculate_particle_accelerations(positions, masses, out=None, targets=None):
+    # Pull of the bodies on test particles, always the exact sum as it is already bodies x particles
+    # and a tree of the few bodies would not save anything
+    return exact_kernel()(positions, masses, out=out, targets=targets, softening=softening)
+
+
+def potential_energy(bodies):
+    # U = 1/2 sum of m_i * Phi_i, from the potential the last gravity call left when it was for these
+    # positions. Otherwise it is worked out along with the accelerations, which the next step then
+    # starts from, so there is never a second pass over every pair. Call from the thread that steps
+    if not (last_potential is not None and last_potential[0].shape == bodies.positions.shape
+            and np.array_equal(last_potential[0], bodies.positions)
+            and np.array_equal(last_potential[1], bodies.masses)):
+        calculate_accelerations(bodies.positions, bodies.masses, out=bodies.accelerations,
+                                potential=np.empty(len(bodies.masses)))
+        integrator.remember(bodies)
+    return 0.5 * float(np.dot(bodies.masses, last_potential[2]))
+
+
+def calculate_gravity_loop(bodies):
+    # Original per pair loop, kept as the reference the vectorised kernel is checked against
+    # Initialise bodies with no acceleration
+    for body in bodies:
+        body.acceleration = np.zeros(DIMENSIONS, dtype=float)
+
+    for i, body1 in enumerate(bodies):
+        # Cycle through all the bodies in the body list
+        for j, body2 in enumerate(bodies):
+            # Only if the 2 bodies are different, run the calculations
+            if i != j:
+                # Find vector direction by getting the distance and normalising it
+                resultant_vector = body2.position - body1.position  # r = p2-p1 calculates the direction of vector
+                resultant_direction = max(np.linalg.norm(resultant_vector),
+                                          1e-20)  # Find the direction by normalising vector, set lowest value to 1e-20
+                # max(a, b) returns the bigger value, either the calculated value or the set value
+
+                # make sure we are never dealing with negatives
+                if resultant_direction > 0:
+                    # Use Newtons equation to calculate the force magnitude between the 2 bodies
+                    force_magnitude = (G * body1.mass * body2.mass) / (resultant_direction ** 2)
+                    # Get the force vector with r^ = r / |r| UNIT vector equation
+                    force_vector = force_magnitude * (
+                            resultant_vector / resultant_direction)
+                    # Apply forces to body F = m * a -> a = F/m
+                    body1.acceleration += force_vector / body1.mass
+
+def potential_zero_points(positions, masses):
+    # For every ordered pair of bodies i, j find the point between them where Phi is 0 by this equation
+    '''
+    Phi = -GM/R1
+    Phi net = -GM1/R1 - GM2/R2
+    Phi net = 0
+    GM1/R1 = -GM2/R2 --> ignore signs, only worry about magnitudes being equal
+    GM1/R1 = GM2/R2 Remove Like terms
+    M1/R1 = M2/R2  (R1 + R2 = D) Put all in terms of R1
+    M1/R1 = M2/(D - R1) --> M1D - M1R1 = M2R1 --> M1D = M2R1 + M1R1
+    M1D = R1(M2 + M1)
+    final equation
+    R1 = M1D/(M2 + M1)
+    '''
+    # Returns the i and j of each pair and the zero points, R1 along the direction from i to j
+    i, j = np.nonzero(~np.eye(len(masses), dtype=bool))
+    share = masses[i] / (masses[i] + masses[j])
+    zero_points = positions[i] + (positions[j] - positions[i]) * share[:, np.newaxis]
+    return i, j, zero_points
+
+
+def total_energy(positions, velocities, masses):
+    # Kinetic plus potential energy of the whole system, the potential sums every pair once
+    # With softening the potential of a pair is -G m1 m2 / sqrt(r^2 + softening^2)
+    kinetic = 0.5 * np.sum(masses * np.einsum('ij,ij->i', velocities, velocities))
+    potential = 0.0
+    for i in range(len(masses) - 1):
+        separation = positions[i + 1:] - positions[i]
+        distance = np.sqrt(np.einsum('ij,ij->i', separation, separation) + softening ** 2)
+        potential -= G * masses[i] * np.sum(masses[i + 1:] / distance)
+    return kinetic + potential
+
+
+def orbital_elements(positions, velocities, masses, central):
+    # Two body orbit of every body around the body with index central
+    # Returns the semi-major axis (inf when unbound), eccentricity and whether the orbit is bound
+    r = positions - positions[central]
+    v = velocities - velocities[central]
+    mu = G * (masses[central] + masses)
+    distance = np.linalg.norm(r, axis=1)
+    speed_squared = np.einsum('ij,ij->i', v, v)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        # Specific orbital energy, negative while the body is held by the central one
+        energy = speed_squared / 2 - mu / distance
+        semi_major_axis = np.where(energy < 0, -mu / (2 * energy), np.inf)
+        eccentricity_vector = ((speed_squared - mu / distance)[:, np.newaxis] * r
+                               - np.einsum('ij,ij->i', r, v)[:, np.newaxis] * v) / mu[:, np.newaxis]
+    eccentricity = np.linalg.norm(eccentricity_vector, axis=1)
+    bound = energy < 0
+    # The central body has no orbit around itself
+    semi_major_axis[central] = 0.0
+    eccentricity[central] = 0.0
+    bound[central] = True
+    return semi_major_axis, eccentricity, bound
+
+
+def update_bodies(bodies, dt):
+    # Move every body on by dt with the selected integrator, it calculates gravity itself
+    # and reuses the acceleration left by the previous step when it can
+    # Test particles take a leapfrog step of their own around it, pulled by the bodies only
+    integrator.compensated = precision == "compensated"
+    barycentric_frame(bodies)
+    if bodies.particles is not None:
+        bodies.particles.start_step(bodies, dt, calculate_particle_accelerations)
+    if precision == "standard" and backend == "jit" and not use_barnes_hut and not use_particle_mesh and type(integrator) is leapfrog:
+        fused_leapfrog_step(bodies, dt)
+    else:
+        integrator.step(bodies, dt, calculate_accelerations)
+    if bodies.particles is not None:
+        bodies.particles.finish_step(bodies, dt, calculate_particle_accelerations)
+    if collisions != "off":
+        handle_collisions(bodies, dt)
+
+
+def barycentric_frame(bodies):
+    # The compensated precision mode runs in the barycentric frame, the move takes away the kinetic
+    # energy of the whole system's motion so call this before measuring the energy a run starts with
+    if precision == "compensated" and not bodies.barycentric:
+        recentre(bodies)
+        bodies.barycentric = True
+
+
+def fused_leapfrog_step(bodies, dt):
+    # The same step as leapfrog.step as one compiled pass, kicks, drift and gravity together
+    global last_potential
+    integrator.start_acceleration(bodies, calculate_accelerations)
+    potential = np.empty(len(bodies.masses)) if track_potential else None
+    jit_leapfrog_step(bodies, dt, softening, potential)
+    integrator.evaluations += 1
+    integrator.remember(bodies)
+    if potential is not None:
+        last_potential = (bodies.positions.copy(), bodies.masses.copy(), potential)
+
+
+def handle_collisions(bodies, dt):
+    # Bodies that touched during the last step of dt are merged or bounced off each other
+    i, j, when = contact_pairs(bodies.positions, bodies.velocities, bodies.physical_radii, dt)
+    if len(i) == 0:
+        return
+    if collisions == "bounce":
+        bounce(bodies, i, j, when, dt)
+    else:
+        absorbed = merge(bodies, i, j)
+        bodies.keep(np.flatnonzero(~absorbed))
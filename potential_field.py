@@ -0,0 +1,82 @@
+import numpy as np
+
+from gravity import potential_kernel
+
+# The gravitational potential over the whole window, Phi = -sum of G * M / r worked out for a
+# coarse grid of points in one batched call and kept until the view or the bodies have moved
+# The points are on the plane through the world origin that faces the screen, the x-y plane when
+# looking straight down
+# No pygame here, main.py turns the arrays into surfaces
+
+# Pixels per grid cell the potential is worked out on, the picture is scaled up to fill the window
+FIELD_CELL = 8
+# The field is worked out again once any body has moved this many pixels on screen
+FIELD_REDRAW_PIXELS = 2.0
+# Equipotential contours per factor of ten in |Phi|
+CONTOURS_PER_DECADE = 4
+# Colour map from the weakest to the strongest potential
+FIELD_COLOURS = np.array([[0, 0, 0], [20, 20, 90], [120, 30, 140], [230, 100, 40], [255, 230, 120]])
+
+
+class potential_field:
+    def __init__(self, width, height, cell=FIELD_CELL):
+        self.width = width
+        self.height = height
+        self.cell = cell
+        self.columns = -(-width // cell)
+        self.rows = -(-height // cell)
+        # log10 |Phi| at the centre of every cell, indexed [column, row] like pygame.surfarray
+        self.log_phi = None
+        # View and bodies the field was worked out for
+        self._view = None
+        self._positions = None
+        self._masses = None
+
+    def stale(self, positions, masses, scale, center, view):
+        if self.log_phi is None or self._view != (scale, tuple(center), view.angles):
+            return True
+        if len(masses) != len(self._masses) or np.any(masses != self._masses):
+            return True
+        return len(masses) > 0 and np.abs(positions - self._positions).max() * scale > FIELD_REDRAW_PIXELS
+
+    def update(self, positions, masses, scale, center, view):
+        # Work the field out again if it is stale, returns whether it was
+        if not self.stale(positions, masses, scale, center, view):
+            return False
+        columns, rows = np.meshgrid((np.arange(self.columns) + 0.5) * self.cell,
+                                    (np.arange(self.rows) + 0.5) * self.cell, indexing='ij')
+        points = view.unproject(np.stack([columns.ravel(), rows.ravel()], axis=1), scale, center)
+        # Inside half a cell of a body the potential is held at its value half a cell away
+        phi = potential_kernel(points, positions, masses, min_distance=0.5 * self.cell / scale)
+        self.log_phi = np.log10(np.maximum(-phi, np.finfo(float).tiny)).reshape(self.columns, self.rows)
+        self._view = (scale, tuple(center), view.angles)
+        self._positions = positions.copy()
+        self._masses = masses.copy()
+        return True
+
+    def colours(self):
+        # (columns, rows, 3) image, log |Phi| spread over the colour map from its lowest to its highest value
+        low, high = self.log_phi.min(), self.log_phi.max()
+        shade = (self.log_phi - low) / max(high - low, 1e-12)
+        stops = np.linspace(0.0, 1.0, len(FIELD_COLOURS))
+        return np.stack([np.interp(shade, stops, FIELD_COLOURS[:, channel]) for channel in range(3)],
+                        axis=-1).astype(np.uint8)
+
+    def contours(self):
+        # (columns * cell, rows * cell) mask of the equipotential lines at full resolution
+        # log |Phi| is interpolated up from the grid, a pixel is on a line where the contour level
+        # changes between it and the pixel to its right or below it
+        def weights(pixels, cells):
+            position = np.clip((np.arange(pixels) + 0.5) / self.cell - 0.5, 0, cells - 1)
+            low = np.minimum(position.astype(int), max(cells - 2, 0))
+            return low, np.minimum(low + 1, cells - 1), position - low
+
+        x0, x1, wx = weights(self.columns * self.cell, self.columns)
+        y0, y1, wy = weights(self.rows * self.cell, self.rows)
+        across = self.log_phi[x0] * (1 - wx[:, np.newaxis]) + self.log_phi[x1] * wx[:, np.newaxis]
+        smooth = across[:, y0] * (1 - wy) + across[:, y1] * wy
+        level = np.floor(smooth * CONTOURS_PER_DECADE)
+        lines = np.zeros(level.shape, dtype=bool)
+        lines[:-1] |= level[:-1] != level[1:]
+        lines[:, :-1] |= level[:, :-1] != level[:, 1:]
+        return lines
@@ -0,0 +1,110 @@
+import math
+import time
+
+import numpy as np
+
+# The compensated precision mode of physics.py, for runs that have to come out the same to the last
+# bit and that mix very big and very small numbers, like the Sun and Phobos in System 4
+# Every position and velocity keeps the rounding its last update lost in a second array, the pair
+# is a double-double that holds about 32 digits, so a step of a few metres is not lost on a
+# position of 4.5e12 m. Exact gravity adds each body's pull up in index order with the same
+# compensated adds in NumPy and Numba, so the result does not depend on the backend or the threads
+# python precision.py reports the drift, the reproducibility and the cost on System 4
+
+# Steps the report runs each system for
+REPORT_STEPS = 17520
+# Seconds per step of the report
+REPORT_DT = 1800
+
+
+def compensated_add(values, delta, errors, rows=None):
+    # values += delta, with the rounding of each add kept in errors and given back on the next one,
+    # so values + errors is the exact sum to about twice the digits of a float (Kahan-Babuska)
+    # rows, a mask or indices, limits it to those rows
+    if rows is not None:
+        part, part_errors = values[rows], errors[rows]
+        compensated_add(part, delta, part_errors)
+        values[rows] = part
+        errors[rows] = part_errors
+        return
+    added = delta + errors
+    total = values + added
+    # Knuth's two-sum, what total lost of values + added, whichever of the two is bigger
+    rounded = total - values
+    errors[...] = (values - (total - rounded)) + (added - rounded)
+    values[...] = total
+
+
+def barycentre(masses, vectors):
+    # Mass weighted mean of the rows of vectors, each column summed with math.fsum so it is correctly
+    # rounded whatever order the bodies are in
+    total = math.fsum(masses)
+    if total == 0:
+        return np.zeros(vectors.shape[1])
+    weighted = masses[:, np.newaxis] * vectors
+    return np.array([math.fsum(weighted[:, axis]) for axis in range(vectors.shape[1])]) / total
+
+
+def recentre(state):
+    # Move the system into its barycentric frame, the centre of mass at the origin and not moving,
+    # so positions stay as small as the orbits and the frame does not drift away over a long run
+    # Test particles move with the bodies
+    centre = barycentre(state.masses, state.positions)
+    drift = barycentre(state.masses, state.velocities)
+    compensated_add(state.positions, -centre, state.position_errors)
+    compensated_add(state.velocities, -drift, state.velocity_errors)
+    if state.particles is not None:
+        state.particles.positions -= centre.astype(state.particles.positions.dtype)
+        state.particles.velocities -= drift.astype(state.particles.velocities.dtype)
+
+
+def _run(name, precision, backend, threads=None):
+    # Final positions, energy error and seconds per step of a year of a system in one mode
+    import physics
+    from gravity_jit import set_threads
+    from integrators import leapfrog
+    from systems import load_system
+    physics.precision = precision
+    physics.backend = backend
+    physics.integrator = leapfrog()
+    if threads is not None:
+        set_threads(threads)
+    bodies = load_system(name)
+    physics.barycentric_frame(bodies)
+    energy_start = physics.total_energy(bodies.positions, bodies.velocities, bodies.masses)
+    # The first step compiles the Numba kernels, it is not timed
+    physics.update_bodies(bodies, REPORT_DT)
+    begin = time.perf_counter()
+    for _ in range(REPORT_STEPS - 1):
+        physics.update_bodies(bodies, REPORT_DT)
+    seconds = (time.perf_counter() - begin) / (REPORT_STEPS - 1)
+    energy_end = physics.total_energy(bodies.positions, bodies.velocities, bodies.masses)
+    if threads is not None:
+        set_threads(None)
+    physics.precision = "standard"
+    return bodies, abs((energy_end - energy_start) / energy_start), seconds
+
+
+def reproducibility_report(name):
+    # Every backend in each mode, whether they end on the same bits and what the mode costs
+    from gravity_jit import JIT_AVAILABLE
+    runs = [("numpy", None)] + ([("jit", 1), ("jit", None)] if JIT_AVAILABLE else [])
+    print(f'{name}, leapfrog, {REPORT_STEPS} steps of {REPORT_DT} s')
+    print('| precision | backend | threads | energy error | µs a step | same bits as NumPy |')
+    print('|---|---|---|---|---|---|')
+    for precision in ("standard", "compensated"):
+        reference = None
+        for backend, threads in runs:
+            bodies, energy_error, seconds = _run(name, precision, backend, threads)
+            if reference is None:
+                reference = bodies
+            same = (np.array_equal(bodies.positions, reference.positions)
+                    and np.array_equal(bodies.velocities, reference.velocities))
+            print(f'| {precision} | {backend} | {"-" if backend == "numpy" else threads or "all"} | {energy_error:.2e} | {seconds * 1e6:.1f} | '
+                  f'{"yes" if same else "no"} |')
+    print()
+
+
+if __name__ == '__main__':
+    for system_name in ("system4", "system3"):
+        reproducibility_report(system_name)
@@ -0,0 +1,151 @@
+import threading
+
+import numpy as np
+
+import physics
+from gravity import DIMENSIONS
+from integrators import leapfrog
+from physics import as_vectors
+
+# Predicted paths of a few bodies, worked out ahead by a background thread on its own copy of the
+# system so the window never waits for it. The thread keeps going from where its prediction ends
+# as the simulation catches up, and only starts again when the system is changed or the real
+# bodies stray from the prediction. No pygame here, main.py draws the paths
+
+# Leapfrog steps a prediction of the whole horizon takes, and the points kept of it
+PREDICTION_STEPS = 2000
+PREDICTION_POINTS = 500
+# Predicted steps taken between hand overs to the window, so a long prediction shows as it grows
+PUBLISH_EVERY = 100
+
+
+class prediction_state:
+    # The arrays an integrator needs, copied from a system with one more body when one is given
+    def __init__(self, bodies, extra=None):
+        self.positions = bodies.positions.copy()
+        self.velocities = bodies.velocities.copy()
+        self.masses = bodies.masses.copy()
+        if extra is not None:
+            mass, position, velocity = extra
+            self.positions = np.vstack([self.positions, as_vectors(position)])
+            self.velocities = np.vstack([self.velocities, as_vectors(velocity)])
+            self.masses = np.append(self.masses, mass)
+        self.accelerations = np.zeros_like(self.positions)
+
+
+class orbit_predictor:
+    def __init__(self, steps=PREDICTION_STEPS, points=PREDICTION_POINTS):
+        self.steps = steps
+        self.points = points
+        # Times and the (time, watched body, 3) positions predicted so far, swapped in whole
+        self.times = np.zeros(0)
+        self.path = np.zeros((0, 0, DIMENSIONS))
+        # Times the path has been swapped, so a window that is not redrawing every frame sees a new one
+        self.updates = 0
+        self._condition = threading.Condition()
+        # Each new prediction has the next generation, the thread drops any older one it is working on
+        # and ends when there is no newer one
+        self._generation = 0
+        self._job = None
+        self._key = None
+        self._now = 0.0
+        self._thread = None
+
+    def watch(self, bodies, rows, extra, horizon, now, tolerance):
+        # Called every frame with the rows of bodies to predict, an extra body (mass, position,
+        # velocity) that is not in the system yet and goes in the last row, the simulated seconds to
+        # look ahead and the current time. A new prediction is started when any of them or the solver
+        # changed, or a watched body is more than tolerance metres from where it was predicted to be
+        key = (id(bodies), len(bodies), bodies.masses.tobytes(), tuple(rows), extra, horizon, physics.use_barnes_hut,
+               physics.theta, physics.use_particle_mesh, physics.mesh_size, physics.mesh_short_range, physics.softening,
+               physics.backend)
+        with self._condition:
+            self._now = now
+            changed = key != self._key
+            if changed or self._strayed(bodies, rows, extra, now, tolerance):
+                self._key = key
+                self._generation += 1
+                if changed:
+                    # A prediction that strayed is still shown until the new one replaces it
+                    self.times = np.zeros(0)
+                    self.path = np.zeros((0, len(rows) + (extra is not None), DIMENSIONS))
+                    self.updates += 1
+                watched = list(rows) + ([len(bodies)] if extra is not None else [])
+                self._job = (self._generation, prediction_state(bodies, extra), watched, horizon, now)
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, daemon=True)
+                    self._thread.start()
+            self._condition.notify()
+
+    def stop(self):
+        # Forget the prediction, the thread ends after the step it is taking and the next watch starts another
+        if self._key is None:
+            return
+        with self._condition:
+            self._key = None
+            self._generation += 1
+            self._job = None
+            self.times = np.zeros(0)
+            self.path = np.zeros((0, 0, DIMENSIONS))
+            self.updates += 1
+            self._condition.notify()
+
+    def _strayed(self, bodies, rows, extra, now, tolerance):
+        # Whether a watched body is not where the prediction has it now, the new body is not checked
+        if len(self.times) == 0 or now < self.times[0] or now > self.times[-1] or not rows:
+            return False
+        predicted = np.stack([[np.interp(now, self.times, self.path[:, k, axis]) for axis in range(DIMENSIONS)]
+                              for k in range(len(rows))])
+        return np.linalg.norm(bodies.positions[list(rows)] - predicted, axis=1).max() > tolerance
+
+    def ahead(self, now):
+        # Times and positions of the prediction from now on
+        times, path = self.times, self.path
+        first = np.searchsorted(times, now)
+        return times[first:], path[first:]
+
+    def _run(self):
+        while True:
+            with self._condition:
+                if self._job is None:
+                    self._thread = None
+                    return
+                generation, state, watched, horizon, start = self._job
+                self._job = None
+            self._predict(generation, state, watched, horizon, start)
+
+    def _predict(self, generation, state, watched, horizon, start):
+        integrator = leapfrog()
+        step = horizon / self.steps
+        record_every = max(1, self.steps // self.points)
+        times = [start]
+        path = [state.positions[watched].copy()]
+        time = start
+        taken = 0
+        while True:
+            with self._condition:
+                # A whole horizon ahead, wait for the simulation to catch up
+                while generation == self._generation and time - self._now >= horizon:
+                    self._condition.wait()
+                if generation != self._generation:
+                    return
+                now = self._now
+            for _ in range(PUBLISH_EVERY):
+                # A step of a big system takes a while, a newer prediction should not wait for the rest
+                if generation != self._generation:
+                    return
+                integrator.step(state, step, physics.solver_gravity)
+                time += step
+                taken += 1
+                if taken % record_every == 0:
+                    times.append(time)
+                    path.append(state.positions[watched].copy())
+            # Points the simulation has already passed are dropped, keeping the one just before now
+            first = max(0, int(np.searchsorted(times, now)) - 1)
+            times, path = times[first:], path[first:]
+            with self._condition:
+                if generation != self._generation:
+                    return
+                self.times = np.array(times)
+                self.path = np.array(path)
+                self.updates += 1
@@ -0,0 +1,117 @@
+import json
+import os
+import threading
+import time
+from collections import deque
+
+import numpy as np
+
+# Where the time of each frame goes. The render loop marks the end of each of its stages, the time
+# since the last mark is put down to that stage. With the profiler off a mark only checks a flag
+# Timings are kept for the overlay and as events for a Chrome trace, which chrome://tracing or
+# https://ui.perfetto.dev can open. No pygame here, main.py draws the graph
+
+# Frames the overlay graph shows
+PROFILE_HISTORY = 120
+# Most trace events kept, the oldest are dropped past this
+TRACE_LIMIT = 200000
+# Default file the trace is written to when the p key turns the profiler off
+TRACE_PATH = 'profile_trace.json'
+# Colour of each stage in the order the stages are first marked, used again past the last one
+STAGE_COLOURS = np.array([[230, 80, 80], [240, 160, 60], [230, 220, 80], [120, 210, 90], [70, 190, 190],
+                          [80, 130, 240], [160, 100, 230], [230, 100, 190], [170, 170, 170], [120, 80, 50],
+                          [40, 120, 60], [250, 250, 250]], dtype=np.uint8)
+
+
+class frame_profiler:
+    def __init__(self, history=PROFILE_HISTORY):
+        self.enabled = False
+        # Stage names in the order they were first marked, and their column in times
+        self.stages = []
+        self._columns = {}
+        # Seconds spent in every stage of the last history frames, a ring with frames in order of head
+        self.times = np.zeros((history, 0))
+        self.frames = 0
+        self._current = []
+        self._last = None
+        self.events = deque(maxlen=TRACE_LIMIT)
+        self._thread = threading.get_ident()
+
+    def start(self):
+        # Timing starts with the next frame
+        self.enabled = True
+        self._last = None
+
+    def stop(self):
+        self.enabled = False
+        self._last = None
+
+    def begin_frame(self):
+        if not self.enabled:
+            return
+        self._current = [0.0] * len(self.stages)
+        self._last = time.perf_counter()
+
+    def mark(self, name):
+        # The time since the last mark was spent in the stage name
+        if self._last is None:
+            return
+        now = time.perf_counter()
+        column = self._columns.get(name)
+        if column is None:
+            column = self._columns[name] = len(self.stages)
+            self.stages.append(name)
+            self._current.append(0.0)
+            self.times = np.pad(self.times, ((0, 0), (0, 1)))
+        self._current[column] += now - self._last
+        self.events.append((name, self._last, now - self._last, self._thread))
+        self._last = now
+
+    def span(self, name, start, end):
+        # Time spent outside the render loop, for example by the physics thread, only goes in the trace
+        if self.enabled:
+            self.events.append((name, start, end - start, threading.get_ident()))
+
+    def end_frame(self):
+        if self._last is None:
+            return
+        self.times[self.frames % len(self.times)] = self._current
+        self.frames += 1
+
+    def recent(self):
+        # Stage times of the frames kept, oldest first
+        filled = min(self.frames, len(self.times))
+        return np.roll(self.times, -self.frames % len(self.times), axis=0)[len(self.times) - filled:]
+
+    def averages(self):
+        # Mean milliseconds of every stage over the frames kept, and the frames per second they add up to
+        recent = self.recent()
+        if len(recent) == 0:
+            return {}, 0.0
+        mean = recent.mean(axis=0) * 1e3
+        frame_ms = recent.sum(axis=1).mean() * 1e3
+        return dict(zip(self.stages, mean.tolist())), 1e3 / frame_ms if frame_ms else 0.0
+
+    def graph(self, height, ms_per_pixel):
+        # (frames, height, 3) image of the frames kept, one column a frame with its stages stacked up
+        # from the bottom in the colours of STAGE_COLOURS, black above
+        recent = self.recent()
+        tops = np.cumsum(recent, axis=1) * (1e3 / ms_per_pixel)
+        above = height - 1 - np.arange(height)
+        # Stage each pixel falls in, len(stages) for the pixels above the whole frame
+        stage = (above[np.newaxis, :, np.newaxis] >= tops[:, np.newaxis, :]).sum(axis=2)
+        colours = np.concatenate([STAGE_COLOURS[np.arange(len(self.stages)) % len(STAGE_COLOURS)],
+                                  np.zeros((1, 3), dtype=np.uint8)])
+        return colours[stage]
+
+    def save_trace(self, path=TRACE_PATH):
+        # Chrome trace event format, a complete event a stage of a frame in microseconds
+        process = os.getpid()
+        threads = {thread for _, _, _, thread in self.events}
+        trace = [{"name": "thread_name", "ph": "M", "pid": process, "tid": thread,
+                  "args": {"name": "render loop" if thread == self._thread else "physics thread"}}
+                 for thread in threads]
+        trace += [{"name": name, "cat": "frame", "ph": "X", "ts": start * 1e6, "dur": duration * 1e6,
+                   "pid": process, "tid": thread} for name, start, duration, thread in self.events]
+        with open(path, 'w') as file:
+            json.dump({"traceEvents": trace, "displayTimeUnit": "ms"}, file)
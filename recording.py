@@ -0,0 +1,142 @@
+import json
+import os
+import struct
+
+import numpy as np
+
+from gravity import DIMENSIONS
+
+# Trajectories recorded step by step into a binary file that is memory mapped, so hours of
+# simulation can be written and scrubbed through without holding them all in memory
+#
+# File layout
+#   8 bytes   magic, RECORDING_MAGIC
+#   8 bytes   length of the JSON header
+#   8 bytes   frames written so far, updated on every append
+#   JSON header with the names, masses, radii, dt, integrator and dimensions, padded to HEADER_ALIGN bytes
+#   frames of (time, positions (N, 3), velocities (N, 3)) as float64, (N, 2) in recordings made
+#   before there was a z, which have no dimensions in the header
+
+RECORDING_MAGIC = b'GRAVREC1'
+HEADER_ALIGN = 64
+# Frames the file grows by each time it fills up
+CHUNK_FRAMES = 4096
+# Default file for the r (record) and y (replay) keys
+RECORDING_PATH = 'recording.grav'
+
+
+def frame_dtype(n, dimensions=DIMENSIONS):
+    return np.dtype([('time', 'f8'), ('positions', 'f8', (n, dimensions)), ('velocities', 'f8', (n, dimensions))])
+
+
+class recorder:
+    def __init__(self, path, bodies, dt, integrator, start_time=0.0, chunk_frames=CHUNK_FRAMES):
+        self.path = path
+        self.time = start_time
+        self.bodies = len(bodies)
+        self.chunk_frames = chunk_frames
+        self.dtype = frame_dtype(self.bodies)
+        header = json.dumps({"names": [body.name for body in bodies], "masses": bodies.masses.tolist(),
+                             "radii": bodies.radii.tolist(), "dt": dt, "integrator": integrator,
+                             "dimensions": DIMENSIONS}).encode()
+        header += b' ' * (-(24 + len(header)) % HEADER_ALIGN)
+        self.offset = 24 + len(header)
+        self.frames = 0
+        self._file = open(path, 'w+b')
+        self._file.write(RECORDING_MAGIC + struct.pack('<QQ', len(header), 0) + header)
+        self._file.flush()
+        # The frame count is mapped too, so keeping it up to date is a memory write, not a seek and write
+        self._count = np.memmap(self._file, dtype='<u8', mode='r+', offset=16, shape=(1,))
+        self._capacity = 0
+        self._map = None
+        self._grow()
+
+    def _grow(self):
+        # Make the file a chunk bigger and map the frame area again
+        if self._map is not None:
+            self._map.flush()
+        self._capacity += self.chunk_frames
+        self._file.truncate(self.offset + self._capacity * self.dtype.itemsize)
+        self._map = np.memmap(self._file, dtype=self.dtype, mode='r+', offset=self.offset, shape=(self._capacity,))
+
+    def append(self, positions, velocities, dt):
+        # Write the state after a step of dt
+        if len(positions) != self.bodies:
+            raise ValueError("the number of bodies changed, start a new recording")
+        if self.frames == self._capacity:
+            self._grow()
+        self.time += dt
+        frame = self._map[self.frames]
+        frame['time'] = self.time
+        frame['positions'] = positions
+        frame['velocities'] = velocities
+        self.frames += 1
+        self._count[0] = self.frames
+
+    def close(self):
+        # Cut off the unused end of the last chunk
+        if self._map is None:
+            return
+        self._map.flush()
+        self._count.flush()
+        self._map = None
+        self._count = None
+        self._file.truncate(self.offset + self.frames * self.dtype.itemsize)
+        self._file.close()
+
+
+class recording:
+    # A recorded file opened for reading, frames is a read only memory map
+    def __init__(self, path):
+        with open(path, 'rb') as file:
+            magic = file.read(8)
+            if magic != RECORDING_MAGIC:
+                raise ValueError(f'{path} is not a recording')
+            header_length, frames = struct.unpack('<QQ', file.read(16))
+            header = json.loads(file.read(header_length))
+        self.names = header["names"]
+        self.masses = np.array(header["masses"], dtype=float)
+        self.radii = np.array(header["radii"], dtype=float)
+        self.dt = header["dt"]
+        self.integrator = header["integrator"]
+        dtype = frame_dtype(len(self.names), header.get("dimensions", 2))
+        # A recorder that is still writing may have grown the file past the frames it has finished
+        frames = min(frames, (os.path.getsize(path) - 24 - header_length) // dtype.itemsize)
+        self.frames = np.memmap(path, dtype=dtype, mode='r', offset=24 + header_length, shape=(frames,))
+        self.times = self.frames['time']
+
+    def __len__(self):
+        return len(self.frames)
+
+    def frame_at(self, time):
+        # Index of the last frame at or before time
+        return max(int(np.searchsorted(self.times, time, side='right')) - 1, 0)
+
+
+class player:
+    # Steps through a recording at speed frames per rendered frame, negative plays it backwards
+    def __init__(self, recording):
+        self.recording = recording
+        self.position = 0.0
+        self.speed = 1.0
+        self.paused = False
+
+    @property
+    def frame(self):
+        return int(self.position)
+
+    def advance(self):
+        if not self.paused:
+            self.seek(self.position + self.speed)
+
+    def seek(self, position):
+        self.position = min(max(position, 0.0), len(self.recording) - 1.0)
+
+    def apply(self, bodies):
+        # Copy the current frame into the system being drawn, returns its simulated time
+        # A 2D recording leaves z as it is, 0 in the bodies main.py makes for a replay
+        frame = self.recording.frames[self.frame]
+        dimensions = frame['positions'].shape[-1]
+        bodies.positions[:, :dimensions] = frame['positions']
+        bodies.velocities[:, :dimensions] = frame['velocities']
+        return float(frame['time'])
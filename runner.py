@@ -0,0 +1,197 @@
+import math
+import threading
+import time
+
+import numpy as np
+
+from gravity import DIMENSIONS
+from particles import PARTICLE_DTYPE
+
+# Runs the physics separately from the drawing, so a time warp means more steps of the same
+# size instead of one bigger and less stable step
+# step(state, dt) is the function that moves a state on, for example main.update_bodies
+
+# Longest physics step in simulated seconds, the time asked for is cut into steps no longer than this
+MAX_STEP = 1800
+# Share of a frame the physics may use when it runs inside the render loop
+FRAME_BUDGET = 0.8
+# Most simulated time the physics can fall behind by, in frames, anything past that is dropped
+MAX_BACKLOG_FRAMES = 4
+
+
+class state_arrays:
+    # A private copy of a system's arrays for the physics thread to work on
+    def __init__(self, state):
+        self.positions = state.positions.copy()
+        self.velocities = state.velocities.copy()
+        self.accelerations = state.accelerations.copy()
+        self.masses = state.masses.copy()
+        self.physical_radii = state.physical_radii.copy()
+        self.position_errors = state.position_errors.copy()
+        self.velocity_errors = state.velocity_errors.copy()
+        self.barycentric = state.barycentric
+        # Row of the system each row came from, rows go when collisions merge bodies
+        self.rows = np.arange(len(self.masses))
+        self.particles = None if state.particles is None else state.particles.copy()
+
+    def __len__(self):
+        return len(self.masses)
+
+    def keep(self, rows):
+        for name in ("positions", "velocities", "accelerations", "masses", "physical_radii", "position_errors",
+                     "velocity_errors", "rows"):
+            setattr(self, name, getattr(self, name)[rows])
+
+
+class snapshot:
+    # One copy of the changing part of the state, handed from the physics to the renderer
+    def __init__(self, n, particles=0):
+        self.positions = np.zeros((n, DIMENSIONS), dtype=float)
+        self.velocities = np.zeros((n, DIMENSIONS), dtype=float)
+        self.accelerations = np.zeros((n, DIMENSIONS), dtype=float)
+        self.masses = np.zeros(n, dtype=float)
+        self.physical_radii = np.zeros(n, dtype=float)
+        self.position_errors = np.zeros((n, DIMENSIONS), dtype=float)
+        self.velocity_errors = np.zeros((n, DIMENSIONS), dtype=float)
+        self.barycentric = False
+        self.rows = np.zeros(n, dtype=int)
+        self.particle_positions = np.zeros((particles, DIMENSIONS), dtype=PARTICLE_DTYPE)
+        self.particle_velocities = np.zeros((particles, DIMENSIONS), dtype=PARTICLE_DTYPE)
+        self.time = 0.0
+
+
+class physics_runner:
+    def __init__(self, state, step, max_step=MAX_STEP, profiler=None):
+        self.state = state
+        self.step = step
+        self.max_step = max_step
+        # Frame profiler the physics thread puts its batches of steps in, see profiler.py
+        self.profiler = profiler
+        # Simulated time so far
+        self.time = 0.0
+        # Simulated time asked for but not simulated yet
+        self.backlog = 0.0
+        self.steps_last_frame = 0
+        self.steps = 0
+        # Background thread, and the two snapshot buffers it swaps between
+        self.paused = False
+        self.warp = 0.0
+        self._thread = None
+        self._running = False
+        self._lock = threading.Lock()
+        self._buffers = []
+        self._front = 0
+        self._work = None
+
+    @property
+    def threaded(self):
+        return self._thread is not None
+
+    def _take_steps(self, state, backlog, deadline):
+        # As many equal steps of at most max_step as fit before the deadline, returns the time left over
+        count = math.ceil(backlog / self.max_step)
+        size = backlog / count if count else 0.0
+        taken = 0
+        while taken < count and (taken == 0 or time.perf_counter() < deadline):
+            self.step(state, size)
+            taken += 1
+        self.time += size * taken
+        self.steps += taken
+        return (backlog - size * taken if taken < count else 0.0), taken
+
+    def advance(self, sim_time, budget):
+        # Called once a frame by the render loop, runs up to budget seconds of physics
+        # A frame that runs out of time carries the rest over instead of taking a bigger step
+        self.backlog = min(self.backlog + sim_time, sim_time * MAX_BACKLOG_FRAMES)
+        self.backlog, self.steps_last_frame = self._take_steps(self.state, self.backlog,
+                                                               time.perf_counter() + budget)
+
+    def start(self, warp):
+        # Run the physics in a background thread at warp simulated seconds per real second
+        # The thread works on its own copy of the arrays and publishes snapshots for read()
+        self.stop()
+        self.warp = warp
+        self._work = state_arrays(self.state)
+        # Bodies in the order the thread's copy started with, to drop the ones it merges away
+        self._origin = list(self.state)
+        particles = 0 if self.state.particles is None else len(self.state.particles)
+        self._buffers = [snapshot(len(self.state), particles), snapshot(len(self.state), particles)]
+        self._publish()
+        self._running = True
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        # Stop the thread, the system is left with the last snapshot
+        if self._thread is not None:
+            self._running = False
+            self._thread.join()
+            self.read()
+            self._thread = None
+            self._buffers = []
+
+    def _run(self):
+        last = time.perf_counter()
+        backlog = 0.0
+        while self._running:
+            now = time.perf_counter()
+            if self.paused:
+                backlog = 0.0
+                time.sleep(0.01)
+            else:
+                # Steps are always max_step long, the thread keeps up with the warp or falls behind
+                backlog = min(backlog + self.warp * (now - last), self.max_step * MAX_BACKLOG_FRAMES)
+                taken = 0
+                while backlog >= self.max_step and time.perf_counter() < now + 0.01:
+                    self.step(self._work, self.max_step)
+                    backlog -= self.max_step
+                    self.time += self.max_step
+                    taken += 1
+                self.steps += taken
+                self.steps_last_frame = taken
+                if taken:
+                    if self.profiler is not None:
+                        self.profiler.span("physics steps", now, time.perf_counter())
+                    self._publish()
+                else:
+                    # Less than one step owed, give the render thread the processor
+                    time.sleep(0.001)
+            last = now
+
+    def _publish(self):
+        # Fill the back buffer without the lock, then swap it to the front
+        back = self._buffers[1 - self._front]
+        if len(back.masses) != len(self._work):
+            # Bodies were merged, the front buffer is still being read so only the back one is replaced
+            back = self._buffers[1 - self._front] = snapshot(len(self._work), len(back.particle_positions))
+        for name in ("positions", "velocities", "accelerations", "masses", "physical_radii", "position_errors",
+                     "velocity_errors", "rows"):
+            np.copyto(getattr(back, name), getattr(self._work, name))
+        back.barycentric = self._work.barycentric
+        if self._work.particles is not None:
+            np.copyto(back.particle_positions, self._work.particles.positions)
+            np.copyto(back.particle_velocities, self._work.particles.velocities)
+        back.time = self.time
+        with self._lock:
+            self._front = 1 - self._front
+
+    def read(self):
+        # Copy the newest snapshot into the system the renderer draws from, returns its simulated time
+        if not self._buffers:
+            return self.time
+        with self._lock:
+            front = self._buffers[self._front]
+            if len(front.rows) != len(self.state):
+                self.state.keep([self._origin[row].index for row in front.rows])
+            np.copyto(self.state.masses, front.masses)
+            np.copyto(self.state.physical_radii, front.physical_radii)
+            np.copyto(self.state.positions, front.positions)
+            np.copyto(self.state.velocities, front.velocities)
+            np.copyto(self.state.accelerations, front.accelerations)
+            np.copyto(self.state.position_errors, front.position_errors)
+            np.copyto(self.state.velocity_errors, front.velocity_errors)
+            self.state.barycentric = front.barycentric
+            if self.state.particles is not None:
+                np.copyto(self.state.particles.positions, front.particle_positions)
+                np.copyto(self.state.particles.velocities, front.particle_velocities)
+            return front.time
@@ -0,0 +1,159 @@
+import argparse
+import json
+
+import numpy as np
+
+import physics
+from integrators import INTEGRATOR_NAMES
+from particles import particle_cloud
+from physics import system
+
+# Scenario files, the bodies of a system with their state and the solver settings. Saved with the
+# time, dt and integrator of a run they are a checkpoint the run can be carried on from
+# .json is readable and can be edited by hand, .npz is binary for systems with millions of bodies
+# python scenarios.py system4 system4.json
+
+SCENARIO_FORMAT = "gravity-scenario"
+# Version 2 vectors are (x, y, z), version 1 files have (x, y) ones and load with every z at 0
+SCENARIO_VERSION = 2
+# Files F5 saves to and F9 loads from in the window, systems with more than JSON_BODY_LIMIT bodies
+# are saved as binary
+SCENARIO_PATH = 'scenario.json'
+BINARY_SCENARIO_PATH = 'scenario.npz'
+JSON_BODY_LIMIT = 10000
+# Solver settings in physics.py that are saved with a scenario
+SETTINGS = ["use_barnes_hut", "theta", "use_particle_mesh", "mesh_size", "mesh_short_range", "collisions",
+            "softening", "precision"]
+
+
+def is_scenario_file(name):
+    return name.endswith(('.json', '.npz'))
+
+
+def scenario_settings(time=0.0, dt=None, integrator=None):
+    # Everything but the bodies, the integrator and its state only when it is a checkpoint
+    settings = {"format": SCENARIO_FORMAT, "version": SCENARIO_VERSION, "time": time, "dt": dt}
+    settings.update({name: getattr(physics, name) for name in SETTINGS})
+    if integrator is not None:
+        settings["integrator"] = type(integrator).__name__
+        settings["integrator_state"] = integrator.checkpoint()
+    return settings
+
+
+def save_scenario(path, bodies, time=0.0, dt=None, integrator=None):
+    # With an integrator the accelerations are saved too, so the first step after loading does not
+    # work them out again and the run carries on exactly as if it had not stopped
+    # In the compensated precision mode the rounding kept with the positions and velocities is saved
+    # as well, so the run carries on to the same bits
+    settings = scenario_settings(time, dt, integrator)
+    compensated = integrator is not None and physics.precision == "compensated"
+    if compensated:
+        settings["barycentric"] = bodies.barycentric
+    if path.endswith('.npz'):
+        # Not compressed, the arrays are read straight into the buffers of the system
+        arrays = {"names": np.array([body.name for body in bodies], dtype=str), "masses": bodies.masses,
+                  "positions": bodies.positions, "velocities": bodies.velocities, "radii": bodies.radii,
+                  "physical_radii": bodies.physical_radii}
+        if integrator is not None:
+            arrays["accelerations"] = bodies.accelerations
+        if compensated:
+            arrays["position_errors"] = bodies.position_errors
+            arrays["velocity_errors"] = bodies.velocity_errors
+        if bodies.particles is not None:
+            arrays["particle_positions"] = bodies.particles.positions
+            arrays["particle_velocities"] = bodies.particles.velocities
+        np.savez(path, settings=np.array(json.dumps(settings)), **arrays)
+        return
+    rows = []
+    for i, body in enumerate(bodies):
+        row = {"name": body.name, "mass": float(bodies.masses[i]), "position": bodies.positions[i].tolist(),
+               "velocity": bodies.velocities[i].tolist(), "radius": float(bodies.radii[i]),
+               "physical_radius": float(bodies.physical_radii[i])}
+        if integrator is not None:
+            row["acceleration"] = bodies.accelerations[i].tolist()
+        if compensated:
+            row["position_error"] = bodies.position_errors[i].tolist()
+            row["velocity_error"] = bodies.velocity_errors[i].tolist()
+        rows.append(row)
+    # One body to a line so the file is easy to read and edit
+    bodies_text = ',\n'.join('  ' + json.dumps(row) for row in rows)
+    particles_text = ''
+    if bodies.particles is not None:
+        # Test particles as two long lists, one line each
+        particles_text = (f',\n "particles": {{\n  "positions": {json.dumps(bodies.particles.positions.tolist())},'
+                          f'\n  "velocities": {json.dumps(bodies.particles.velocities.tolist())}\n }}')
+    with open(path, 'w') as file:
+        file.write(json.dumps(settings, indent=1)[:-2] + f',\n "bodies": [\n{bodies_text}\n ]{particles_text}\n}}\n')
+
+
+def load_scenario(path):
+    # Returns the system and the settings it was saved with
+    if path.endswith('.npz'):
+        with np.load(path) as data:
+            settings = json.loads(str(data["settings"]))
+            accelerations = data["accelerations"] if "accelerations" in data else None
+            bodies = system.from_arrays(data["names"].tolist(), data["masses"], data["positions"],
+                                        data["velocities"], data["radii"], data["physical_radii"], accelerations,
+                                        data.get("position_errors"), data.get("velocity_errors"))
+            if "particle_positions" in data:
+                bodies.particles = particle_cloud(data["particle_positions"], data["particle_velocities"])
+    else:
+        with open(path) as file:
+            settings = json.load(file)
+        rows = settings.pop("bodies")
+        particles = settings.pop("particles", None)
+        accelerations = None
+        if rows and all("acceleration" in row for row in rows):
+            accelerations = [row["acceleration"] for row in rows]
+        position_errors = velocity_errors = None
+        if rows and all("position_error" in row and "velocity_error" in row for row in rows):
+            position_errors = [row["position_error"] for row in rows]
+            velocity_errors = [row["velocity_error"] for row in rows]
+        bodies = system.from_arrays([row["name"] for row in rows], [row["mass"] for row in rows],
+                                    [row["position"] for row in rows], [row["velocity"] for row in rows],
+                                    [row.get("radius", 2) for row in rows],
+                                    [row.get("physical_radius", 0.0) for row in rows], accelerations,
+                                    position_errors, velocity_errors)
+        if particles is not None:
+            bodies.particles = particle_cloud(particles["positions"], particles["velocities"])
+    if settings.get("format") != SCENARIO_FORMAT:
+        raise ValueError(f'{path} is not a scenario file')
+    settings["accelerations"] = accelerations is not None
+    # Recentring a checkpoint that is already barycentric again would change its bits
+    bodies.barycentric = settings.get("barycentric", False)
+    return bodies, settings
+
+
+def restore_settings(bodies, settings):
+    # Put the solver settings and the integrator of a loaded scenario back, returns its time and dt
+    for name in SETTINGS:
+        if name in settings:
+            setattr(physics, name, settings[name])
+    if "integrator" in settings:
+        physics.integrator = INTEGRATOR_NAMES[settings["integrator"]]()
+        physics.integrator.restore(settings.get("integrator_state", {}))
+        if settings["accelerations"]:
+            # The saved accelerations belong to the saved positions
+            physics.integrator.remember(bodies)
+    return settings.get("time", 0.0), settings.get("dt")
+
+
+def main(argv=None):
+    # Save a built in system, or convert a scenario between .json and .npz
+    from systems import SYSTEM_NAMES, load_system
+    parser = argparse.ArgumentParser(description="Write a system out as a scenario file")
+    parser.add_argument("system", help="one of " + ", ".join(SYSTEM_NAMES) + " or a scenario file")
+    parser.add_argument("output", help="scenario file to write, .json or .npz")
+    parser.add_argument("--seed", type=int, help="seed for random systems")
+    args = parser.parse_args(argv)
+    if is_scenario_file(args.system):
+        # Keep the time, dt and integrator of a checkpoint
+        bodies, settings = load_scenario(args.system)
+        time, dt = restore_settings(bodies, settings)
+        save_scenario(args.output, bodies, time, dt, physics.integrator if "integrator" in settings else None)
+    else:
+        save_scenario(args.output, load_system(args.system, seed=args.seed))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,224 @@
+import argparse
+import csv
+import itertools
+import multiprocessing
+import os
+import sys
+import time
+
+import numpy as np
+
+import physics
+from gravity import nearest_neighbour_distances
+from headless import INTEGRATOR_NAMES, parse_duration, run, system_name
+from systems import SYSTEM_NAMES, load_system
+
+# Runs many variants of one system over every processor core and streams a summary of each run
+# into one csv table. Runs already in the table are skipped, so a sweep that crashed carries on
+# python sweep.py system3 --duration 30d --grid "Asteroid 1.vy=700,760,820" --grid "Moon.mass=7e22,7.37e22"
+# python sweep.py system3 --duration 30d --random "Asteroid 1.vy=normal:760:20" --samples 200 --seed 1
+
+# Body values a parameter can set, "Body name.field", every body with that name is changed
+FIELDS = ["mass", "x", "y", "z", "vx", "vy", "vz"]
+# Bodies closer than this many metres at a checked step count as a collision
+COLLISION_DISTANCE = 1e6
+# Steps between collision checks
+CHECK_EVERY = 10
+# Columns of every finished run between its parameter values and the bodies' orbits
+SUMMARY_COLUMNS = ["energy_error", "wall_time", "ejections", "collisions", "closest_approach"]
+
+
+def set_parameter(bodies, parameter, value):
+    name, field = parameter.rsplit('.', 1)
+    if field not in FIELDS:
+        raise ValueError(f'Unknown field "{field}" in {parameter}, pick one of {", ".join(FIELDS)}')
+    matches = [body for body in bodies if body.name == name]
+    if not matches:
+        raise ValueError(f'No body called "{name}" in {parameter}')
+    for body in matches:
+        if field == "mass":
+            body.mass = value
+        elif field in ("x", "y", "z"):
+            body.position["xyz".index(field)] = value
+        else:
+            body.velocity["xyz".index(field[1])] = value
+
+
+def parse_grid(text):
+    # "Asteroid 1.vy=700,760,820"
+    parameter, values = text.split('=', 1)
+    return parameter, [float(value) for value in values.split(',')]
+
+
+def parse_distribution(text):
+    # "Asteroid 1.vy=normal:760:20" or "Moon.mass=uniform:7e22:8e22"
+    parameter, spec = text.split('=', 1)
+    kind, a, b = spec.split(':')
+    if kind not in ("normal", "uniform"):
+        raise ValueError(f'Unknown distribution "{kind}", use normal or uniform')
+    return parameter, (kind, float(a), float(b))
+
+
+def make_jobs(grid, distributions, samples, seed):
+    # Every grid point, times every random sample when there are distributions
+    # All the random values are drawn up front so a resumed sweep gets the same runs
+    grid_points = [dict(zip(grid, values)) for values in itertools.product(*grid.values())]
+    rng = np.random.default_rng(seed)
+    drawn = {parameter: getattr(rng, kind)(a, b, samples) for parameter, (kind, a, b) in distributions.items()}
+    random_points = [{parameter: float(values[i]) for parameter, values in drawn.items()}
+                     for i in range(samples if distributions else 1)]
+    return [(run_id, {**grid_point, **random_point})
+            for run_id, (grid_point, random_point) in enumerate(itertools.product(grid_points, random_points))]
+
+
+def body_labels(names):
+    # Bodies that share a name get their index added
+    return [name if names.count(name) == 1 else f'{name} {i}' for i, name in enumerate(names)]
+
+
+def result_columns(parameters, names):
+    # The header of the results table, the same for every row so a run that fails first does not
+    # decide it, failed runs leave everything but run, their parameters and error empty
+    orbits = [f'{label} {element}' for label in body_labels(names) for element in ("a", "e")]
+    return ["run", *parameters, *SUMMARY_COLUMNS, *orbits, "error"]
+
+
+def run_variant(job):
+    # One run in a worker process, returns its row of the results table
+    run_id, values, settings = job
+    row = {"run": run_id, **values}
+    try:
+        physics.integrator = INTEGRATOR_NAMES[settings["integrator"]]()
+        physics.use_barnes_hut = settings["barnes_hut"]
+        physics.theta = settings["theta"]
+        physics.use_particle_mesh = settings["particle_mesh"] or settings["p3m"]
+        physics.mesh_short_range = settings["p3m"]
+        physics.mesh_size = settings["mesh_size"]
+        physics.precision = settings["precision"]
+        bodies = load_system(settings["system"], seed=settings["seed"])
+        for parameter, value in values.items():
+            set_parameter(bodies, parameter, value)
+        summary, trajectory = run(bodies, settings["dt"], settings["steps"], settings["check_every"])
+
+        closest = np.full(len(bodies), np.inf)
+        for positions in trajectory["positions"]:
+            np.minimum(closest, nearest_neighbour_distances(positions), out=closest)
+        central = int(np.argmax(bodies.masses))
+        semi_major_axis, eccentricity, bound = physics.orbital_elements(
+            bodies.positions, bodies.velocities, bodies.masses, central)
+
+        row.update({"energy_error": summary["energy_error"], "wall_time": summary["wall_time"],
+                    "ejections": int(np.count_nonzero(~bound)),
+                    "collisions": int(np.count_nonzero(closest < settings["collision_distance"])),
+                    "closest_approach": float(closest.min(initial=np.inf))})
+        for i, label in enumerate(body_labels([body.name for body in bodies])):
+            row[f'{label} a'] = float(semi_major_axis[i])
+            row[f'{label} e'] = float(eccentricity[i])
+        row["error"] = ""
+    except Exception as error:
+        row["error"] = repr(error)
+    return row
+
+
+def finished(row):
+    # A row cut off by a crash has empty fields, a run that failed has its error
+    return None not in row.values() and row.get("error") == ""
+
+
+def completed_runs(path):
+    # Runs already written and the header, and whether every row is a finished run
+    if not os.path.exists(path):
+        return set(), None, True
+    with open(path, newline='') as file:
+        reader = csv.DictReader(file)
+        rows = list(reader)
+        done = {int(row["run"]) for row in rows if finished(row)}
+        return done, reader.fieldnames, len(done) == len(rows)
+
+
+def keep_finished(path, columns):
+    # The table written out again with only the finished runs, so the runs that failed or were cut
+    # off are run again, and with the full header when it was started without one
+    with open(path, newline='') as file:
+        reader = csv.DictReader(file)
+        unknown = [name for name in reader.fieldnames or [] if name not in columns]
+        if unknown:
+            raise ValueError(f'{path} has columns {", ".join(unknown)} that this sweep does not make')
+        rows = [row for row in reader if finished(row)]
+    with open(path, 'w', newline='') as file:
+        writer = csv.DictWriter(file, fieldnames=columns, restval="")
+        writer.writeheader()
+        writer.writerows(rows)
+
+
+def sweep(system_name, steps, dt, output, grid=None, distributions=None, samples=1, seed=0, processes=None,
+          integrator="leapfrog", barnes_hut=False, theta=physics.theta, particle_mesh=False, p3m=False,
+          mesh_size=physics.mesh_size, precision=physics.precision, check_every=CHECK_EVERY,
+          collision_distance=COLLISION_DISTANCE):
+    settings = {"system": system_name, "steps": steps, "dt": dt, "seed": seed, "integrator": integrator,
+                "barnes_hut": barnes_hut, "theta": theta, "particle_mesh": particle_mesh, "p3m": p3m,
+                "mesh_size": mesh_size, "precision": precision, "check_every": check_every, "collision_distance": collision_distance}
+    jobs = make_jobs(grid or {}, distributions or {}, samples, seed)
+    columns = result_columns(list(grid or {}) + list(distributions or {}),
+                             [body.name for body in load_system(system_name, seed=seed)])
+    done, fieldnames, tidy = completed_runs(output)
+    if fieldnames is not None and (fieldnames != columns or not tidy):
+        keep_finished(output, columns)
+        done, fieldnames, tidy = completed_runs(output)
+    todo = [(run_id, values, settings) for run_id, values in jobs if run_id not in done]
+    print(f'{len(jobs)} runs, {len(jobs) - len(todo)} already in {output}', file=sys.stderr)
+
+    begin = time.perf_counter()
+    # Workers are started fresh rather than forked, a fork copies Numba's thread pool without its
+    # threads and the workers then hang when they exit
+    context = multiprocessing.get_context("spawn")
+    with context.Pool(processes) as pool, open(output, 'a', newline='') as file:
+        writer = csv.DictWriter(file, fieldnames=columns, restval="")
+        if fieldnames is None:
+            writer.writeheader()
+        for finished, row in enumerate(pool.imap_unordered(run_variant, todo), start=1):
+            writer.writerow(row)
+            # Flush every row so a crash loses at most the runs still going
+            file.flush()
+            elapsed = time.perf_counter() - begin
+            remaining = elapsed / finished * (len(todo) - finished)
+            status = row["error"] or f'energy error {row["energy_error"]:.2e}'
+            print(f'[{finished}/{len(todo)}] run {row["run"]}: {status}, about {remaining:.0f}s left', file=sys.stderr)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run many variants of a system over a process pool")
+    parser.add_argument("system", type=system_name, help="one of " + ", ".join(SYSTEM_NAMES) + " or a scenario file")
+    length = parser.add_mutually_exclusive_group(required=True)
+    length.add_argument("--steps", type=int, help="number of steps per run")
+    length.add_argument("--duration", type=parse_duration, help="simulated time per run, e.g. 30d")
+    parser.add_argument("--dt", type=float, default=1800, help="seconds per step (default 1800)")
+    parser.add_argument("--grid", type=parse_grid, action="append", default=[],
+                        help='values to try, "Body.field=v1,v2,..." with field one of ' + ", ".join(FIELDS))
+    parser.add_argument("--random", type=parse_distribution, action="append", default=[],
+                        help='random values, "Body.field=normal:mean:std" or "Body.field=uniform:low:high"')
+    parser.add_argument("--samples", type=int, default=1, help="random samples per grid point")
+    parser.add_argument("--seed", type=int, default=0, help="seed for the random values and random systems")
+    parser.add_argument("--integrator", choices=sorted(INTEGRATOR_NAMES), default="leapfrog")
+    parser.add_argument("--barnes-hut", action="store_true")
+    parser.add_argument("--theta", type=float, default=physics.theta)
+    parser.add_argument("--particle-mesh", action="store_true")
+    parser.add_argument("--p3m", action="store_true", help="particle-mesh with the close pairs added exactly")
+    parser.add_argument("--mesh-size", type=int, default=physics.mesh_size)
+    parser.add_argument("--precision", choices=physics.PRECISIONS, default=physics.precision)
+    parser.add_argument("--processes", type=int, help="worker processes (default every core)")
+    parser.add_argument("--check-every", type=int, default=CHECK_EVERY, help="steps between collision checks")
+    parser.add_argument("--collision-distance", type=float, default=COLLISION_DISTANCE)
+    parser.add_argument("--output", required=True, help="results table, .csv, appended to when resuming")
+    args = parser.parse_args(argv)
+
+    steps = args.steps if args.steps is not None else int(round(args.duration / args.dt))
+    sweep(args.system, steps, args.dt, args.output, grid=dict(args.grid), distributions=dict(args.random),
+          samples=args.samples, seed=args.seed, processes=args.processes, integrator=args.integrator,
+          barnes_hut=args.barnes_hut, theta=args.theta, particle_mesh=args.particle_mesh, p3m=args.p3m,
+          mesh_size=args.mesh_size, precision=args.precision, check_every=args.check_every,
+          collision_distance=args.collision_distance)
+
+
+if __name__ == '__main__':
+    main()
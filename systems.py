@@ -0,0 +1,72 @@
+import math
+import random
+
+from particles import ring
+from physics import body, system
+from scenarios import is_scenario_file, load_scenario
+
+# The built in systems, every call makes new bodies so a system can be loaded more than once
+# A .json or .npz scenario file can be given instead of a name, see scenarios.py
+
+SYSTEM_NAMES = ["system1", "system2", "system3", "system4", "asteroid_belt", "pluto", "random_earths", "empty"]
+# Test particles in the main belt of asteroid_belt, between 2.1 and 3.3 AU from the Sun
+BELT_PARTICLES = 200000
+# Degrees Pluto's orbit is tilted out of the plane of the planets' orbits
+PLUTO_INCLINATION = 17.16
+
+
+def load_system(name, seed=None):
+    if is_scenario_file(name):
+        return load_scenario(name)[0]
+    # Bodies, the last number is the radius in metres used for collisions
+    Earth = body(5.24e24, [0, 0], [0, 0], 10, "Earth", 6.371e6)
+    Minmus = body(3.5e22, [0, -600], [-900000000, 0], 2, "Minmus", 6.0e4)
+    Moon = body(7.37e22, [0, -954], [-384000000, 0], 6, "Moon", 1.737e6)
+    Asteroid = body(27.0e6, [0, 760], [600000000, 0], 2, "Asteroid 1", 20)
+    Asteroid1 = body(27.0e6, [0, 660], [500000000, 0], 2, "Asteroid 2", 20)
+    Asteroid2 = body(27.0e6, [0, 660], [400000000, 0], 2, "Asteroid 3", 20)
+    GeoSat = body(120, [0, 2940], [40430423, 0], 1, "Geo Sat", 5)
+    Sun = body(1.989e30, [0, 0], [0, 0], 20, "The Sun", 6.957e8)
+    Moon2 = body(7.37e22, [0, 954 + 29785], [1.496e11 + 384000000, 0], 2, "Moon", 1.737e6)
+    Mercury = body(3.30e23, [0, 47360], [5.79e10, 0], 2, "Mercury", 2.440e6)
+    Venus = body(4.87e24, [0, 35020], [1.08e11, 0], 2, "Venus", 6.052e6)
+    Earth2 = body(5.97e24, [0, 29780], [1.496e11, 0], 2, "Earth", 6.371e6)
+    Mars = body(6.42e23, [0, 24070], [2.28e11, 0], 2, "Mars", 3.390e6)
+    Jupiter = body(1.90e27, [0, 13070], [7.78e11, 0], 5, "Jupiter", 6.991e7)
+    Saturn = body(5.68e26, [0, 9680], [1.43e12, 0], 4, "Saturn", 5.823e7)
+    Uranus = body(8.68e25, [0, 6800], [2.87e12, 0], 3, "Uranus", 2.536e7)
+    Neptune = body(1.02e26, [0, 5430], [4.50e12, 0], 3, "Neptune", 2.462e7)
+    Phobos = body(1.07e16, [0, 24070 + 2138], [2.28e11 + 9.376e6, 0], 2, "Phobos", 1.1e4)
+    Deimos = body(1.48e15, [0, 24070 + 1350], [2.28e11 + 2.346e7, 0], 2, "Deimos", 6.2e3)
+    # At its closest to the Sun, moving up out of the plane of the others
+    inclination = math.radians(PLUTO_INCLINATION)
+    Pluto = body(1.30e22, [0, 6100 * math.cos(inclination), 6100 * math.sin(inclination)], [4.44e12, 0, 0], 2,
+                 "Pluto", 1.188e6)
+
+    # Systems
+    if name == "system1":
+        return system([Earth, Moon, Asteroid, Asteroid1, Asteroid2, Minmus, GeoSat])
+    if name == "system2":
+        return system([Earth, Moon])
+    if name == "system3":
+        return system([Earth, Moon, Asteroid, Asteroid1, Asteroid2])
+    if name == "system4":
+        return system([Sun, Mercury, Venus, Earth2, Moon2, Mars, Phobos, Deimos, Jupiter, Saturn, Neptune])
+    if name == "asteroid_belt":
+        # System 4 with a belt of test particles between Mars and Jupiter, seed makes it repeatable
+        solar_system = system([Sun, Mercury, Venus, Earth2, Moon2, Mars, Phobos, Deimos, Jupiter, Saturn, Neptune])
+        solar_system.particles = ring(Sun, BELT_PARTICLES, 3.14e11, 4.94e11, seed=seed, eccentricity=0.1)
+        return solar_system
+    if name == "pluto":
+        # System 4 out to Pluto, the only orbit that leaves the x-y plane, tilt the view to see it
+        return system([Sun, Mercury, Venus, Earth2, Moon2, Mars, Phobos, Deimos, Jupiter, Saturn, Uranus, Neptune,
+                       Pluto])
+    if name == "random_earths":
+        # 50 Earths dropped at random, seed makes it repeatable
+        generator = random.Random(seed)
+        return system([body(5.24e24, [0, 0], [generator.randint(0, 2000000000000),
+                                              generator.randint(0, 200000000000)], 10, "Earth", 6.371e6)
+                       for i in range(50)])
+    if name == "empty":
+        return system()
+    raise ValueError(f'Unknown system "{name}", pick one of {", ".join(SYSTEM_NAMES)}')
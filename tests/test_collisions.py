@@ -0,0 +1,35 @@
+import numpy as np
+
+from collisions import bounce, merge
+from physics import system
+
+# Collisions conserve what they should and drop the rounding kept for the rows they write over
+
+
+def pair(positions, velocities, masses=(2.0, 1.0), physical_radii=(1.0, 1.0)):
+    # Two touching bodies and a third far away, every row carrying some rounding
+    bodies = system.from_arrays(["a", "b", "c"], [*masses, 1.0], [*positions, (1e9, 0, 0)],
+                                [*velocities, (0, 0, 0)], [2, 2, 2], [*physical_radii, 1.0],
+                                position_errors=np.full((3, 3), 1e-9), velocity_errors=np.full((3, 3), 1e-12))
+    return bodies
+
+
+def test_merge_keeps_momentum_and_clears_errors():
+    bodies = pair([(0, 0, 0), (1.5, 0, 0)], [(0, 0, 0), (3, 0, 0)])
+    momentum = (bodies.masses[:, np.newaxis] * bodies.velocities).sum(axis=0)
+    absorbed = merge(bodies, np.array([0]), np.array([1]))
+    assert absorbed.tolist() == [False, True, False]
+    assert bodies.masses[0] == 3.0
+    assert np.allclose(bodies.masses[0] * bodies.velocities[0], momentum)
+    assert not np.any(bodies.position_errors[0]) and not np.any(bodies.velocity_errors[0])
+    assert np.all(bodies.position_errors[2] == 1e-9) and np.all(bodies.velocity_errors[2] == 1e-12)
+
+
+def test_bounce_keeps_momentum_and_clears_errors():
+    bodies = pair([(0, 0, 0), (1.5, 0, 0)], [(1, 0, 0), (-1, 0, 0)])
+    momentum = (bodies.masses[:, np.newaxis] * bodies.velocities).sum(axis=0)
+    bounce(bodies, np.array([0]), np.array([1]), np.array([0.0]), 1.0)
+    assert np.allclose((bodies.masses[:, np.newaxis] * bodies.velocities).sum(axis=0), momentum)
+    assert bodies.velocities[1, 0] > bodies.velocities[0, 0]
+    assert not np.any(bodies.position_errors[:2]) and not np.any(bodies.velocity_errors[:2])
+    assert np.all(bodies.position_errors[2] == 1e-9) and np.all(bodies.velocity_errors[2] == 1e-12)
@@ -0,0 +1,54 @@
+import os
+import shutil
+import subprocess
+import sys
+
+import pytest
+
+from commands import read_command_log
+
+# Command logs, read and played back through the window with no display
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+REPLAY_LOG = os.path.join(ROOT, "tests", "replay_commands.jsonl")
+
+
+def write_log(tmp_path, text):
+    path = tmp_path / "log.jsonl"
+    path.write_text(text)
+    return str(path)
+
+
+def test_read_command_log(tmp_path):
+    path = write_log(tmp_path, '# comment\n\n[2, "click", 60, 60]\n[2, "quit"]\n[0, "zoom_in"]\n')
+    assert read_command_log(path, {"click", "quit", "zoom_in"}) == {
+        0: [("zoom_in",)], 2: [("click", 60, 60), ("quit",)]}
+
+
+@pytest.mark.parametrize("line, message", [
+    ('[1.5, "quit"]', "line 2: frame 1.5"), ('["a", "quit"]', 'line 2: frame "a"'),
+    ('[1, "fly"]', 'line 2: unknown command "fly"'), ('{"frame": 1}', "line 2: expected")])
+def test_bad_lines_name_file_and_line(tmp_path, line, message):
+    path = write_log(tmp_path, f'[0, "quit"]\n{line}\n')
+    with pytest.raises(ValueError, match=message) as error:
+        read_command_log(path, {"quit"})
+    assert str(error.value).startswith(path)
+
+
+def play(directory):
+    # Play the replay log in a fresh directory and return the checkpoint it saved
+    pytest.importorskip("pygame")
+    os.makedirs(directory / "Images")
+    for image in ("Play.png", "Pause.png"):
+        shutil.copy(os.path.join(ROOT, image), directory / "Images" / image)
+    env = dict(os.environ, SDL_VIDEODRIVER="dummy", SDL_AUDIODRIVER="dummy")
+    subprocess.run([sys.executable, os.path.join(ROOT, "main.py"), "system4", "--play-commands", REPLAY_LOG],
+                   cwd=directory, env=env, check=True, capture_output=True, timeout=300)
+    return (directory / "scenario.json").read_text()
+
+
+def test_replay_is_deterministic(tmp_path):
+    first = play(tmp_path / "first")
+    second = play(tmp_path / "second")
+    assert '"precision": "compensated"' in first
+    assert first == second
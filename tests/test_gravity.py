@@ -0,0 +1,59 @@
+import numpy as np
+import pytest
+
+import physics
+from barnes_hut import random_cloud
+from gravity import KERNEL_CHUNK_PAIRS
+from gravity_jit import JIT_AVAILABLE
+from physics import calculate_accelerations, calculate_gravity_loop, system
+from systems import load_system
+
+# The vectorised and compiled kernels against the original per pair loop, each acceleration to a
+# relative error below TOLERANCE
+
+TOLERANCE = 1e-12
+# Bodies in the random cloud, enough that the NumPy kernel works through it in several row blocks
+CLOUD_SIZE = 1100
+BACKENDS = ["numpy", pytest.param("jit", marks=pytest.mark.skipif(not JIT_AVAILABLE, reason="needs Numba"))]
+
+
+def cloud(n, seed=1):
+    positions, masses = random_cloud(n, seed)
+    return system.from_arrays([f'Body {k}' for k in range(n)], masses, positions, np.zeros_like(positions),
+                              np.full(n, 2.0), np.zeros(n))
+
+
+@pytest.fixture(scope="module", params=["system1", "system2", "system3", "system4", "cloud"])
+def reference(request):
+    # A system and the accelerations the loop gives it
+    bodies = cloud(CLOUD_SIZE) if request.param == "cloud" else load_system(request.param)
+    calculate_gravity_loop(bodies)
+    return bodies, bodies.accelerations.copy()
+
+
+@pytest.fixture(params=BACKENDS)
+def backend(request, monkeypatch):
+    monkeypatch.setattr(physics, "backend", request.param)
+    monkeypatch.setattr(physics, "precision", "standard")
+    return request.param
+
+
+def assert_matches(accelerations, expected):
+    error = np.linalg.norm(accelerations - expected, axis=1) / np.linalg.norm(expected, axis=1)
+    assert error.max() < TOLERANCE
+
+
+def test_cloud_crosses_row_blocks():
+    assert CLOUD_SIZE * CLOUD_SIZE > KERNEL_CHUNK_PAIRS
+
+
+def test_matches_loop(reference, backend):
+    bodies, expected = reference
+    assert_matches(calculate_accelerations(bodies.positions, bodies.masses), expected)
+
+
+def test_targets_match_loop(reference, backend):
+    bodies, expected = reference
+    rows = np.arange(0, len(bodies), 3)
+    accelerations = calculate_accelerations(bodies.positions, bodies.masses, targets=bodies.positions[rows])
+    assert_matches(accelerations, expected[rows])
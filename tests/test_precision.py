@@ -0,0 +1,64 @@
+import numpy as np
+import pytest
+
+import physics
+from gravity_jit import JIT_AVAILABLE, set_threads
+from integrators import leapfrog
+from scenarios import load_scenario, restore_settings, save_scenario
+from systems import load_system
+
+# The compensated precision mode comes out the same to the bit on every backend and thread count,
+# and a run carried on from a checkpoint ends where the unbroken run does
+
+STEPS = 200
+DT = 1800
+needs_jit = pytest.mark.skipif(not JIT_AVAILABLE, reason="needs Numba")
+
+
+@pytest.fixture(autouse=True)
+def compensated(monkeypatch):
+    monkeypatch.setattr(physics, "precision", "compensated")
+    monkeypatch.setattr(physics, "integrator", leapfrog())
+    yield
+    set_threads(None)
+
+
+def run(bodies, steps, backend):
+    physics.backend = backend
+    for _ in range(steps):
+        physics.update_bodies(bodies, DT)
+    return bodies
+
+
+def assert_same_bits(bodies, expected):
+    for name in ("positions", "velocities", "position_errors", "velocity_errors"):
+        assert np.array_equal(getattr(bodies, name), getattr(expected, name)), name
+
+
+@needs_jit
+@pytest.mark.parametrize("threads", [1, None])
+@pytest.mark.parametrize("system_name", ["system3", "system4"])
+def test_backends_agree(monkeypatch, system_name, threads):
+    monkeypatch.setattr(physics, "backend", "numpy")
+    expected = run(load_system(system_name), STEPS, "numpy")
+    physics.integrator = leapfrog()
+    set_threads(threads)
+    assert_same_bits(run(load_system(system_name), STEPS, "jit"), expected)
+    assert np.any(expected.position_errors)
+
+
+@pytest.mark.parametrize("extension", ["json", "npz"])
+def test_checkpoint_resumes_on_same_bits(monkeypatch, tmp_path, extension):
+    backend = "jit" if JIT_AVAILABLE else "numpy"
+    monkeypatch.setattr(physics, "backend", backend)
+    expected = run(load_system("system4"), 2 * STEPS, backend)
+
+    physics.integrator = leapfrog()
+    bodies = run(load_system("system4"), STEPS, backend)
+    path = str(tmp_path / f'checkpoint.{extension}')
+    save_scenario(path, bodies, STEPS * DT, DT, physics.integrator)
+    physics.precision = "standard"
+    resumed, settings = load_scenario(path)
+    restore_settings(resumed, settings)
+    assert physics.precision == "compensated" and resumed.barycentric
+    assert_same_bits(run(resumed, STEPS, backend), expected)
@@ -0,0 +1,84 @@
+import numpy as np
+import pytest
+
+import physics
+from integrators import block_leapfrog
+from particles import particle_cloud
+from scenarios import load_scenario, restore_settings, save_scenario
+from systems import load_system
+
+# Scenario files give back the system they were saved from, and a checkpoint carries the run on
+# exactly as if it had not stopped
+
+STEPS = 20
+DT = 86400
+ARRAYS = ["masses", "positions", "velocities", "radii", "physical_radii"]
+
+
+@pytest.fixture(autouse=True)
+def settings(monkeypatch):
+    # Every physics setting a test or restore_settings changes is put back afterwards
+    for name in ["integrator", "use_barnes_hut", "theta", "use_particle_mesh", "mesh_size", "mesh_short_range",
+                 "collisions", "softening", "precision"]:
+        monkeypatch.setattr(physics, name, getattr(physics, name))
+
+
+def with_particles(bodies, count=50, seed=0):
+    rng = np.random.default_rng(seed)
+    radius = rng.uniform(3e11, 4e11, count)
+    angle = rng.uniform(0, 2 * np.pi, count)
+    positions = np.column_stack((radius * np.cos(angle), radius * np.sin(angle), np.zeros(count)))
+    velocities = np.column_stack((-np.sin(angle), np.cos(angle), np.zeros(count))) * 18000.0
+    bodies.particles = particle_cloud(positions, velocities)
+    return bodies
+
+
+def run(bodies, steps):
+    for _ in range(steps):
+        physics.update_bodies(bodies, DT)
+    return bodies
+
+
+@pytest.mark.parametrize("extension", ["json", "npz"])
+def test_scenario_round_trip(tmp_path, extension):
+    bodies = with_particles(load_system("system4"))
+    path = str(tmp_path / f'system.{extension}')
+    save_scenario(path, bodies)
+    loaded, settings = load_scenario(path)
+    assert [body.name for body in loaded] == [body.name for body in bodies]
+    for name in ARRAYS:
+        assert np.array_equal(getattr(loaded, name), getattr(bodies, name)), name
+    assert np.array_equal(loaded.particles.positions, bodies.particles.positions)
+    assert np.array_equal(loaded.particles.velocities, bodies.particles.velocities)
+    assert not settings["accelerations"] and "integrator" not in settings
+
+
+@pytest.mark.parametrize("extension", ["json", "npz"])
+def test_checkpoint_carries_on(tmp_path, extension):
+    physics.collisions = "merge"
+    physics.softening = 1e6
+    physics.integrator = block_leapfrog()
+    expected = run(with_particles(load_system("system4")), 2 * STEPS)
+    expected_state = physics.integrator.checkpoint()
+
+    physics.integrator = block_leapfrog()
+    bodies = run(with_particles(load_system("system4")), STEPS)
+    path = str(tmp_path / f'checkpoint.{extension}')
+    save_scenario(path, bodies, STEPS * DT, DT, physics.integrator)
+    saved_state = physics.integrator.checkpoint()
+    physics.integrator = None
+    physics.collisions = "off"
+    physics.softening = 0.0
+
+    resumed, settings = load_scenario(path)
+    assert restore_settings(resumed, settings) == (STEPS * DT, DT)
+    assert type(physics.integrator) is block_leapfrog
+    assert physics.integrator.checkpoint() == saved_state
+    assert physics.collisions == "merge" and physics.softening == 1e6
+    assert np.array_equal(resumed.accelerations, bodies.accelerations)
+
+    run(resumed, STEPS)
+    for name in ARRAYS:
+        assert np.array_equal(getattr(resumed, name), getattr(expected, name)), name
+    assert np.array_equal(resumed.particles.positions, expected.particles.positions)
+    assert physics.integrator.checkpoint() == expected_state
@@ -0,0 +1,47 @@
+import csv
+
+from sweep import completed_runs, result_columns, sweep
+from systems import load_system
+
+# A resumed sweep keeps its finished runs and runs the failed and cut off ones again
+
+GRID = {"Moon.mass": [7e22, 7.3e22]}
+STEPS = 20
+DT = 1800
+
+
+def read(path):
+    with open(path, newline='') as file:
+        return list(csv.DictReader(file))
+
+
+def test_resume_runs_failed_and_cut_off_rows_again(tmp_path):
+    path = str(tmp_path / "sweep.csv")
+    columns = result_columns(list(GRID), [body.name for body in load_system("system3")])
+    with open(path, 'w', newline='') as file:
+        writer = csv.DictWriter(file, fieldnames=columns, restval="")
+        writer.writeheader()
+        writer.writerow({"run": 0, "Moon.mass": 7e22, "error": "MemoryError()"})
+        # Run 1 was being written when the sweep crashed
+        file.write("1,7.3e+22,3.4e-09")
+    assert completed_runs(path)[0] == set()
+
+    sweep("system3", STEPS, DT, path, grid=GRID, processes=1)
+    rows = read(path)
+    assert [row["run"] for row in rows] == ["0", "1"]
+    assert all(row["error"] == "" and row["energy_error"] for row in rows)
+    assert list(rows[0]) == columns
+    assert completed_runs(path) == ({0, 1}, columns, True)
+
+    # Everything finished, a second resume runs nothing and leaves the table as it is
+    before = open(path).read()
+    sweep("system3", STEPS, DT, path, grid=GRID, processes=1)
+    assert open(path).read() == before
+
+
+def test_failed_runs_leave_the_results_empty(tmp_path):
+    path = str(tmp_path / "sweep.csv")
+    sweep("system3", STEPS, DT, path, grid={"Nobody.mass": [1.0]}, processes=1)
+    rows = read(path)
+    assert len(rows) == 1 and "Nobody" in rows[0]["error"] and rows[0]["energy_error"] == ""
+    assert completed_runs(path)[0] == set()
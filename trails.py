@@ -0,0 +1,88 @@
+import numpy as np
+
+from gravity import DIMENSIONS
+
+# Trajectory trails for every body in one preallocated ring buffer, adding the newest point is
+# one array write for all the bodies instead of a list append and pop(0) for each of them
+
+# Points kept for each body
+TRAIL_LENGTH = 500
+# When drawing, trail points closer than this many pixels to the last point kept are skipped
+MIN_SEGMENT_PIXELS = 2.0
+
+
+class trail_buffer:
+    def __init__(self, bodies=0, length=TRAIL_LENGTH):
+        self.length = length
+        # Slot head is written next, so the oldest point of a full trail is at head
+        self.points = np.zeros((bodies, length, DIMENSIONS), dtype=float)
+        self.filled = np.zeros(bodies, dtype=int)
+        self.head = 0
+
+    def push(self, positions):
+        if len(positions) != len(self.points):
+            self._resize(len(positions))
+        self.points[:, self.head] = positions
+        self.head = (self.head + 1) % self.length
+        np.minimum(self.filled + 1, self.length, out=self.filled)
+
+    def _resize(self, n):
+        # New bodies start with an empty trail, fewer bodies means a different system so every trail restarts
+        if n > len(self.points):
+            extra = n - len(self.points)
+            self.points = np.concatenate([self.points, np.zeros((extra, self.length, DIMENSIONS))])
+            self.filled = np.concatenate([self.filled, np.zeros(extra, dtype=int)])
+        else:
+            self.points = np.zeros((n, self.length, DIMENSIONS), dtype=float)
+            self.filled = np.zeros(n, dtype=int)
+
+    def clear(self):
+        self.filled[:] = 0
+
+    def ordered(self, rows=None):
+        # Trails of the given bodies (all by default) oldest point first, shape (bodies, length, 3)
+        # Only the last filled[i] points of row i are real
+        order = (self.head + np.arange(self.length)) % self.length
+        points = self.points if rows is None else self.points[rows]
+        return points[:, order]
+
+    def bounds(self, rows):
+        # Lowest and highest corner of the points each trail really has
+        # Slot s holds the point written age[s] pushes ago, it is real if that is within filled
+        age = (self.head - 1 - np.arange(self.length)) % self.length
+        real = age < self.filled[rows, np.newaxis]
+        points = self.points[rows]
+        low = np.where(real[..., np.newaxis], points, np.inf).min(axis=1)
+        high = np.where(real[..., np.newaxis], points, -np.inf).max(axis=1)
+        return low, high
+
+    def screen_polylines(self, view, scale, center, rows=None, min_pixels=MIN_SEGMENT_PIXELS, viewport=None):
+        # Every trail projected to screen coordinates by the camera view in one go, with points that
+        # are closer than min_pixels along the trail to the last kept point dropped. Returns the body
+        # index and its points for every trail with at least two points left
+        # With a (width, height) viewport, trails that lie wholly outside it are left out
+        rows = np.arange(len(self.points)) if rows is None else np.asarray(rows)
+        rows = rows[self.filled[rows] >= 2]
+        if viewport is not None and len(rows):
+            # Cull with the bounding box of each trail before doing any more work on it
+            low, high = self.bounds(rows)
+            low, high = view.project_box(low, high, scale, center)
+            rows = rows[(high[:, 0] >= 0) & (low[:, 0] < viewport[0]) & (high[:, 1] >= 0) & (low[:, 1] < viewport[1])]
+        if len(rows) == 0:
+            return []
+        points = view.project(self.ordered(rows), scale, center)
+        filled = self.filled[rows]
+        real = np.arange(self.length) >= (self.length - filled)[:, np.newaxis]
+        # Distance along the trail on screen, a point is kept each time it passes another min_pixels
+        step = np.zeros(real.shape)
+        step[:, 1:] = np.hypot(*np.moveaxis(np.diff(points, axis=1), 2, 0))
+        step[~real] = 0.0
+        bucket = np.floor(np.cumsum(step, axis=1) / min_pixels)
+        keep = np.ones(real.shape, dtype=bool)
+        keep[:, 1:] = bucket[:, 1:] != bucket[:, :-1]
+        # Always keep the two ends
+        keep[np.arange(len(rows)), np.minimum(self.length - filled, self.length - 1)] = True
+        keep[:, -1] = True
+        keep &= real
+        return [(row, trail[mask]) for row, trail, mask, count in zip(rows, points, keep, keep.sum(axis=1))
+                if count >= 2]
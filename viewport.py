@@ -0,0 +1,121 @@
+import numpy as np
+
+# What is worth drawing this frame, worked out for every body at once so zoomed out views of
+# thousands of bodies only cost what ends up on screen. No pygame here, main.py does the drawing
+
+# Labels are placed on a grid of cells this many pixels wide, a label is merged into any label
+# already placed in one of its cells
+LABEL_CELL = 8
+
+
+def on_screen(screen_xy, radii, width, height):
+    # Bodies whose circle reaches into the width x height window
+    x, y = screen_xy[:, 0], screen_xy[:, 1]
+    return (x + radii >= 0) & (x - radii < width) & (y + radii >= 0) & (y - radii < height)
+
+
+def one_per_pixel(indices, pixel_xy, radii):
+    # Of the bodies in indices that land on the same pixel only the biggest is drawn, a crowd
+    # smaller than a pixel looks the same as one body
+    if len(indices) < 2:
+        return indices
+    indices = indices[np.argsort(-radii[indices], kind='stable')]
+    pixels = pixel_xy[indices].astype(np.int64)
+    keys = pixels[:, 0] * 2 ** 32 + pixels[:, 1]
+    first = np.unique(keys, return_index=True)[1]
+    return np.sort(indices[first])
+
+
+def segments_on_screen(begin_xy, end_xy, width, height):
+    # Lines whose bounding box touches the window
+    low = np.minimum(begin_xy, end_xy)
+    high = np.maximum(begin_xy, end_xy)
+    return (high[:, 0] >= 0) & (low[:, 0] < width) & (high[:, 1] >= 0) & (low[:, 1] < height)
+
+
+def place_labels(corners, sizes, priority, width, height):
+    # Labels go down in order of priority, highest first, at their top left corner with their
+    # (width, height) size. A label that would overlap one already placed is merged into it
+    # Returns which labels are placed and how many other labels were merged into each
+    columns, rows = -(-width // LABEL_CELL), -(-height // LABEL_CELL)
+    owner = np.full((columns, rows), -1)
+    placed = []
+    merged = []
+    limit = (columns, rows)
+    starts = np.clip(np.floor_divide(corners, LABEL_CELL), 0, limit).astype(int).tolist()
+    ends = np.clip(np.floor_divide(corners + sizes - 1, LABEL_CELL) + 1, 0, limit).astype(int).tolist()
+    for k in np.argsort(-priority, kind='stable').tolist():
+        (x0, y0), (x1, y1) = starts[k], ends[k]
+        if x0 >= x1 or y0 >= y1:
+            # Off screen
+            continue
+        region = owner[x0:x1, y0:y1]
+        taken = region[region >= 0]
+        if len(taken):
+            merged[taken[0]] += 1
+        else:
+            region[...] = len(placed)
+            placed.append(k)
+            merged.append(0)
+    return placed, merged
+
+
+# Cells of the picking grid are this many pixels wide
+PICK_CELL = 32
+# Bodies smaller than this many pixels can still be picked this far from their centre
+PICK_TOLERANCE = 3
+
+
+class screen_index:
+    # Uniform grid over the window of the bodies drawn this frame, built with one sort so it can be
+    # rebuilt every frame. Picking looks only at the few cells around the mouse
+    def __init__(self, screen_xy, radii, indices, width, height):
+        self.columns = -(-width // PICK_CELL)
+        self.rows = -(-height // PICK_CELL)
+        self.xy = screen_xy[indices]
+        # Half the side of each hit box, bodies are picked with the same square as before
+        self.reach = np.maximum(radii[indices].astype(int), PICK_TOLERANCE)
+        self.max_reach = int(self.reach.max(initial=0))
+        cells = self._cells(self.xy)
+        self.order = np.argsort(cells, kind='stable')
+        # Bodies in cell c are indices[order[start[c]:start[c + 1]]]
+        self.start = np.zeros(self.columns * self.rows + 1, dtype=int)
+        np.cumsum(np.bincount(cells, minlength=self.columns * self.rows), out=self.start[1:])
+        self.indices = np.asarray(indices)
+
+    def _cells(self, xy):
+        column = np.clip(xy[:, 0] // PICK_CELL, 0, self.columns - 1).astype(int)
+        row = np.clip(xy[:, 1] // PICK_CELL, 0, self.rows - 1).astype(int)
+        return column * self.rows + row
+
+    def _candidates(self, low, high):
+        # Positions in xy of every body in the cells covering the box from low to high
+        # Bodies off the edge are kept in the edge cells, so the box is clamped the same way
+        c0, c1 = (min(max(int(v // PICK_CELL), 0), self.columns - 1) for v in (low[0], high[0]))
+        r0, r1 = (min(max(int(v // PICK_CELL), 0), self.rows - 1) for v in (low[1], high[1]))
+        # Each column of cells is one run of the sorted order
+        runs = [self.order[self.start[c * self.rows + r0]:self.start[c * self.rows + r1 + 1]] for c in range(c0, c1 + 1)]
+        return np.concatenate(runs)
+
+    def pick(self, pos):
+        # The body whose hit box holds pos and whose centre is nearest to it, None if there is none
+        candidates = self._candidates((pos[0] - self.max_reach, pos[1] - self.max_reach),
+                                      (pos[0] + self.max_reach, pos[1] + self.max_reach))
+        offset = pos - self.xy[candidates]
+        reach = self.reach[candidates, np.newaxis]
+        # Same edges as Rect.collidepoint(), left/top inside and right/bottom outside
+        inside = np.all((offset >= -reach) & (offset < reach), axis=1)
+        candidates = candidates[inside]
+        if len(candidates) == 0:
+            return None
+        nearest = candidates[np.argmin(np.hypot(*(self.xy[candidates] - pos).T))]
+        return int(self.indices[nearest])
+
+    def in_box(self, corner, other_corner):
+        # Bodies with their centre in the box between the two corners, nearest to corner first
+        low, high = np.minimum(corner, other_corner), np.maximum(corner, other_corner)
+        candidates = self._candidates(low, high)
+        xy = self.xy[candidates]
+        candidates = candidates[np.all((xy >= low) & (xy <= high), axis=1)]
+        distance = np.hypot(*(self.xy[candidates] - corner).T)
+        return self.indices[candidates[np.argsort(distance, kind='stable')]]